@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+asyncio upload engine for high fan-out
+Compresses on a process pool and uploads as coroutines over one aiohttp
+session with a per-host connection limit, so a single process can keep
+hundreds of uploads in flight without a thread per upload.
+Without aiohttp installed, the HTTP calls run on a thread pool instead.
+"""
+import sys
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import upload_to_b2
+from upload_to_b2 import (B2_BUCKET_ID, B2_LARGE_FILE_THRESHOLD, b2_session, b2_upload_headers,
+                          cdn_url_for, compression_params_key, object_name, upload_file_info,
+                          normalize_renditions, resolve_profile, available_cpus, hash_bytes,
+                          lookup_dedup, record_dedup, with_result_metrics, _compress_job,
+                          _combine_renditions, _upload_prepared)
+from upload_metrics import metrics
+from upload_retry import (RetryableError, retryable_status, retryable_request_error, batch_retry_budget,
+                          run_with_budget, upload_retry_policy)
+
+# Uploads in flight at once, and connections per upload/API host
+DEFAULT_ASYNC_CONCURRENCY = int(os.environ.get('B2_ASYNC_CONCURRENCY', '64'))
+DEFAULT_PER_HOST_LIMIT = int(os.environ.get('B2_ASYNC_PER_HOST_LIMIT', '16'))
+ASYNC_UPLOAD_TIMEOUT = 60
+
+class AsyncUploader:
+    """Compress and upload many images from one event loop
+
+    Use as "async with AsyncUploader(...) as uploader" and await
+    uploader.upload_many(items). Single uploads go straight to the B2 API;
+    large files, and uploads the direct API fails on, are handed to the
+    regular blocking fallback chain on a worker thread.
+    """
+
+    def __init__(self, concurrency=DEFAULT_ASYNC_CONCURRENCY, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                 compress_workers=None, profile=None, target_bytes=None, renditions=None,
+                 content_addressed=None):
+        self.concurrency = max(1, concurrency)
+        self.per_host_limit = max(1, per_host_limit)
+        self.compress_workers = compress_workers or available_cpus()
+        self.profile = resolve_profile(profile)
+        self.target_bytes = target_bytes
+        renditions = renditions or upload_to_b2.DEFAULT_RENDITIONS
+        self.renditions = normalize_renditions(renditions) if renditions else None
+        self.params = compression_params_key(self.profile, target_bytes, self.renditions, content_addressed)
+        self._session = None
+        self._http_threads = None
+        self._compress_pool = None
+        self._blocking_threads = None
+        self._upload_slots = None
+        # Shared by every upload until the next upload_many() call
+        self.retry_budget = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """Open the HTTP session and the compression and fallback pools"""
+        if aiohttp is not None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host_limit)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=ASYNC_UPLOAD_TIMEOUT))
+        else:
+            print("aiohttp not installed, running async uploads on a thread pool", file=sys.stderr)
+            self._http_threads = ThreadPoolExecutor(max_workers=self.concurrency)
+        if self.compress_workers > 1:
+            self._compress_pool = ProcessPoolExecutor(max_workers=self.compress_workers)
+        self._blocking_threads = ThreadPoolExecutor(max_workers=min(self.concurrency, 16))
+        self._upload_slots = asyncio.Semaphore(self.concurrency)
+        # Every upload in flight hands an upload URL back to the pool - keep them all
+        pool = upload_to_b2.upload_url_pool
+        pool.pool_size = max(pool.pool_size, self.concurrency)
+
+    async def close(self):
+        """Close the session and shut the pools down"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        for executor in (self._http_threads, self._compress_pool, self._blocking_threads):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._http_threads = self._compress_pool = self._blocking_threads = None
+
+    async def _run_blocking(self, function, *args):
+        """Run a blocking call (hashing, SQLite, the fallback chain) off the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._blocking_threads, function, *args)
+
+    async def _post(self, url, headers, data=None, json_body=None):
+        """POST and return (status, parsed JSON body or text, Retry-After header)"""
+        if self._session is not None:
+            async with self._session.post(url, headers=headers, data=data, json=json_body) as response:
+                try:
+                    body = await response.json(content_type=None)
+                except ValueError:
+                    body = await response.text()
+                return response.status, body, response.headers.get('Retry-After')
+
+        def post():
+            response = b2_session.post(url, headers=headers, data=data, json=json_body,
+                                       timeout=ASYNC_UPLOAD_TIMEOUT)
+            retry_after = response.headers.get('Retry-After')
+            try:
+                return response.status_code, response.json(), retry_after
+            except ValueError:
+                return response.status_code, response.text, retry_after
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._http_threads, post)
+
+    async def _acquire_upload_url(self, timings):
+        """Take a pooled upload URL, or fetch a new one, re-authorizing once on 401"""
+        pool = upload_to_b2.upload_url_pool
+        pair = pool.take_idle()
+        if pair:
+            return pair
+        for attempt in range(2):
+            started = time.perf_counter()
+            auth_data = await self._run_blocking(pool.get_auth)
+            timings['auth'] = timings.get('auth', 0.0) + time.perf_counter() - started
+            started = time.perf_counter()
+            status, body, retry_after = await self._post(
+                f"{auth_data['apiUrl']}/b2api/v2/b2_get_upload_url",
+                {'Authorization': auth_data['authorizationToken']},
+                json_body={'bucketId': B2_BUCKET_ID})
+            elapsed = time.perf_counter() - started
+            timings['upload_url'] = timings.get('upload_url', 0.0) + elapsed
+            metrics.observe_stage('upload_url', elapsed)
+            if status == 401 and attempt == 0:
+                pool.invalidate_auth()
+                continue
+            if status >= 400:
+                error = retryable_status(status, body, {'Retry-After': retry_after})
+                raise error or Exception(f"Failed to get upload URL: B2 returned {status}: {body}")
+            return body['uploadUrl'], body['authorizationToken']
+
+    async def upload_direct(self, data, filename, content_type, file_info=None, timings=None):
+        """Upload bytes with one b2_upload_file call; returns (cdn_url, file_id, error)
+
+        Transient errors are retried with backoff like upload_direct_to_b2,
+        with a fresh upload URL after a 401/5xx or connection error.
+        """
+        timings = {} if timings is None else timings
+        pool = upload_to_b2.upload_url_pool
+
+        async def attempt(number):
+            try:
+                upload_url, auth_token = await self._acquire_upload_url(timings)
+            except RetryableError:
+                raise
+            except Exception as e:
+                raise retryable_request_error(e) or e
+            headers = b2_upload_headers(auth_token, filename, content_type, file_info)
+            started = time.perf_counter()
+            try:
+                status, body, retry_after = await self._post(upload_url, headers, data=data)
+            except Exception as e:
+                pool.discard(upload_url, auth_token)
+                raise RetryableError(str(e) or type(e).__name__)
+            finally:
+                elapsed = time.perf_counter() - started
+                timings['upload'] = timings.get('upload', 0.0) + elapsed
+                metrics.observe_stage('upload', elapsed)
+            error = retryable_status(status, body, {'Retry-After': retry_after})
+            if error:
+                # 429 only asks us to slow down - the URL itself is still good
+                if status == 429:
+                    pool.release(upload_url, auth_token)
+                else:
+                    pool.discard(upload_url, auth_token)
+                raise error
+            pool.release(upload_url, auth_token)
+            if status >= 400:
+                raise Exception(f"B2 returned {status}: {body}")
+            return body
+
+        try:
+            body = await upload_retry_policy.call_async(attempt, self.retry_budget)
+        except Exception as e:
+            return None, None, str(e)
+        return cdn_url_for(filename), body.get('fileId'), None
+
+    async def upload_prepared(self, data, filename, content_type, content_hash=None, timings=None):
+        """Upload compressed data; falls back to the blocking chain for large files and failures"""
+        timings = {} if timings is None else timings
+        size = len(data)
+        if size <= B2_LARGE_FILE_THRESHOLD:
+            file_info = upload_file_info(content_hash, self.params)
+            started = time.perf_counter()
+            async with self._upload_slots:
+                cdn_url, file_id, error = await self.upload_direct(data, filename, content_type,
+                                                                   file_info, timings)
+            metrics.observe_upload("direct_b2_api_async", cdn_url is not None,
+                                   time.perf_counter() - started, size)
+            if cdn_url:
+                return {
+                    "success": True,
+                    "url": cdn_url,
+                    "filename": filename,
+                    "file_id": file_id,
+                    "method": "direct_b2_api_async",
+                    "bytes_out": size
+                }
+            print(f"Async upload of {filename} failed ({error}), using the fallback chain",
+                  file=sys.stderr)
+
+        started = time.perf_counter()
+        async with self._upload_slots:
+            result = await self._run_blocking(run_with_budget, self.retry_budget, _upload_prepared,
+                                              data, filename, content_type, content_hash, self.params)
+        timings['upload'] = timings.get('upload', 0.0) + time.perf_counter() - started
+        return result
+
+    async def _compress(self, data, filename, content_type):
+        """Compress on the process pool; returns (prepared, timings)"""
+        loop = asyncio.get_running_loop()
+        executor = self._compress_pool or self._blocking_threads
+        _, prepared, timings = await loop.run_in_executor(
+            executor, _compress_job, 0, data, filename, content_type,
+            self.profile, self.target_bytes, self.renditions)
+        if self._compress_pool is not None:
+            # Stage histograms live in this process, not the worker's
+            for stage, seconds in timings.items():
+                metrics.observe_stage(stage, seconds)
+        return prepared, dict(timings)
+
+    async def upload_image(self, image_data, filename, content_type):
+        """Deduplicate, compress and upload one image; returns an upload_image-style result"""
+        timings = {}
+        started = time.perf_counter()
+        try:
+            content_hash = await self._run_blocking(hash_bytes, image_data)
+            timings['hash'] = time.perf_counter() - started
+            cached = await self._run_blocking(lookup_dedup, content_hash, self.params, self.renditions)
+            if cached:
+                result = cached
+            else:
+                filename = object_name(filename, content_hash, self.params)
+                prepared, compress_timings = await self._compress(image_data, filename, content_type)
+                for stage, seconds in compress_timings.items():
+                    timings[stage] = timings.get(stage, 0.0) + seconds
+
+                if self.renditions:
+                    uploads = await asyncio.gather(*(
+                        self.upload_prepared(data, name, rendition_type,
+                                             content_hash if position == 0 else None, timings)
+                        for position, (size, data, name, rendition_type) in enumerate(prepared)
+                    ))
+                    result = await self._run_blocking(_combine_renditions, prepared, list(uploads),
+                                                      content_hash, self.params)
+                else:
+                    data, name, prepared_type = prepared
+                    result = await self.upload_prepared(data, name, prepared_type, content_hash, timings)
+                    await self._run_blocking(record_dedup, content_hash, result, self.params)
+        except Exception as e:
+            result = {
+                "success": False,
+                "error": str(e)
+            }
+        timings['total'] = time.perf_counter() - started
+        return with_result_metrics(result, timings, len(image_data))
+
+    async def upload_many(self, items):
+        """Upload (image_data, filename, content_type) items; results come back in input order"""
+        items = list(items)
+        self.retry_budget = batch_retry_budget(len(items))
+        return list(await asyncio.gather(*(
+            self.upload_image(image_data, filename, content_type)
+            for image_data, filename, content_type in items
+        )))
+
+async def upload_many(items, concurrency=DEFAULT_ASYNC_CONCURRENCY, **options):
+    """Upload many images with at most concurrency uploads in flight
+
+    options are passed to AsyncUploader (per_host_limit, compress_workers,
+    profile, target_bytes, renditions, content_addressed).
+    """
+    async with AsyncUploader(concurrency, **options) as uploader:
+        return await uploader.upload_many(items)
+
+def upload_many_blocking(items, concurrency=DEFAULT_ASYNC_CONCURRENCY, **options):
+    """Run upload_many on a fresh event loop, for callers that aren't async"""
+    return asyncio.run(upload_many(items, concurrency, **options))
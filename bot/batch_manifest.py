@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Durable manifests for upload batches
+Every batch records its files, their hashes, per-file state and resulting URLs,
+plus the Google Sheets rows still to be written, so an interrupted batch can
+be resumed without uploading completed files again
+"""
+import os
+import json
+import time
+import uuid
+import threading
+
+# Where batch manifests are kept
+BATCH_DIR = os.environ.get(
+    'IMAGE_UPLOADER_BATCH_DIR',
+    os.path.join(os.path.expanduser('~'), '.image_uploader', 'batches')
+)
+
+# Per-file states
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# Sheet row states
+ROW_PENDING = 'pending'
+ROW_WRITTEN = 'written'
+
+class BatchManifest:
+    """JSON manifest of one upload batch, rewritten atomically after every change"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, image_paths, batch_dir=BATCH_DIR):
+        """Start a manifest for a new batch of files"""
+        os.makedirs(batch_dir, exist_ok=True)
+        batch_id = time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        data = {
+            'batch_id': batch_id,
+            'created_at': time.time(),
+            'files': [
+                {
+                    'path': os.path.abspath(image_path),
+                    'filename': os.path.basename(image_path),
+                    'sha256': None,
+                    'state': PENDING
+                }
+                for image_path in image_paths
+            ],
+            'sheet_rows': []
+        }
+        manifest = cls(os.path.join(batch_dir, f"batch-{batch_id}.json"), data)
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, path):
+        """Open an existing manifest"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(path, json.load(f))
+
+    @property
+    def batch_id(self):
+        return self.data['batch_id']
+
+    @property
+    def files(self):
+        return self.data['files']
+
+    def save(self):
+        """Write the manifest to disk (temp file + rename, so a crash never leaves half a file)"""
+        with self._lock:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+
+    def image_paths(self):
+        """Paths of all files in the batch, in selection order"""
+        return [entry['path'] for entry in self.files]
+
+    def pending_indexes(self):
+        """Indexes of files that still need uploading (pending or failed)"""
+        return [i for i, entry in enumerate(self.files) if entry['state'] != DONE]
+
+    def record_result(self, index, result):
+        """Store the outcome of uploading file number index"""
+        entry = self.files[index]
+        with self._lock:
+            if result.get('sha256'):
+                entry['sha256'] = result['sha256']
+            if result['status'] == 'success':
+                entry.update(state=DONE, public_url=result['public_url'],
+                             file_id=result.get('file_id'), error=None)
+            else:
+                entry.update(state=FAILED, error=result.get('error'))
+        self.save()
+
+    def result_for(self, index):
+        """Stored upload result of a completed file (same shape as the uploader's), else None"""
+        entry = self.files[index]
+        if entry['state'] != DONE:
+            return None
+        return {
+            'filename': entry['filename'],
+            'file_id': entry.get('file_id'),
+            'public_url': entry['public_url'],
+            'sha256': entry.get('sha256'),
+            'status': 'success'
+        }
+
+    def add_sheet_row(self, row_data):
+        """Record a row before it is sent to Google Sheets; returns its index"""
+        with self._lock:
+            self.data['sheet_rows'].append({'row': list(row_data), 'state': ROW_PENDING})
+            index = len(self.data['sheet_rows']) - 1
+        self.save()
+        return index
+
+    def update_sheet_row(self, index, row_data):
+        """Replace a pending row that is about to be sent again"""
+        with self._lock:
+            self.data['sheet_rows'][index]['row'] = list(row_data)
+        self.save()
+
+    def mark_sheet_row_written(self, index):
+        """Record that a sheet row has been written"""
+        with self._lock:
+            self.data['sheet_rows'][index]['state'] = ROW_WRITTEN
+        self.save()
+
+    def pending_sheet_rows(self):
+        """(index, row) for sheet rows that were never confirmed as written"""
+        return [
+            (i, entry['row'])
+            for i, entry in enumerate(self.data['sheet_rows'])
+            if entry['state'] == ROW_PENDING
+        ]
+
+    def is_complete(self):
+        """True when every file is uploaded and every sheet row is written"""
+        return not self.pending_indexes() and not self.pending_sheet_rows()
+
+def find_incomplete_manifests(batch_dir=BATCH_DIR):
+    """Paths of manifests with unfinished files or sheet rows, newest first"""
+    if not os.path.isdir(batch_dir):
+        return []
+    paths = sorted(
+        (os.path.join(batch_dir, name) for name in os.listdir(batch_dir)
+         if name.startswith('batch-') and name.endswith('.json')),
+        key=os.path.getmtime, reverse=True
+    )
+    incomplete = []
+    for path in paths:
+        try:
+            if not BatchManifest.load(path).is_complete():
+                incomplete.append(path)
+        except (OSError, ValueError, KeyError):
+            continue
+    return incomplete
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Headless batch upload to Backblaze B2 and Google Sheets
+Runs the same upload -> sheet row flow as the GUI (UploadPipeline) for
+directories and glob patterns, and prints the batch manifest as JSON, so bulk
+imports can run unattended on servers without a display
+"""
+import sys
+import os
+import glob
+import json
+
+from upload_pipeline import (UploadPipeline, DEFAULT_UPLOAD_CONCURRENCY, MAX_UPLOAD_CONCURRENCY,
+                             SERVICE_ACCOUNT_FILE, SHEET_CATEGORIES, sheet_row)
+from batch_manifest import BatchManifest
+from image_probe import IMAGE_EXTENSIONS
+
+def find_images(inputs, recursive=False):
+    """Expand files, directories and glob patterns into image paths
+
+    Directories contribute the image files in them (sorted, recursively with
+    recursive=True); files named explicitly are taken whatever their
+    extension. Each path is listed once, in the order first found.
+    """
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            if recursive:
+                found = [os.path.join(directory, name)
+                         for directory, _, names in os.walk(entry) for name in names]
+            else:
+                found = [os.path.join(entry, name) for name in os.listdir(entry)]
+            paths.extend(sorted(path for path in found
+                                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)))
+        elif glob.has_magic(entry):
+            paths.extend(sorted(path for path in glob.glob(entry, recursive=True)
+                                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)))
+        elif os.path.isfile(entry):
+            paths.append(entry)
+        else:
+            print(f"No such file or directory: {entry}", file=sys.stderr)
+
+    unique = []
+    seen = set()
+    for path in paths:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+def parse_shard(text):
+    """Parse "N/M" (1-based) into (N - 1, M)"""
+    try:
+        number, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"invalid shard {text!r}, expected N/M")
+    if count < 1 or not 1 <= number <= count:
+        raise ValueError(f"invalid shard {text!r}, expected 1 <= N <= M")
+    return number - 1, count
+
+def run_batch(image_paths, metadata=None, concurrency=DEFAULT_UPLOAD_CONCURRENCY,
+              service_account_file=SERVICE_ACCOUNT_FILE, content_addressed=None):
+    """Upload image_paths and, with metadata, append one sheet row for them
+
+    metadata holds the sheet fields (title, content, category, author,
+    caption, is_album). Returns the JSON-serializable batch summary.
+    """
+    pipeline = UploadPipeline(service_account_file)
+    if content_addressed is not None:
+        pipeline.content_addressed = content_addressed
+    pipeline.connect_b2()
+    if metadata is not None and pipeline.connect_sheets() is None:
+        raise Exception(f"Google Sheets unavailable: service account file {service_account_file} not found")
+
+    manifest = BatchManifest.create(image_paths)
+
+    def on_progress(completed, total):
+        print(f"Uploaded {completed}/{total}", file=sys.stderr)
+
+    results = pipeline.upload_files(image_paths, concurrency, on_progress, manifest)
+    successful = [result for result in results if result['status'] == 'success']
+    failed = len(results) - len(successful)
+
+    row = None
+    sheet_error = None
+    if metadata is not None and successful:
+        row = sheet_row(successful, metadata['title'], metadata['content'], metadata['category'],
+                        metadata['author'], metadata.get('caption', ""), metadata.get('is_album', True))
+        try:
+            pipeline.add_rows([row], manifest=manifest)
+        except Exception as e:
+            # The row stays pending in the manifest - "image_uploader.py --resume" writes it
+            sheet_error = str(e)
+
+    summary = {
+        "success": not failed and sheet_error is None and manifest.is_complete(),
+        "batch_id": manifest.batch_id,
+        "manifest": manifest.path,
+        "uploaded": len(successful),
+        "failed": failed,
+        "sheet_row": row,
+        "results": results
+    }
+    if sheet_error:
+        summary["sheet_error"] = sheet_error
+    return summary
+
+def main(argv=None):
+    """Command line entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Upload images to Backblaze B2 and add them to Google Sheets, without the GUI")
+    parser.add_argument('inputs', nargs='+', help="image files, directories or glob patterns")
+    parser.add_argument('--recursive', action='store_true', help="include subdirectories of directories")
+    parser.add_argument('--title', help="post title (required unless --no-sheet)")
+    parser.add_argument('--content', help="post content (required unless --no-sheet)")
+    parser.add_argument('--category', choices=SHEET_CATEGORIES, default=SHEET_CATEGORIES[0],
+                        help="post category")
+    parser.add_argument('--author', help="post author (required unless --no-sheet)")
+    parser.add_argument('--caption', default="", help="post caption")
+    parser.add_argument('--is-album', dest='is_album', action='store_true', default=True,
+                        help="mark the post as an album (default)")
+    parser.add_argument('--not-album', dest='is_album', action='store_false',
+                        help="don't mark the post as an album")
+    parser.add_argument('--no-sheet', action='store_true', help="only upload, don't write a sheet row")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_UPLOAD_CONCURRENCY,
+                        help="files uploaded at once")
+    parser.add_argument('--shard', help="only upload part N of M of the files (e.g. 2/4), "
+                                        "to split one import across machines (needs --no-sheet)")
+    parser.add_argument('--content-addressed', action='store_true',
+                        help="name objects by content hash and mark them immutable for caching")
+    parser.add_argument('--service-account', default=SERVICE_ACCOUNT_FILE,
+                        help="Google service account JSON file")
+    args = parser.parse_args(argv)
+
+    metadata = None
+    if not args.no_sheet:
+        missing = [name for name in ('title', 'content', 'author') if not (getattr(args, name) or "").strip()]
+        if missing:
+            parser.error(f"--{', --'.join(missing)} required (or use --no-sheet)")
+        metadata = {
+            'title': args.title.strip(),
+            'content': args.content.strip(),
+            'category': args.category,
+            'author': args.author.strip(),
+            'caption': args.caption.strip(),
+            'is_album': args.is_album
+        }
+
+    image_paths = find_images(args.inputs, args.recursive)
+    if args.shard:
+        if metadata is not None:
+            # Each shard would write its own row holding only its part of the images
+            parser.error("--shard would split the post into one sheet row per shard; "
+                         "use it with --no-sheet")
+        try:
+            shard, shards = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        image_paths = image_paths[shard::shards]
+    if not image_paths:
+        print(json.dumps({"success": False, "error": "no images found"}))
+        return 1
+
+    concurrency = max(1, min(args.concurrency, MAX_UPLOAD_CONCURRENCY))
+    try:
+        summary = run_batch(image_paths, metadata, concurrency, args.service_account,
+                            args.content_addressed or None)
+    except Exception as e:
+        print(json.dumps({"success": False, "error": str(e)}))
+        return 1
+    print(json.dumps(summary, indent=2))
+    return 0 if summary['success'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Offline upload benchmark against a local stand-in for the B2 v2 API
+Runs a fake B2 server with configurable latency, bandwidth and error
+injection, drives the upload paths of upload_to_b2.py against it at
+several concurrencies and file sizes, and prints the results as JSON
+"""
+import sys
+import os
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import threading
+from io import BytesIO
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+# Keep benchmark runs away from the real auth cache, and upload every file
+# instead of answering repeats from the dedup index
+os.environ['B2_AUTH_CACHE_FILE'] = ''
+os.environ['B2_DEDUP_INDEX'] = ''
+
+import upload_to_b2
+
+TARGETS = ('direct', 'large_file', 'b2sdk', 'upload_image')
+DEFAULT_TARGETS = ('direct', 'upload_image')
+DEFAULT_CONCURRENCY = (1, 4, 16)
+DEFAULT_SIZES = ('64K', '1M', '4M')
+DEFAULT_FILES = 32
+
+class FakeB2Handler(BaseHTTPRequestHandler):
+    """Answers the B2 v2 calls the uploader makes"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, code, message):
+        self._send_json(status, {'status': status, 'code': code, 'message': message})
+
+    def _read_body(self):
+        """Read the request body, throttled to the configured bandwidth"""
+        remaining = int(self.headers.get('Content-Length', 0))
+        bandwidth = self.server.bandwidth
+        digest = hashlib.sha1()
+        size = 0
+        started = time.time()
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 256 * 1024))
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            remaining -= len(chunk)
+            if bandwidth:
+                # Sleep until this many bytes would have arrived at the configured rate
+                delay = size / bandwidth - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        return size, digest.hexdigest()
+
+    def _authorized(self):
+        if self.headers.get('Authorization') != self.server.auth_token:
+            self._send_error(401, 'expired_auth_token', 'Authorization token has expired')
+            return False
+        return True
+
+    def _authorize_account(self):
+        base = self.server.base_url
+        allowed = {
+            'bucketId': upload_to_b2.B2_BUCKET_ID,
+            'bucketName': 'benchmark',
+            'capabilities': ['listBuckets', 'listFiles', 'readFiles', 'writeFiles'],
+            'namePrefix': None
+        }
+        storage_api = {
+            'apiUrl': base,
+            'downloadUrl': base,
+            's3ApiUrl': base,
+            'recommendedPartSize': upload_to_b2.B2_LARGE_FILE_PART_SIZE,
+            'absoluteMinimumPartSize': upload_to_b2.B2_MIN_PART_SIZE
+        }
+        # v2 layout for the direct uploader, plus the v3 apiInfo layout newer b2sdk releases read
+        self._send_json(200, dict(storage_api, **{
+            'accountId': upload_to_b2.B2_ACCOUNT_ID,
+            'authorizationToken': self.server.auth_token,
+            'allowed': allowed,
+            'apiInfo': {'storageApi': dict(storage_api, infoType='storageApi', **allowed)}
+        }))
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.path.endswith('/b2_authorize_account'):
+            self._authorize_account()
+        else:
+            self._send_error(404, 'not_found', self.path)
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        path = self.path
+        if path.endswith('/b2_authorize_account'):
+            self._authorize_account()
+            return
+
+        # Uploads carry their own (upload URL) token; everything else needs the account token
+        if path.startswith('/upload/') or path.startswith('/upload_part/'):
+            size, sha1 = self._read_body()
+            if random.random() < self.server.error_rate:
+                self._send_error(503, 'service_unavailable', 'injected error')
+                return
+            if path.startswith('/upload_part/'):
+                self._send_json(200, {
+                    'fileId': self.headers.get('Authorization', '').split(':', 1)[-1],
+                    'partNumber': int(self.headers.get('X-Bz-Part-Number', 0)),
+                    'contentLength': size,
+                    'contentSha1': sha1
+                })
+                return
+            self._send_json(200, self.server.file_record(
+                self.headers.get('X-Bz-File-Name', ''), size, sha1,
+                self.headers.get('Content-Type', 'b2/x-auto')))
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not self._authorized():
+            return
+        endpoint = path.rsplit('/', 1)[-1]
+        base = self.server.base_url
+
+        if endpoint == 'b2_get_upload_url':
+            self._send_json(200, {
+                'bucketId': body.get('bucketId'),
+                'uploadUrl': f"{base}/upload/{uuid.uuid4().hex}",
+                'authorizationToken': f"upload-{uuid.uuid4().hex}"
+            })
+        elif endpoint == 'b2_start_large_file':
+            record = self.server.file_record(body.get('fileName', ''), 0, 'none',
+                                             body.get('contentType', 'b2/x-auto'))
+            record['action'] = 'start'
+            self._send_json(200, record)
+        elif endpoint == 'b2_get_upload_part_url':
+            # The part token carries the file id so the part response can echo it
+            self._send_json(200, {
+                'fileId': body.get('fileId'),
+                'uploadUrl': f"{base}/upload_part/{uuid.uuid4().hex}",
+                'authorizationToken': f"part:{body.get('fileId')}"
+            })
+        elif endpoint == 'b2_finish_large_file':
+            self._send_json(200, self.server.file_record(
+                '', 0, 'none', 'b2/x-auto', file_id=body.get('fileId')))
+        elif endpoint == 'b2_cancel_large_file':
+            self._send_json(200, {'fileId': body.get('fileId')})
+        elif endpoint == 'b2_list_file_names':
+            self._send_json(200, {'files': [], 'nextFileName': None})
+        else:
+            self._send_error(400, 'bad_request', f"unsupported endpoint {endpoint}")
+
+class FakeB2Server(ThreadingHTTPServer):
+    """Local B2 v2 API stand-in
+
+    latency is added to every request (seconds), bandwidth throttles request
+    bodies (bytes per second, 0 for unlimited) and error_rate is the chance
+    that an upload is answered with a 503.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, bandwidth=0, error_rate=0.0, port=0):
+        super().__init__(('127.0.0.1', port), FakeB2Handler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.auth_token = f"account-{uuid.uuid4().hex}"
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+        self._thread = None
+
+    def file_record(self, file_name, size, sha1, content_type, file_id=None):
+        return {
+            'accountId': upload_to_b2.B2_ACCOUNT_ID,
+            'action': 'upload',
+            'bucketId': upload_to_b2.B2_BUCKET_ID,
+            'contentLength': size,
+            'contentSha1': sha1,
+            'contentType': content_type,
+            'fileId': file_id or f"4_z{uuid.uuid4().hex}",
+            'fileInfo': {},
+            'fileName': file_name,
+            'fileRetention': {'isClientAuthorizedToRead': False, 'value': None},
+            'legalHold': {'isClientAuthorizedToRead': False, 'value': None},
+            'serverSideEncryption': {'mode': None},
+            'uploadTimestamp': int(time.time() * 1000)
+        }
+
+    def start(self):
+        """Serve from a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+@contextmanager
+def use_server(server):
+    """Point upload_to_b2 at the fake server with fresh auth, URL pool and b2sdk client
+
+    rclone is switched off (it uploads to the real remote) and the real
+    credentials are replaced, so nothing in the block can reach production.
+    Everything is restored on exit.
+    """
+    names = ('B2_API_URL', 'B2_ACCOUNT_ID', 'B2_APPLICATION_KEY', 'upload_url_pool',
+             '_b2sdk_bucket', 'backend_selector', '_rclone_available')
+    saved = {name: getattr(upload_to_b2, name) for name in names}
+    upload_to_b2.B2_API_URL = server.base_url
+    upload_to_b2.B2_ACCOUNT_ID = 'benchmark-account'
+    upload_to_b2.B2_APPLICATION_KEY = 'benchmark-key'
+    upload_to_b2.upload_url_pool = upload_to_b2.B2UploadUrlPool(cache_file=None)
+    upload_to_b2._b2sdk_bucket = None
+    upload_to_b2.backend_selector = upload_to_b2.BackendSelector()
+    upload_to_b2._rclone_available = False
+    try:
+        yield server
+    finally:
+        for name, value in saved.items():
+            setattr(upload_to_b2, name, value)
+
+def parse_size(text):
+    """Parse a byte count such as 65536, 64K, 4M or 1G"""
+    text = str(text).strip().upper()
+    for suffix, factor in (('K', 1024), ('M', 1024 ** 2), ('G', 1024 ** 3)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+def make_payload(size, target):
+    """Random bytes of the given size, or for upload_image a noise JPEG of about size raw pixel bytes"""
+    if target != 'upload_image':
+        return os.urandom(size), 'application/octet-stream', 'bin'
+    from PIL import Image
+    side = max(16, int((size / 3) ** 0.5))
+    img = Image.frombytes('RGB', (side, side), os.urandom(side * side * 3))
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=90)
+    return output.getvalue(), 'image/jpeg', 'jpg'
+
+def upload_once(target, data, filename, content_type):
+    """Run one upload through the chosen path; returns (success, method, error)"""
+    if target == 'direct':
+        url, error = upload_to_b2.upload_direct_to_b2(data, filename, content_type)
+        return url is not None, 'direct_b2_api', error
+    if target == 'large_file':
+        url, error = upload_to_b2.upload_large_file_to_b2(data, filename, content_type)
+        return url is not None, 'b2_large_file', error
+    if target == 'b2sdk':
+        url, error = upload_to_b2.upload_with_b2sdk_optimized(data, filename, content_type)
+        return url is not None, 'b2sdk', error
+    result = upload_to_b2.upload_image(data, filename, content_type)
+    return result['success'], result.get('method'), result.get('error')
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+def run_scenario(target, concurrency, size, files):
+    """Upload `files` payloads of one size at one concurrency and summarize it"""
+    data, content_type, extension = make_payload(size, target)
+    latencies = []
+    methods = {}
+    errors = []
+    lock = threading.Lock()
+
+    def one(number):
+        filename = f"bench/{target}-{size}-{concurrency}-{number}.{extension}"
+        started = time.perf_counter()
+        try:
+            success, method, error = upload_once(target, data, filename, content_type)
+        except Exception as e:
+            success, method, error = False, None, str(e)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if success:
+                methods[method] = methods.get(method, 0) + 1
+            else:
+                errors.append(error)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(files)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    succeeded = files - len(errors)
+    return {
+        'target': target,
+        'concurrency': concurrency,
+        'size': size,
+        'files': files,
+        'succeeded': succeeded,
+        'failed': len(errors),
+        'seconds': round(wall, 4),
+        'files_per_s': round(succeeded / wall, 2) if wall else None,
+        'mb_per_s': round(succeeded * len(data) / wall / (1024 * 1024), 3) if wall else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2)
+        },
+        'methods': methods,
+        'errors': errors[:5]
+    }
+
+def scenario_key(scenario):
+    return f"{scenario['target']}:{scenario['size']}:{scenario['concurrency']}"
+
+def compare_with_baseline(report, baseline, tolerance):
+    """Scenarios whose files/s dropped more than tolerance (a fraction) below the baseline"""
+    previous = {scenario_key(s): s for s in baseline.get('scenarios', [])}
+    regressions = []
+    for scenario in report['scenarios']:
+        before = previous.get(scenario_key(scenario))
+        if not before or not before.get('files_per_s') or scenario['files_per_s'] is None:
+            continue
+        change = scenario['files_per_s'] / before['files_per_s'] - 1
+        if change < -tolerance:
+            regressions.append({
+                'scenario': scenario_key(scenario),
+                'baseline_files_per_s': before['files_per_s'],
+                'files_per_s': scenario['files_per_s'],
+                'change': round(change, 3)
+            })
+    return regressions
+
+def run_benchmark(targets=DEFAULT_TARGETS, concurrencies=DEFAULT_CONCURRENCY, sizes=DEFAULT_SIZES,
+                  files=DEFAULT_FILES, latency=0.0, bandwidth=0, error_rate=0.0):
+    """Start a fake B2 server, run every scenario against it and return the report"""
+    server = FakeB2Server(latency=latency, bandwidth=bandwidth, error_rate=error_rate).start()
+    try:
+        with use_server(server):
+            scenarios = []
+            for target in targets:
+                for size in sizes:
+                    for concurrency in concurrencies:
+                        print(f"Benchmarking {target}, {size} bytes, concurrency {concurrency}",
+                              file=sys.stderr)
+                        scenarios.append(run_scenario(target, concurrency, parse_size(size), files))
+    finally:
+        server.stop()
+
+    return {
+        'created_at': time.time(),
+        'server': {'latency': latency, 'bandwidth': bandwidth, 'error_rate': error_rate},
+        'scenarios': scenarios
+    }
+
+def main(argv=None):
+    """Command line entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark B2 uploads against a local fake B2 server")
+    parser.add_argument('--targets', default=','.join(DEFAULT_TARGETS),
+                        help=f"comma separated, any of {', '.join(TARGETS)}")
+    parser.add_argument('--concurrency', default=','.join(str(c) for c in DEFAULT_CONCURRENCY),
+                        help="comma separated concurrency levels")
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help="comma separated file sizes (e.g. 64K,1M,20M)")
+    parser.add_argument('--files', type=int, default=DEFAULT_FILES,
+                        help="uploads per scenario")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="added server latency per request, in milliseconds")
+    parser.add_argument('--bandwidth', type=float, default=0.0,
+                        help="server receive bandwidth per connection in MB/s (0 = unlimited)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of uploads answered with a 503")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    parser.add_argument('--baseline', help="earlier JSON report to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="allowed files/s drop against the baseline (fraction)")
+    args = parser.parse_args(argv)
+
+    targets = [t.strip() for t in args.targets.split(',') if t.strip()]
+    unknown = [t for t in targets if t not in TARGETS]
+    if unknown:
+        parser.error(f"unknown target(s): {', '.join(unknown)}")
+
+    report = run_benchmark(
+        targets=targets,
+        concurrencies=[int(c) for c in args.concurrency.split(',')],
+        sizes=[s.strip() for s in args.sizes.split(',')],
+        files=args.files,
+        latency=args.latency / 1000,
+        bandwidth=int(args.bandwidth * 1024 * 1024),
+        error_rate=args.error_rate
+    )
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            report['regressions'] = compare_with_baseline(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    print(output)
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Local content-hash index of images already uploaded to Backblaze B2
+Maps (source SHA-256, compression parameters) to the B2 file and CDN URL
+so identical images are never compressed or uploaded twice
+"""
+import sys
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+
+# Index location - set B2_DEDUP_INDEX to an empty string to disable deduplication
+DEDUP_INDEX_FILE = os.environ.get(
+    'B2_DEDUP_INDEX',
+    os.path.join(os.path.expanduser('~'), '.b2_upload_index.sqlite3')
+)
+
+# B2 file info keys written on upload so the index can be rebuilt from the bucket
+SOURCE_HASH_INFO_KEY = 'src_sha256'
+PARAMS_INFO_KEY = 'upload_params'
+
+# Parameters key for files uploaded unmodified (no compression)
+ORIGINAL_UPLOAD_PARAMS = 'original'
+
+# Name objects after their content instead of the uploaded file's name (B2_CONTENT_ADDRESSED=1)
+CONTENT_ADDRESSED = os.environ.get('B2_CONTENT_ADDRESSED', '').lower() in ('1', 'true', 'yes')
+CONTENT_ADDRESSED_PARAMS_SUFFIX = ':content-addressed'
+
+# A content-addressed URL never points at other bytes, so it can be cached forever
+CACHE_CONTROL_INFO_KEY = 'b2-cache-control'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def hash_bytes(data):
+    """SHA-256 hex digest of in-memory image data"""
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def content_addressed_params(params):
+    """Parameters key of the same upload with content-addressed names"""
+    if params.endswith(CONTENT_ADDRESSED_PARAMS_SUFFIX):
+        return params
+    return params + CONTENT_ADDRESSED_PARAMS_SUFFIX
+
+def is_content_addressed(params):
+    """Whether a parameters key asks for content-addressed names"""
+    return bool(params) and params.endswith(CONTENT_ADDRESSED_PARAMS_SUFFIX)
+
+def content_addressed_name(filename, content_hash, params):
+    """Object name derived from the source hash and upload parameters, keeping the extension
+
+    The same source uploaded with other settings gets another name, so a
+    name always refers to the same bytes.
+    """
+    digest = hashlib.sha256(f"{content_hash}|{params}".encode('utf-8')).hexdigest()[:32]
+    extension = os.path.splitext(filename)[1].lower()
+    return f"{digest}{extension}"
+
+class DedupIndex:
+    """SQLite-backed map of source hash + parameters to uploaded B2 files"""
+
+    def __init__(self, path=DEDUP_INDEX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                " content_hash TEXT NOT NULL,"
+                " params TEXT NOT NULL,"
+                " file_id TEXT,"
+                " file_name TEXT NOT NULL,"
+                " url TEXT NOT NULL,"
+                " uploaded_at REAL NOT NULL,"
+                " PRIMARY KEY (content_hash, params))"
+            )
+
+    def lookup(self, content_hash, params):
+        """Return the recorded upload as a dict, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id, file_name, url FROM uploads WHERE content_hash = ? AND params = ?",
+                (content_hash, params)
+            ).fetchone()
+        if not row:
+            return None
+        return {'file_id': row[0], 'file_name': row[1], 'url': row[2]}
+
+    def record(self, content_hash, params, file_name, url, file_id=None):
+        """Remember a successful upload
+
+        An upload replaces whatever was stored under file_name before, so
+        entries for other content under the same name are dropped.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM uploads WHERE file_name = ? AND NOT (content_hash = ? AND params = ?)",
+                (file_name, content_hash, params)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, params, file_id, file_name, url, time.time())
+            )
+
+    def forget(self, content_hash, params):
+        """Drop one entry (e.g. after the B2 file was deleted)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM uploads WHERE content_hash = ? AND params = ?",
+                (content_hash, params)
+            )
+
+    def entries(self):
+        """All entries as (content_hash, params, file_id, file_name, url) tuples"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT content_hash, params, file_id, file_name, url FROM uploads"
+            ).fetchall()
+
+    def sync_with_bucket(self, bucket_files, url_for_name, rebuild=False):
+        """Verify the index against a bucket listing, optionally rebuilding it
+
+        bucket_files yields (file_name, file_id, file_info) for the latest
+        version of every file in the bucket. Entries whose file is gone or
+        was overwritten are removed. With rebuild=True, entries are (re)created
+        from the src_sha256/upload_params file info stored at upload time.
+        Returns a summary dict of the changes.
+        """
+        latest = {}
+        for file_name, file_id, file_info in bucket_files:
+            latest[file_name] = (file_id, file_info or {})
+
+        removed = 0
+        for content_hash, params, file_id, file_name, url in self.entries():
+            current = latest.get(file_name)
+            if current is None or (file_id and current[0] != file_id):
+                self.forget(content_hash, params)
+                removed += 1
+
+        added = 0
+        if rebuild:
+            for file_name, (file_id, file_info) in latest.items():
+                content_hash = file_info.get(SOURCE_HASH_INFO_KEY)
+                params = file_info.get(PARAMS_INFO_KEY)
+                if not content_hash or not params:
+                    continue
+                existing = self.lookup(content_hash, params)
+                if existing and existing['file_id'] == file_id:
+                    continue
+                self.record(content_hash, params, file_name, url_for_name(file_name), file_id)
+                added += 1
+
+        return {'checked': len(latest), 'removed': removed, 'added': added}
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+def get_dedup_index():
+    """Shared index for this process, or None when deduplication is disabled"""
+    global _default_index
+    if not DEDUP_INDEX_FILE:
+        return None
+    with _default_index_lock:
+        if _default_index is None:
+            try:
+                _default_index = DedupIndex(DEDUP_INDEX_FILE)
+            except Exception as e:
+                print(f"Deduplication index unavailable: {str(e)}", file=sys.stderr)
+                return None
+        return _default_index
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Image format sniffing and header-only dimension probing
+Identifies images by their magic bytes instead of their file extension and
+reads their dimensions from the first few header bytes, without importing
+Pillow or decoding any pixels
+"""
+import mmap
+import struct
+
+# Format name (as Pillow reports it) -> MIME type and file extension
+CONTENT_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+    'BMP': 'image/bmp',
+    'TIFF': 'image/tiff',
+    'HEIF': 'image/heif',
+    'AVIF': 'image/avif',
+}
+EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'WEBP': '.webp',
+    'BMP': '.bmp',
+    'TIFF': '.tiff',
+    'HEIF': '.heic',
+    'AVIF': '.avif',
+}
+
+# File extensions picked up when scanning directories for images
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp')
+
+# Bytes needed to sniff any of the formats above
+SNIFF_BYTES = 32
+
+# JPEG start-of-frame markers (the ones carrying the image size)
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def sniff_format(data):
+    """Format name from an image's first bytes, or None if it isn't a known image format"""
+    head = bytes(data[:SNIFF_BYTES])
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    if head[:2] == b'BM':
+        return 'BMP'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'TIFF'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'avif', b'avis'):
+            return 'AVIF'
+        if brand in (b'heic', b'heix', b'hevc', b'heim', b'heis', b'mif1', b'msf1'):
+            return 'HEIF'
+    return None
+
+def sniff_content_type(data):
+    """MIME type from an image's first bytes, or None"""
+    return CONTENT_TYPES.get(sniff_format(data))
+
+def sniff_file_content_type(path):
+    """MIME type of an image file from its first bytes, or None"""
+    with open(path, 'rb') as f:
+        return sniff_content_type(f.read(SNIFF_BYTES))
+
+def _jpeg_size(data):
+    """Walk the JPEG marker segments up to the first start-of-frame"""
+    offset = 2
+    end = len(data)
+    while offset + 9 <= end:
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length
+            offset += 2
+            continue
+        (length,) = struct.unpack('>H', data[offset + 2:offset + 4])
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+def _webp_size(data):
+    chunk = bytes(data[12:16])
+    if chunk == b'VP8 ' and bytes(data[23:26]) == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and data[20] == 0x2F:
+        (bits,) = struct.unpack('<I', data[21:25])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        return (int.from_bytes(bytes(data[24:27]), 'little') + 1,
+                int.from_bytes(bytes(data[27:30]), 'little') + 1)
+    return None
+
+def probe_image(data):
+    """Format and (width, height) of an image from its header only
+
+    Returns (format, size), where size is None for formats whose dimensions
+    aren't parsed here (TIFF, HEIF, AVIF) or a malformed header, and None
+    if data isn't a known image format. data may be bytes, a bytearray, a
+    memoryview or an mmap.
+    """
+    image_format = sniff_format(data)
+    if image_format is None:
+        return None
+    size = None
+    try:
+        if image_format == 'JPEG':
+            size = _jpeg_size(data)
+        elif image_format == 'PNG' and bytes(data[12:16]) == b'IHDR':
+            size = struct.unpack('>II', data[16:24])
+        elif image_format == 'GIF':
+            size = struct.unpack('<HH', data[6:10])
+        elif image_format == 'WEBP':
+            size = _webp_size(data)
+        elif image_format == 'BMP':
+            width, height = struct.unpack('<ii', data[18:26])
+            size = (width, abs(height))
+    except (struct.error, IndexError):
+        size = None
+    return image_format, tuple(size) if size else None
+
+def probe_file(path):
+    """probe_image() of a file on disk, reading only the pages the header is on"""
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+        try:
+            return probe_image(mapped)
+        finally:
+            mapped.close()
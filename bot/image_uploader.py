@@ -5,101 +5,292 @@ Allows users to select one or more images from a gallery, upload them to Backbla
 and add the data to Google Sheets with a dashboard for entering details.
 """
 
+import time
+
+# Start of the startup timing (time to first window and to each service being ready)
+STARTUP_STARTED = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import b2sdk
-from b2sdk.v1 import InMemoryAccountInfo, B2Api
 import os
+import sys
 import threading
-from PIL import Image, ImageTk
-import io
 import json
-from datetime import datetime
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from upload_pipeline import (UploadPipeline, DEFAULT_UPLOAD_CONCURRENCY, MAX_UPLOAD_CONCURRENCY,
+                             SHEET_CATEGORIES, sheet_row, B2_BUCKET_ID, B2_BUCKET_NAME, B2_KEY_ID, B2_KEY_NAME, B2_APPLICATION_KEY,
+                             SCOPES, SPREADSHEET_ID, SERVICE_ACCOUNT_FILE)
+from batch_manifest import BatchManifest, find_incomplete_manifests
+from thumbnail_cache import ThumbnailCache, THUMBNAIL_SIZE
+
+# Print startup timings to stderr (also enabled by --startup-timing)
+STARTUP_TIMING = os.environ.get('IMAGE_UPLOADER_STARTUP_TIMING', '') not in ('', '0')
+
+class ThumbnailGrid(ttk.Frame):
+    """Scrollable grid of image thumbnails that only draws the rows in view
+
+    Thousands of paths cost nothing until they scroll into view; thumbnails
+    are decoded by the ThumbnailCache workers and drawn when they arrive.
+    """
+
+    CELL_WIDTH = THUMBNAIL_SIZE[0] + 24
+    CELL_HEIGHT = THUMBNAIL_SIZE[1] + 28
+
+    def __init__(self, parent, thumbnail_cache):
+        super().__init__(parent)
+        self.thumbnail_cache = thumbnail_cache
+        self.paths = []
+        self.columns = 1
+        self._index_by_path = {}
+        self._drawn = {}   # index -> canvas item ids of the cell
+        self._photos = {}  # index -> PhotoImage, referenced only while the cell is drawn
+        
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        self.canvas = tk.Canvas(self, highlightthickness=0, background="white")
+        self.canvas.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._yview)
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.canvas.configure(yscrollcommand=scrollbar.set, yscrollincrement=self.CELL_HEIGHT // 4)
+        
+        self.canvas.bind('<Configure>', self._on_resize)
+        self.canvas.bind('<MouseWheel>', self._on_mousewheel)
+        self.canvas.bind('<Button-4>', lambda event: self._scroll(-3))
+        self.canvas.bind('<Button-5>', lambda event: self._scroll(3))
+    
+    def set_paths(self, paths):
+        """Show a new list of images, scrolled to the top"""
+        self.paths = list(paths)
+        self._index_by_path = {path: index for index, path in enumerate(self.paths)}
+        self._clear()
+        self._update_scrollregion()
+        self.canvas.yview_moveto(0)
+        self._refresh()
+    
+    def _clear(self):
+        self.canvas.delete("all")
+        self._drawn.clear()
+        self._photos.clear()
+    
+    def _update_scrollregion(self):
+        rows = (len(self.paths) + self.columns - 1) // self.columns
+        self.canvas.configure(scrollregion=(0, 0, self.columns * self.CELL_WIDTH, rows * self.CELL_HEIGHT))
+    
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self._refresh()
+    
+    def _scroll(self, units):
+        self.canvas.yview_scroll(units, "units")
+        self._refresh()
+    
+    def _on_mousewheel(self, event):
+        self._scroll(-1 if event.delta > 0 else 1)
+    
+    def _on_resize(self, event):
+        columns = max(1, event.width // self.CELL_WIDTH)
+        if columns != self.columns:
+            self.columns = columns
+            self._clear()
+            self._update_scrollregion()
+        self._refresh()
+    
+    def _visible_range(self):
+        """Indexes of the cells in view, plus one row above and below"""
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first_row = max(0, int(top // self.CELL_HEIGHT) - 1)
+        last_row = int(bottom // self.CELL_HEIGHT) + 1
+        return first_row * self.columns, min(len(self.paths), (last_row + 1) * self.columns)
+    
+    def _refresh(self):
+        """Draw the cells that came into view, drop the ones that left, and queue thumbnails"""
+        start, end = self._visible_range()
+        for index in list(self._drawn):
+            if not start <= index < end:
+                self.canvas.delete(*self._drawn.pop(index))
+                self._photos.pop(index, None)
+        
+        missing = []
+        for index in range(start, end):
+            if index not in self._drawn:
+                self._draw_cell(index, self.thumbnail_cache.get(self.paths[index]))
+            if index not in self._photos:
+                missing.append(self.paths[index])
+        
+        # Replaces the previous request, so rows scrolled past are never decoded
+        self.thumbnail_cache.request(missing, self._thumbnail_ready)
+    
+    def _draw_cell(self, index, image):
+        row, column = divmod(index, self.columns)
+        x = column * self.CELL_WIDTH + self.CELL_WIDTH // 2
+        y = row * self.CELL_HEIGHT + 4
+        width, height = THUMBNAIL_SIZE
+        items = []
+        if image is not None:
+            # Pillow's Tk bridge is only needed once the first thumbnail arrives
+            from PIL import ImageTk
+            photo = ImageTk.PhotoImage(image)
+            self._photos[index] = photo
+            items.append(self.canvas.create_image(x, y + height // 2, image=photo))
+        else:
+            items.append(self.canvas.create_rectangle(x - width // 2, y, x + width // 2, y + height,
+                                                      outline="#cccccc", fill="#f2f2f2"))
+        filename = os.path.basename(self.paths[index])
+        if len(filename) > 18:
+            filename = filename[:15] + "..."
+        items.append(self.canvas.create_text(x, y + height + 12, text=f"{index+1}. {filename}",
+                                             font=("Arial", 8)))
+        self._drawn[index] = items
+    
+    def _thumbnail_ready(self, path, image):
+        # Called on a thumbnail worker thread - draw it from the Tk loop
+        self.after(0, self._show_thumbnail, path, image)
+    
+    def _show_thumbnail(self, path, image):
+        index = self._index_by_path.get(path)
+        if image is None or index is None or index not in self._drawn or index in self._photos:
+            return
+        self.canvas.delete(*self._drawn.pop(index))
+        self._draw_cell(index, image)
 
 class ImageUploader:
-    def __init__(self, root):
+    def __init__(self, root, on_startup_event=None):
         self.root = root
         self.root.title("Image Uploader to Backblaze B2")
         self.root.geometry("800x600")
         
         # B2 Configuration
-        self.bucket_id = "cf82ffa78d0a1a7197ac0510"
-        self.bucket_name = "social-feed-image"
-        self.key_id = "004f2f7daa17c500000000002"
-        self.key_name = "uplaod"
-        self.application_key = "K004ozruXnFNNq8cbFRxdYO1HhfJTSs"
+        self.bucket_id = B2_BUCKET_ID
+        self.bucket_name = B2_BUCKET_NAME
+        self.key_id = B2_KEY_ID
+        self.key_name = B2_KEY_NAME
+        self.application_key = B2_APPLICATION_KEY
         
         # Google Sheets Configuration
-        self.SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-        self.SPREADSHEET_ID = '1J2tXeDwvJBdayzPr-vEUt5JMt8Em73awYZmdvVhgCHQ'
-        self.SERVICE_ACCOUNT_FILE = 'service_account.json'  # Path to your service account JSON file
-        self.credentials = None
+        self.SCOPES = SCOPES
+        self.SPREADSHEET_ID = SPREADSHEET_ID
+        self.SERVICE_ACCOUNT_FILE = SERVICE_ACCOUNT_FILE
         self.sheets_service = None
         
-        # Initialize B2 API
+        # Upload and Sheets logic shared with the command line
+        self.pipeline = UploadPipeline(self.SERVICE_ACCOUNT_FILE)
+        
+        # Services connect in the background: "connecting", "ready" or "failed"
         self.b2_api = None
-        self.setup_b2_connection()
+        self.b2_state = "connecting"
+        self.sheets_state = "connecting"
+        self.uploading = False
         
-        # Initialize Google Sheets
-        self.setup_google_sheets()
+        # Startup timing hook: on_startup_event(name, milliseconds since STARTUP_STARTED)
+        self.on_startup_event = on_startup_event
+        self.startup_timings = {}
         
         # Selected images
         self.selected_images = []
+        self.thumbnail_cache = ThumbnailCache()
         self.upload_results = []
         
-        # Create GUI
+        # Manifest of the current batch, so it can be resumed after a crash
+        self.current_manifest = None
+        
+        # Create GUI first, so the window shows up before any network round trip
         self.create_widgets()
+        self.record_startup_event("widgets")
+        self.root.bind("<Map>", self._on_first_map, add="+")
         
+        # Connect to B2 and Google Sheets without blocking the window
+        for target in (self.setup_b2_connection, self.setup_google_sheets):
+            threading.Thread(target=target, daemon=True).start()
+    
+    def record_startup_event(self, name):
+        """Record how long after STARTUP_STARTED a startup step finished"""
+        elapsed_ms = round((time.perf_counter() - STARTUP_STARTED) * 1000, 1)
+        self.startup_timings[name] = elapsed_ms
+        if STARTUP_TIMING:
+            print(f"Startup: {name} after {elapsed_ms} ms", file=sys.stderr)
+        if self.on_startup_event:
+            self.on_startup_event(name, elapsed_ms)
+    
+    def _on_first_map(self, event):
+        if event.widget is not self.root or "first_window" in self.startup_timings:
+            return
+        # Mapped - the window is drawn once the pending idle tasks have run
+        self.root.after_idle(self.record_startup_event, "first_window")
+    
+    def _post(self, callback, *args):
+        """Run callback on the Tk thread (from a worker thread)"""
+        try:
+            self.root.after(0, callback, *args)
+        except (RuntimeError, tk.TclError):
+            # The window was closed while connecting
+            pass
+    
     def setup_b2_connection(self):
-        """Initialize Backblaze B2 connection"""
+        """Initialize Backblaze B2 connection (runs on a background thread)"""
         try:
-            # Create account info and B2 API
-            info = InMemoryAccountInfo()
-            self.b2_api = B2Api(info)
-            
-            # Try to authorize with the provided credentials
+            # Authorize with the provided credentials
             # Using the new Master Application Key
-            self.b2_api.authorize_account("production", self.key_id, self.application_key)
-            print("B2 connection established successfully")
-            
+            b2_api = self.pipeline.connect_b2()
         except Exception as e:
-            error_msg = f"Failed to connect to Backblaze B2: {str(e)}\n\n"
-            error_msg += "Please check your B2 credentials:\n"
-            error_msg += f"Key ID: {self.key_id}\n"
-            error_msg += f"Key Name: {self.key_name}\n"
-            error_msg += f"Application Key: {self.application_key[:10]}...\n"
-            error_msg += f"Bucket ID: {self.bucket_id}\n\n"
-            error_msg += "You may need to:\n"
-            error_msg += "1. Generate a new application key in B2 console\n"
-            error_msg += "2. Update the credentials in the script\n"
-            error_msg += "3. Ensure the key has the required permissions"
-            
-            messagebox.showerror("B2 Connection Error", error_msg)
-            self.b2_api = None
+            self._post(self._b2_failed, str(e))
+            return
+        self._post(self._b2_ready, b2_api)
+    
+    def _b2_ready(self, b2_api):
+        self.b2_api = b2_api
+        self.b2_state = "ready"
+        self.record_startup_event("b2_ready")
+        self._update_service_status()
+    
+    def _b2_failed(self, error):
+        self.b2_api = None
+        self.b2_state = "failed"
+        self.record_startup_event("b2_failed")
+        self._update_service_status()
+        error_msg = f"Failed to connect to Backblaze B2: {error}\n\n"
+        error_msg += "Please check your B2 credentials:\n"
+        error_msg += f"Key ID: {self.key_id}\n"
+        error_msg += f"Key Name: {self.key_name}\n"
+        error_msg += f"Application Key: {self.application_key[:10]}...\n"
+        error_msg += f"Bucket ID: {self.bucket_id}\n\n"
+        error_msg += "You may need to:\n"
+        error_msg += "1. Generate a new application key in B2 console\n"
+        error_msg += "2. Update the credentials in the script\n"
+        error_msg += "3. Ensure the key has the required permissions"
+        
+        messagebox.showerror("B2 Connection Error", error_msg)
     
     def setup_google_sheets(self):
-        """Initialize Google Sheets connection using service account"""
+        """Initialize Google Sheets connection using service account (runs on a background thread)"""
         try:
-            if not os.path.exists(self.SERVICE_ACCOUNT_FILE):
-                print(f"Service account file not found: {self.SERVICE_ACCOUNT_FILE}")
-                print("Please place your service_account.json file in the same directory as this script")
-                self.sheets_service = None
-                return
-            
-            # Create credentials from service account file
-            self.credentials = service_account.Credentials.from_service_account_file(
-                self.SERVICE_ACCOUNT_FILE, scopes=self.SCOPES)
-            
-            # Build the service
-            self.sheets_service = build('sheets', 'v4', credentials=self.credentials)
-            print("Google Sheets connection established successfully")
-            
+            # Returns None (and explains why) when service_account.json is missing
+            sheets_service = self.pipeline.connect_sheets()
         except Exception as e:
             print(f"Google Sheets setup error: {str(e)}")
-            self.sheets_service = None
+            sheets_service = None
+        self._post(self._sheets_connected, sheets_service)
+    
+    def _sheets_connected(self, sheets_service):
+        self.sheets_service = sheets_service
+        self.sheets_state = "ready" if sheets_service else "failed"
+        self.record_startup_event(f"sheets_{self.sheets_state}")
+        self._update_service_status()
+    
+    def _update_service_status(self):
+        """Show each service's state and enable the buttons that need it"""
+        labels = {"connecting": "connecting...", "ready": "connected", "failed": "unavailable"}
+        self.services_label.config(
+            text=f"B2: {labels[self.b2_state]}   Google Sheets: {labels[self.sheets_state]}")
+        self._update_buttons()
+    
+    def _update_buttons(self):
+        """Enable each button once its service is ready and it has something to act on"""
+        b2_ready = self.b2_api is not None and not self.uploading
+        has_uploads = any(r['status'] == 'success' for r in self.upload_results)
+        self.upload_btn.config(state="normal" if b2_ready and self.selected_images else "disabled")
+        self.resume_btn.config(state="normal" if b2_ready else "disabled")
+        self.test_btn.config(state="normal" if self.b2_api is not None else "disabled")
+        self.sheets_btn.config(state="normal" if self.sheets_service and has_uploads else "disabled")
     
     def create_widgets(self):
         """Create the main GUI widgets"""
@@ -111,7 +302,7 @@ class ImageUploader:
         self.root.columnconfigure(0, weight=1)
         self.root.rowconfigure(0, weight=1)
         main_frame.columnconfigure(1, weight=1)
-        main_frame.rowconfigure(2, weight=1)
+        main_frame.rowconfigure(3, weight=1)
         
         # Title
         title_label = ttk.Label(main_frame, text="Image Uploader to Backblaze B2", 
@@ -131,8 +322,9 @@ class ImageUploader:
         
         # Test connection button
         test_btn = ttk.Button(main_frame, text="Test B2 Connection", 
-                            command=self.test_connection)
+                            command=self.test_connection, state="disabled")
         test_btn.grid(row=1, column=2, pady=10, padx=(10, 0), sticky=tk.E)
+        self.test_btn = test_btn
         
         # Add to Google Sheets button
         sheets_btn = ttk.Button(main_frame, text="Add to Google Sheets", 
@@ -140,32 +332,50 @@ class ImageUploader:
         sheets_btn.grid(row=1, column=3, pady=10, padx=(10, 0), sticky=tk.E)
         self.sheets_btn = sheets_btn
         
-        # Images listbox with scrollbar
+        # Upload options
+        options_frame = ttk.Frame(main_frame)
+        options_frame.grid(row=2, column=0, columnspan=3, sticky=tk.W)
+        ttk.Label(options_frame, text="Parallel uploads:").pack(side=tk.LEFT)
+        self.concurrency_var = tk.IntVar(value=DEFAULT_UPLOAD_CONCURRENCY)
+        concurrency_spin = ttk.Spinbox(options_frame, from_=1, to=MAX_UPLOAD_CONCURRENCY,
+                                       textvariable=self.concurrency_var, width=5)
+        concurrency_spin.pack(side=tk.LEFT, padx=(5, 0))
+        
+        # Content-addressed object names can be cached by the CDN forever
+        self.content_addressed_var = tk.BooleanVar(value=self.pipeline.content_addressed)
+        ttk.Checkbutton(options_frame, text="Name files by content hash",
+                        variable=self.content_addressed_var).pack(side=tk.LEFT, padx=(20, 0))
+        
+        # Resume an interrupted batch
+        resume_btn = ttk.Button(options_frame, text="Resume Batch",
+                                command=self.resume_batch, state="disabled")
+        resume_btn.pack(side=tk.LEFT, padx=(20, 0))
+        self.resume_btn = resume_btn
+        
+        # Connection state of B2 and Google Sheets, filled in as they connect
+        self.services_label = ttk.Label(main_frame, text="B2: connecting...   Google Sheets: connecting...")
+        self.services_label.grid(row=2, column=3, sticky=tk.E)
+        
+        # Thumbnail previews of the selected images (only visible rows are drawn)
         list_frame = ttk.Frame(main_frame)
-        list_frame.grid(row=2, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=10)
+        list_frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=10)
         list_frame.columnconfigure(0, weight=1)
         list_frame.rowconfigure(0, weight=1)
         
-        # Listbox for selected images
-        self.images_listbox = tk.Listbox(list_frame, selectmode=tk.MULTIPLE)
-        self.images_listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        
-        # Scrollbar for listbox
-        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.images_listbox.yview)
-        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        self.images_listbox.configure(yscrollcommand=scrollbar.set)
+        self.thumbnail_grid = ThumbnailGrid(list_frame, self.thumbnail_cache)
+        self.thumbnail_grid.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
         # Progress bar
         self.progress = ttk.Progressbar(main_frame, mode='indeterminate')
-        self.progress.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10)
+        self.progress.grid(row=4, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10)
         
         # Status label
         self.status_label = ttk.Label(main_frame, text="Ready to select images")
-        self.status_label.grid(row=4, column=0, columnspan=3, pady=5)
+        self.status_label.grid(row=5, column=0, columnspan=3, pady=5)
         
         # Results text area
         results_frame = ttk.LabelFrame(main_frame, text="Upload Results", padding="5")
-        results_frame.grid(row=5, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=10)
+        results_frame.grid(row=6, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=10)
         results_frame.columnconfigure(0, weight=1)
         results_frame.rowconfigure(0, weight=1)
         
@@ -194,15 +404,12 @@ class ImageUploader:
         if files:
             self.selected_images = list(files)
             self.update_images_list()
-            self.upload_btn.config(state="normal")
+            self._update_buttons()
             self.status_label.config(text=f"Selected {len(files)} image(s)")
     
     def update_images_list(self):
-        """Update the listbox with selected images"""
-        self.images_listbox.delete(0, tk.END)
-        for i, image_path in enumerate(self.selected_images):
-            filename = os.path.basename(image_path)
-            self.images_listbox.insert(tk.END, f"{i+1}. {filename}")
+        """Show the selected images in the thumbnail grid"""
+        self.thumbnail_grid.set_paths(self.selected_images)
     
     def upload_images(self):
         """Upload selected images to Backblaze B2"""
@@ -214,75 +421,100 @@ class ImageUploader:
             messagebox.showerror("B2 Error", "B2 connection not established")
             return
         
+        self._start_upload(list(self.selected_images))
+    
+    def _get_concurrency(self):
+        """Read the concurrency setting - Tk variables belong to the main thread"""
+        try:
+            concurrency = int(self.concurrency_var.get())
+        except (tk.TclError, ValueError):
+            concurrency = DEFAULT_UPLOAD_CONCURRENCY
+        return max(1, min(concurrency, MAX_UPLOAD_CONCURRENCY))
+    
+    def _start_upload(self, image_paths, manifest=None):
+        """Start the upload worker thread (manifest given when resuming)"""
         # Start upload in a separate thread
         self.progress.start()
-        self.upload_btn.config(state="disabled")
+        self.uploading = True
+        self._update_buttons()
         self.status_label.config(text="Uploading images...")
+        self.pipeline.content_addressed = self.content_addressed_var.get()
         
-        upload_thread = threading.Thread(target=self._upload_worker)
+        upload_thread = threading.Thread(target=self._upload_worker,
+                                         args=(image_paths, self._get_concurrency(), manifest))
         upload_thread.daemon = True
         upload_thread.start()
     
-    def _upload_worker(self):
+    def resume_batch(self):
+        """Resume the most recent interrupted batch"""
+        if not self.b2_api:
+            messagebox.showerror("B2 Error", "B2 connection not established")
+            return
+        
+        incomplete = find_incomplete_manifests()
+        if not incomplete:
+            messagebox.showinfo("Resume Batch", "There is no interrupted batch to resume.")
+            return
+        
+        try:
+            manifest = BatchManifest.load(incomplete[0])
+        except Exception as e:
+            messagebox.showerror("Resume Batch", f"Could not read batch manifest:\n{str(e)}")
+            return
+        
+        remaining = len(manifest.pending_indexes())
+        pending_rows = len(manifest.pending_sheet_rows())
+        if not messagebox.askyesno(
+                "Resume Batch",
+                f"Batch {manifest.batch_id}\n\n"
+                f"{len(manifest.files) - remaining} of {len(manifest.files)} file(s) already uploaded\n"
+                f"{remaining} file(s) to upload\n"
+                f"{pending_rows} Google Sheets row(s) to write\n\n"
+                f"Resume this batch?"):
+            return
+        
+        self.selected_images = manifest.image_paths()
+        self.update_images_list()
+        self._start_upload(self.selected_images, manifest)
+    
+    def _upload_worker(self, image_paths, concurrency=DEFAULT_UPLOAD_CONCURRENCY, manifest=None):
         """Worker thread for uploading images"""
         try:
-            bucket = self.b2_api.get_bucket_by_id(self.bucket_id)
-            results = []
+            def on_progress(completed, total):
+                # Update progress in main thread
+                self.root.after(0, self._update_progress, completed, total)
             
-            for i, image_path in enumerate(self.selected_images):
+            rows_written = 0
+            if manifest:
+                results, rows_written = self.pipeline.resume(manifest, concurrency, on_progress)
+            else:
+                # Record the batch on disk first so it can be resumed if we crash
                 try:
-                    filename = os.path.basename(image_path)
-                    
-                    # Upload file to B2 using upload_local_file method
-                    content_type = 'image/jpeg' if filename.lower().endswith(('.jpg', '.jpeg')) else 'image/png'
-                    
-                    file_info = bucket.upload_local_file(
-                        local_file=image_path,
-                        file_name=filename,
-                        content_type=content_type
-                    )
-                    
-                    # Get public URL - Convert to BunnyCDN format for faster loading
-                    # Original B2 format: https://f004.backblazeb2.com/file/bucket-name/filename
-                    # Convert to BunnyCDN format: https://leakurge.b-cdn.net/filename
-                    public_url = f"https://leakurge.b-cdn.net/{filename}"
-                    
-                    result = {
-                        'filename': filename,
-                        'file_id': file_info.id_,
-                        'public_url': public_url,
-                        'status': 'success'
-                    }
-                    results.append(result)
-                    
-                    # Update progress in main thread
-                    self.root.after(0, lambda: self._update_progress(i + 1, len(self.selected_images)))
-                    
+                    manifest = BatchManifest.create(image_paths)
                 except Exception as e:
-                    result = {
-                        'filename': os.path.basename(image_path),
-                        'error': str(e),
-                        'status': 'error'
-                    }
-                    results.append(result)
+                    print(f"Could not create batch manifest: {str(e)}")
+                results = self.pipeline.upload_files(image_paths, concurrency, on_progress, manifest)
             
             # Update UI in main thread
-            self.root.after(0, lambda: self._upload_complete(results))
+            self.root.after(0, lambda: self._upload_complete(results, manifest, rows_written))
             
         except Exception as e:
-            self.root.after(0, lambda: self._upload_error(str(e)))
+            error_msg = str(e)
+            self.root.after(0, lambda: self._upload_error(error_msg))
     
     def _update_progress(self, current, total):
         """Update progress display"""
         self.status_label.config(text=f"Uploading {current}/{total} images...")
     
-    def _upload_complete(self, results):
+    def _upload_complete(self, results, manifest=None, rows_written=0):
         """Handle upload completion"""
         self.progress.stop()
-        self.upload_btn.config(state="normal")
+        self.uploading = False
         
         # Store upload results for Google Sheets
         self.upload_results = results
+        self.current_manifest = manifest
+        self._update_buttons()
         
         # Display results
         self.results_text.delete(1.0, tk.END)
@@ -297,17 +529,19 @@ class ImageUploader:
         if successful_uploads:
             self.results_text.insert(tk.END, "Successful Uploads:\n")
             for result in successful_uploads:
-                self.results_text.insert(tk.END, f"✓ {result['filename']}\n")
+                cached_note = " (already uploaded)" if result.get('method') == 'dedup_cache' else ""
+                self.results_text.insert(tk.END, f"✓ {result['filename']}{cached_note}\n")
                 self.results_text.insert(tk.END, f"  Public URL: {result['public_url']}\n")
                 self.results_text.insert(tk.END, f"  🔗 Click to open in browser: {result['public_url']}\n\n")
-            
-            # Enable Google Sheets button if there are successful uploads
-            self.sheets_btn.config(state="normal")
         
         if failed_uploads:
             self.results_text.insert(tk.END, "Failed Uploads:\n")
             for result in failed_uploads:
                 self.results_text.insert(tk.END, f"✗ {result['filename']}: {result['error']}\n")
+            self.results_text.insert(tk.END, "\nUse \"Resume Batch\" to retry the failed uploads.\n")
+        
+        if rows_written:
+            self.results_text.insert(tk.END, f"\nRecovered {rows_written} pending Google Sheets row(s).\n")
         
         self.status_label.config(text=f"Upload complete: {len(successful_uploads)} successful, {len(failed_uploads)} failed")
         
@@ -321,7 +555,8 @@ class ImageUploader:
     def _upload_error(self, error_msg):
         """Handle upload error"""
         self.progress.stop()
-        self.upload_btn.config(state="normal")
+        self.uploading = False
+        self._update_buttons()
         self.status_label.config(text="Upload failed")
         self.results_text.delete(1.0, tk.END)
         self.results_text.insert(tk.END, f"Upload Error: {error_msg}")
@@ -391,7 +626,7 @@ class ImageUploader:
         ttk.Label(fields_frame, text="Category:").grid(row=2, column=0, sticky=tk.W, pady=5)
         category_var = tk.StringVar(value="chamet")
         category_combo = ttk.Combobox(fields_frame, textvariable=category_var, 
-                                     values=["chamet", "viral", "tango", "other"], state="readonly")
+                                     values=SHEET_CATEGORIES, state="readonly")
         category_combo.grid(row=2, column=1, sticky=(tk.W, tk.E), pady=5, padx=(10, 0))
         
         # Author field
@@ -440,27 +675,9 @@ class ImageUploader:
                     messagebox.showerror("Error", "Author is required")
                     return
                 
-                # Prepare data for Google Sheets
-                current_time = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
-                
-                # Get image URLs
-                image_urls = [result['public_url'] for result in successful_uploads]
-                primary_image_url = image_urls[0] if image_urls else ""
-                all_images_url = ",".join(image_urls)
-                
-                # Prepare row data
-                row_data = [
-                    "",  # ID (auto-generated)
-                    title,
-                    content,
-                    platform,
-                    author,
-                    current_time,
-                    primary_image_url,
-                    all_images_url,
-                    caption,
-                    "TRUE" if is_album else "FALSE"
-                ]
+                # Prepare row data (same layout as the command-line batch upload)
+                row_data = sheet_row(successful_uploads, title, content, platform, author,
+                                     caption, is_album)
                 
                 # Add to Google Sheets
                 self.add_row_to_sheets(row_data)
@@ -481,41 +698,71 @@ class ImageUploader:
     
     def add_row_to_sheets(self, row_data):
         """Add a new row to Google Sheets"""
-        try:
-            if not self.sheets_service:
-                raise Exception("Google Sheets service not initialized")
-            
-            # Get the next available row
-            range_name = 'Sheet1!A:A'
-            result = self.sheets_service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID, range=range_name).execute()
-            values = result.get('values', [])
-            next_row = len(values) + 1
-            
-            # Prepare the data to append
-            range_name = f'Sheet1!A{next_row}:J{next_row}'
-            body = {
-                'values': [row_data]
-            }
-            
-            # Insert the data
-            result = self.sheets_service.spreadsheets().values().update(
-                spreadsheetId=self.SPREADSHEET_ID, range=range_name,
-                valueInputOption='RAW', body=body).execute()
-            
-            print(f"Added row to Google Sheets: {result.get('updatedCells')} cells updated")
-            
-        except HttpError as error:
-            print(f"Google Sheets API error: {error}")
-            raise Exception(f"Google Sheets API error: {error}")
-        except Exception as e:
-            print(f"Error adding to Google Sheets: {e}")
-            raise
+        self.add_rows_to_sheets([row_data])
+    
+    def add_rows_to_sheets(self, rows):
+        """Append one or more rows (e.g. several albums) to Google Sheets in a single request"""
+        self.pipeline.add_rows(rows, manifest=self.current_manifest)
+
+def resume_from_command_line(manifest_path=None, concurrency=DEFAULT_UPLOAD_CONCURRENCY):
+    """Resume an interrupted batch without the GUI and print a JSON summary"""
+    if not manifest_path:
+        incomplete = find_incomplete_manifests()
+        if not incomplete:
+            print(json.dumps({"success": True, "message": "no interrupted batch to resume"}))
+            return 0
+        manifest_path = incomplete[0]
+    
+    manifest = BatchManifest.load(manifest_path)
+    pipeline = UploadPipeline()
+    pipeline.connect_b2()
+    pipeline.connect_sheets()
+    
+    results, rows_written = pipeline.resume(manifest, concurrency)
+    failed = [r for r in results if r['status'] != 'success']
+    print(json.dumps({
+        "success": not failed and manifest.is_complete(),
+        "batch_id": manifest.batch_id,
+        "manifest": manifest.path,
+        "uploaded": len(results) - len(failed),
+        "failed": len(failed),
+        "sheet_rows_written": rows_written,
+        "results": results
+    }, indent=2))
+    return 0 if not failed else 1
 
-def main():
+def main(argv=None):
     """Main function to run the application"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Upload images to Backblaze B2 and Google Sheets")
+    parser.add_argument('--resume', nargs='?', const='', metavar='MANIFEST',
+                        help="resume an interrupted batch without the GUI (default: the most recent one)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_UPLOAD_CONCURRENCY,
+                        help="files uploaded at once")
+    parser.add_argument('--startup-timing', action='store_true',
+                        help="print the time to first window and to each service being ready to stderr")
+    parser.add_argument('--quit-after-startup', action='store_true',
+                        help="close the window once both services have connected (for measuring startup)")
+    args = parser.parse_args(argv)
+    
+    if args.resume is not None:
+        sys.exit(resume_from_command_line(args.resume or None, args.concurrency))
+    
+    global STARTUP_TIMING
+    STARTUP_TIMING = STARTUP_TIMING or args.startup_timing
+    
     root = tk.Tk()
-    app = ImageUploader(root)
+    on_startup_event = None
+    if args.quit_after_startup:
+        done = set()
+        
+        def on_startup_event(name, elapsed_ms):
+            # Quit once the window is up and neither service is still connecting
+            done.add(name.split('_')[0])
+            if {"first", "b2", "sheets"} <= done:
+                root.after_idle(root.destroy)
+    app = ImageUploader(root, on_startup_event)
     
     # Center the window
     root.update_idletasks()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Batched, append-based Google Sheets writer
+Queues rows and writes them with the values().append API, so many albums
+go out in a single request and concurrent writers never race for a row
+"""
+import sys
+import time
+import random
+import threading
+from concurrent.futures import Future
+
+# Appends are not idempotent. Quota errors (429, and 403 rate limit errors) are
+# rejected before anything is written, so they are simply sent again. After a
+# server error or a timeout the rows may have been written anyway, so the end
+# of the sheet is checked for them before sending them again
+REJECTED_STATUSES = (429,)
+AMBIGUOUS_STATUSES = (500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'RATE_LIMIT_EXCEEDED')
+
+# How many rows at the end of the sheet are read back when looking for rows that may have
+# been appended. The end of the sheet is found from COUNT_COLUMN, which every row fills in
+# (the post time), so the check never reads the whole table
+VERIFY_WINDOW_ROWS = 1000
+COUNT_COLUMN = 'F'
+
+DEFAULT_RANGE = 'Sheet1!A:J'
+MAX_RETRIES = 6
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 64.0
+
+def _error_status(error):
+    """HTTP status of a googleapiclient HttpError (None for other errors)"""
+    resp = getattr(error, 'resp', None)
+    return getattr(resp, 'status', None)
+
+def _is_rejected(error):
+    """Whether a Sheets API error is a quota error, i.e. nothing was written"""
+    status = _error_status(error)
+    if status in REJECTED_STATUSES:
+        return True
+    if status == 403:
+        return any(reason in str(error) for reason in RATE_LIMIT_REASONS)
+    return False
+
+def _is_ambiguous(error):
+    """Whether the request may have been applied although it failed (server error, timeout)"""
+    if _error_status(error) in AMBIGUOUS_STATUSES:
+        return True
+    # Timeouts and dropped connections (socket.timeout, ConnectionError, ...)
+    return isinstance(error, OSError)
+
+def _cells_match(written, cell):
+    # Cells left empty (e.g. the auto-generated ID) may have been filled in since
+    return written in ("", None) or cell == written or str(cell) == str(written)
+
+def _contains_rows(sheet_rows, rows):
+    """Whether rows appear as one contiguous block in sheet_rows"""
+    for start in range(len(sheet_rows) - len(rows), -1, -1):
+        if all(
+            all(_cells_match(value, sheet_row[column] if column < len(sheet_row) else "")
+                for column, value in enumerate(row))
+            for sheet_row, row in zip(sheet_rows[start:start + len(rows)], rows)
+        ):
+            return True
+    return False
+
+def _retry_after(error):
+    """Seconds requested by a Retry-After header, if any"""
+    resp = getattr(error, 'resp', None)
+    try:
+        return float(resp.get('retry-after')) if resp is not None else None
+    except (TypeError, ValueError):
+        return None
+
+class SheetsWriter:
+    """Append rows to a sheet, batching queued rows into single API calls
+
+    append_rows() writes immediately. submit() queues a row and returns a
+    Future; queued rows are flushed together by flush(), or by a background
+    thread every flush_interval seconds once start() has been called.
+    """
+
+    def __init__(self, sheets_service, spreadsheet_id, range_name=DEFAULT_RANGE,
+                 max_batch_rows=500, flush_interval=2.0):
+        self.sheets_service = sheets_service
+        self.spreadsheet_id = spreadsheet_id
+        self.range_name = range_name
+        self.max_batch_rows = max_batch_rows
+        self.flush_interval = flush_interval
+        self._queue = []
+        self._queue_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def rows_written(self, rows):
+        """Whether rows are already among the last VERIFY_WINDOW_ROWS rows of the sheet"""
+        sheet, columns = self.range_name.rsplit('!', 1)
+        first_column, last_column = columns.split(':')
+        values = self.sheets_service.spreadsheets().values()
+        # One column is enough to find the last row
+        result = values.get(spreadsheetId=self.spreadsheet_id,
+                            range=f"{sheet}!{COUNT_COLUMN}:{COUNT_COLUMN}").execute()
+        last_row = len((result or {}).get('values', []))
+        if last_row == 0:
+            return False
+        first_row = max(1, last_row - VERIFY_WINDOW_ROWS + 1)
+        result = values.get(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"{sheet}!{first_column}{first_row}:{last_column}{last_row}",
+            valueRenderOption='UNFORMATTED_VALUE').execute()
+        return _contains_rows((result or {}).get('values', []), rows)
+
+    def append_rows(self, rows):
+        """Append rows after the last row of the table, retrying failed appends with backoff
+
+        Rows are never appended twice: after a server error or timeout the
+        sheet is checked for them first, and if that check fails too the
+        original error is raised instead of retrying.
+        """
+        body = {'values': [list(row) for row in rows]}
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return self.sheets_service.spreadsheets().values().append(
+                    spreadsheetId=self.spreadsheet_id, range=self.range_name,
+                    valueInputOption='RAW', insertDataOption='INSERT_ROWS',
+                    body=body).execute()
+            except Exception as error:
+                if attempt == MAX_RETRIES or not (_is_rejected(error) or _is_ambiguous(error)):
+                    raise
+                if not _is_rejected(error):
+                    try:
+                        written = self.rows_written(body['values'])
+                    except Exception as check_error:
+                        print(f"Could not check whether the rows were written: {check_error}",
+                              file=sys.stderr)
+                        raise error
+                    if written:
+                        print("Google Sheets append failed, but the rows were written",
+                              file=sys.stderr)
+                        return {'updates': {'updatedRows': len(rows)}}
+                delay = _retry_after(error)
+                if delay is None:
+                    delay = min(MAX_BACKOFF, BASE_BACKOFF * (2 ** attempt))
+                    delay = delay / 2 + random.uniform(0, delay / 2)
+                print(f"Google Sheets quota/server error ({_error_status(error)}), "
+                      f"retrying in {delay:.1f}s", file=sys.stderr)
+                time.sleep(delay)
+
+    def submit(self, row):
+        """Queue a row for the next batched append and return a Future for it"""
+        future = Future()
+        with self._queue_lock:
+            self._queue.append((list(row), future))
+            queued = len(self._queue)
+        if queued >= self.max_batch_rows:
+            self._wakeup.set()
+        return future
+
+    def submit_many(self, rows):
+        """Queue several rows (e.g. many albums) and return their Futures"""
+        return [self.submit(row) for row in rows]
+
+    def flush(self):
+        """Write every queued row, max_batch_rows per API call"""
+        with self._flush_lock:
+            while True:
+                with self._queue_lock:
+                    batch = self._queue[:self.max_batch_rows]
+                    del self._queue[:self.max_batch_rows]
+                if not batch:
+                    return
+                try:
+                    result = self.append_rows([row for row, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        future.set_exception(e)
+                    continue
+                updates = (result or {}).get('updates', {})
+                print(f"Appended {len(batch)} row(s) to Google Sheets: "
+                      f"{updates.get('updatedRange', '')}", file=sys.stderr)
+                for _, future in batch:
+                    future.set_result(updates)
+
+    def start(self):
+        """Flush queued rows from a background thread until close()"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the background thread and write anything still queued"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
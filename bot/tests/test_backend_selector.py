@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+# upload_to_b2 needs requests at import time
+pytest.importorskip('requests')
+
+from upload_to_b2 import BackendSelector
+
+
+def fail(selector, backend, times=1):
+    for _ in range(times):
+        assert selector.begin(backend)
+        selector.record(backend, False, 0.1)
+
+
+def test_orders_unmeasured_then_fastest():
+    selector = BackendSelector()
+    selector.record('a', True, 0.5)
+    selector.record('b', True, 0.1)
+    assert selector.order(['a', 'b', 'c']) == ['c', 'b', 'a']
+
+
+def test_recent_failure_goes_last():
+    selector = BackendSelector(failure_threshold=3, cooldown=60)
+    selector.record('a', True, 0.1)
+    selector.record('b', True, 0.5)
+    fail(selector, 'a')
+    assert selector.order(['a', 'b']) == ['b', 'a']
+
+
+def test_circuit_open_half_open_closed():
+    selector = BackendSelector(failure_threshold=2, cooldown=0.05)
+    selector.record('a', True, 0.1)
+    selector.record('b', True, 0.5)
+    fail(selector, 'b', times=2)
+    assert selector.snapshot()['b']['circuit'] == 'open'
+    assert selector.order(['a', 'b']) == ['a']
+
+    time.sleep(0.06)
+    assert selector.snapshot()['b']['circuit'] == 'half_open'
+    assert selector.order(['a', 'b']) == ['a', 'b']
+
+    # One probe at a time
+    assert selector.begin('b')
+    assert not selector.begin('b')
+    assert selector.order(['a', 'b']) == ['a']
+
+    selector.record('b', True, 0.2)
+    assert selector.snapshot()['b']['circuit'] == 'closed'
+    assert selector.begin('b')
+    assert selector.order(['a', 'b']) == ['a', 'b']
+
+
+def test_failed_probe_reopens_circuit():
+    selector = BackendSelector(failure_threshold=1, cooldown=0.05)
+    fail(selector, 'b')
+    time.sleep(0.06)
+    fail(selector, 'b')
+    assert selector.snapshot()['b']['circuit'] == 'open'
+    assert selector.order(['a', 'b']) == ['a']
+
+
+def test_skipped_probe_stays_half_open():
+    selector = BackendSelector(failure_threshold=1, cooldown=0.05)
+    selector.record('a', True, 0.01)
+    selector.record('b', True, 0.5)
+    fail(selector, 'b')
+    time.sleep(0.06)
+
+    # b is listed as the probe, but a succeeds first and b is never attempted
+    for _ in range(3):
+        order = selector.order(['a', 'b'])
+        assert order == ['a', 'b']
+        assert selector.begin('a')
+        selector.record('a', True, 0.01)
+
+    assert selector.snapshot()['b']['circuit'] == 'half_open'
+    assert selector.begin('b')
+    selector.record('b', True, 0.01)
+    assert selector.snapshot()['b']['circuit'] == 'closed'
+
+
+def test_everything_open_still_tries_all():
+    selector = BackendSelector(failure_threshold=1, cooldown=60)
+    fail(selector, 'a')
+    fail(selector, 'b')
+    assert selector.order(['a', 'b']) == ['a', 'b']
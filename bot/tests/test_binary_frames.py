@@ -0,0 +1,34 @@
+import io
+import json
+import struct
+
+import pytest
+
+pytest.importorskip('requests')
+
+import upload_to_b2
+from upload_to_b2 import read_frame, write_frame
+
+
+def test_frame_round_trip():
+    stream = io.BytesIO()
+    write_frame(stream, {'id': 1, 'filename': 'a.png'}, b'image bytes')
+    stream.seek(0)
+    header, image_data = read_frame(stream)
+    assert header == {'id': 1, 'filename': 'a.png', 'length': 11}
+    assert bytes(image_data) == b'image bytes'
+    assert read_frame(stream) is None
+
+
+def test_json_line_is_not_read_as_a_huge_header():
+    stream = io.BytesIO(b'{"id": 1, "image": "..."}\n')
+    with pytest.raises(ValueError):
+        read_frame(stream)
+
+
+def test_oversized_image_is_rejected(monkeypatch):
+    monkeypatch.setattr(upload_to_b2, 'MAX_FRAME_IMAGE_BYTES', 10)
+    header = json.dumps({'id': 1, 'length': 11}).encode('utf-8')
+    stream = io.BytesIO(struct.pack('>I', len(header)) + header + b'x' * 11)
+    with pytest.raises(ValueError):
+        read_frame(stream)
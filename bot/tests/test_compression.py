@@ -0,0 +1,39 @@
+import random
+from io import BytesIO
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+pytest.importorskip('requests')
+
+from upload_to_b2 import compress_and_optimize_image
+
+
+def noise_png_with_transparency(size=(64, 64)):
+    # Noise doesn't compress well as lossy WebP, so the PNG fallback is used
+    rng = random.Random(1)
+    img = Image.new('P', size)
+    img.putpalette([255, 0, 0, 0, 255, 0, 0, 0, 255, 0, 0, 0] + [0] * 756)
+    img.putdata([rng.randrange(4) for _ in range(size[0] * size[1])])
+    output = BytesIO()
+    img.save(output, format='PNG', transparency=3, compress_level=1)
+    return output.getvalue()
+
+
+def test_png_fallback_keeps_transparency():
+    data = noise_png_with_transparency()
+    output, content_type, filename = compress_and_optimize_image(data, 'sprite.png')
+    assert content_type == 'image/png'
+    assert filename == 'sprite.png'
+    assert len(output) < len(data)
+    result = Image.open(BytesIO(output)).convert('RGBA')
+    assert result.getextrema()[3][0] == 0
+
+
+def test_webp_is_smaller_than_the_original():
+    img = Image.new('RGB', (300, 200), (200, 30, 30))
+    output = BytesIO()
+    img.save(output, format='PNG')
+    data, content_type, filename = compress_and_optimize_image(output.getvalue(), 'flat.png')
+    assert content_type == 'image/webp'
+    assert filename == 'flat.webp'
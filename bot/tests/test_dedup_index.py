@@ -0,0 +1,72 @@
+from dedup_index import (DedupIndex, SOURCE_HASH_INFO_KEY, PARAMS_INFO_KEY, content_addressed_name,
+                         content_addressed_params, is_content_addressed)
+
+
+def url_for(name):
+    return f"https://cdn.example/{name}"
+
+
+def make_index(tmp_path):
+    return DedupIndex(str(tmp_path / 'index.sqlite3'))
+
+
+def test_record_and_lookup(tmp_path):
+    index = make_index(tmp_path)
+    index.record('aaa', 'webp:q85', 'photo.webp', url_for('photo.webp'), 'id1')
+    assert index.lookup('aaa', 'webp:q85') == {'file_id': 'id1', 'file_name': 'photo.webp',
+                                               'url': url_for('photo.webp')}
+    assert index.lookup('aaa', 'webp:q80') is None
+    assert index.lookup('bbb', 'webp:q85') is None
+
+
+def test_same_name_other_content_replaces_entry(tmp_path):
+    index = make_index(tmp_path)
+    index.record('aaa', 'webp:q85', 'photo.webp', url_for('photo.webp'), 'id1')
+    index.record('bbb', 'webp:q85', 'photo.webp', url_for('photo.webp'), 'id2')
+    # photo.webp now holds bbb - re-uploading aaa must not be answered with it
+    assert index.lookup('aaa', 'webp:q85') is None
+    assert index.lookup('bbb', 'webp:q85')['file_id'] == 'id2'
+
+
+def test_same_content_other_name_keeps_latest(tmp_path):
+    index = make_index(tmp_path)
+    index.record('aaa', 'webp:q85', 'one.webp', url_for('one.webp'))
+    index.record('aaa', 'webp:q85', 'two.webp', url_for('two.webp'))
+    assert index.lookup('aaa', 'webp:q85')['file_name'] == 'two.webp'
+    assert len(index.entries()) == 1
+
+
+def test_sync_removes_deleted_and_overwritten(tmp_path):
+    index = make_index(tmp_path)
+    index.record('aaa', 'p', 'a.webp', url_for('a.webp'), 'id-a')
+    index.record('bbb', 'p', 'b.webp', url_for('b.webp'), 'id-b')
+    index.record('ccc', 'p', 'c.webp', url_for('c.webp'), 'id-c')
+    bucket = [('a.webp', 'id-a', {}), ('b.webp', 'id-b2', {})]
+    summary = index.sync_with_bucket(bucket, url_for)
+    assert summary == {'checked': 2, 'removed': 2, 'added': 0}
+    assert [entry[0] for entry in index.entries()] == ['aaa']
+
+
+def test_rebuild_from_file_info(tmp_path):
+    index = make_index(tmp_path)
+    bucket = [
+        ('a.webp', 'id-a', {SOURCE_HASH_INFO_KEY: 'aaa', PARAMS_INFO_KEY: 'p'}),
+        ('plain.webp', 'id-p', {})
+    ]
+    summary = index.sync_with_bucket(bucket, url_for, rebuild=True)
+    assert summary['added'] == 1
+    assert index.lookup('aaa', 'p') == {'file_id': 'id-a', 'file_name': 'a.webp', 'url': url_for('a.webp')}
+    # Nothing changes on a second pass
+    assert index.sync_with_bucket(bucket, url_for, rebuild=True)['added'] == 0
+
+
+def test_content_addressed_names():
+    params = content_addressed_params('webp:q85')
+    assert is_content_addressed(params)
+    assert not is_content_addressed('webp:q85')
+    assert content_addressed_params(params) == params
+    name = content_addressed_name('Photo.JPG', 'aaa', params)
+    assert name.endswith('.jpg') and len(name) == 36
+    assert name == content_addressed_name('other.jpg', 'aaa', params)
+    assert name != content_addressed_name('Photo.JPG', 'bbb', params)
+    assert name != content_addressed_name('Photo.JPG', 'aaa', 'webp:q80:content-addressed')
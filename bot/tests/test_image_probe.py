@@ -0,0 +1,89 @@
+import struct
+from io import BytesIO
+
+import pytest
+
+from image_probe import probe_image, probe_file, sniff_format, sniff_content_type, sniff_file_content_type
+
+
+def png_header(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', width, height) + b'\x08\x06\x00\x00\x00'
+
+
+def jpeg_header(width, height, progressive=False):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    dht = b'\xff\xc4' + struct.pack('>H', 4) + b'\x00\x00'
+    sof = (b'\xff\xc2' if progressive else b'\xff\xc0') + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return b'\xff\xd8' + app0 + dht + sof
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'\xff\xd8\xff\xe0' + b'\x00' * 28, 'JPEG'),
+    (png_header(1, 1), 'PNG'),
+    (b'GIF89a' + b'\x00' * 26, 'GIF'),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 ' + b'\x00' * 16, 'WEBP'),
+    (b'BM' + b'\x00' * 30, 'BMP'),
+    (b'II*\x00' + b'\x00' * 28, 'TIFF'),
+    (b'\x00\x00\x00\x1cftypavif' + b'\x00' * 20, 'AVIF'),
+    (b'\x00\x00\x00\x1cftypheic' + b'\x00' * 20, 'HEIF'),
+    (b'<html>' + b'\x00' * 26, None),
+    (b'', None),
+])
+def test_sniff_format(data, expected):
+    assert sniff_format(data) == expected
+
+
+def test_sniff_content_type_ignores_extension(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(png_header(10, 20))
+    assert sniff_content_type(png_header(10, 20)) == 'image/png'
+    assert sniff_file_content_type(str(path)) == 'image/png'
+
+
+def test_probe_png_and_jpeg_headers():
+    assert probe_image(png_header(640, 480)) == ('PNG', (640, 480))
+    assert probe_image(jpeg_header(1920, 1080)) == ('JPEG', (1920, 1080))
+    assert probe_image(jpeg_header(33, 17, progressive=True)) == ('JPEG', (33, 17))
+
+
+def test_probe_truncated_or_unknown():
+    assert probe_image(b'not an image at all, not at all!') is None
+    assert probe_image(jpeg_header(10, 10)[:20]) == ('JPEG', None)
+    assert probe_image(b'\x00\x00\x00\x1cftypavif' + b'\x00' * 20) == ('AVIF', None)
+
+
+def test_probe_file_empty(tmp_path):
+    path = tmp_path / 'empty.png'
+    path.write_bytes(b'')
+    assert probe_file(str(path)) is None
+
+
+@pytest.mark.parametrize('image_format, options', [
+    ('JPEG', {}),
+    ('JPEG', {'progressive': True}),
+    ('PNG', {}),
+    ('GIF', {}),
+    ('BMP', {}),
+    ('WEBP', {'quality': 80}),
+    ('WEBP', {'lossless': True}),
+])
+def test_probe_matches_pillow(tmp_path, image_format, options):
+    Image = pytest.importorskip('PIL.Image')
+    mode = 'RGBA' if options.get('lossless') else 'RGB'
+    output = BytesIO()
+    Image.new(mode, (123, 45), (10, 20, 30)).save(output, format=image_format, **options)
+    data = output.getvalue()
+    assert probe_image(data) == (image_format, (123, 45))
+    path = tmp_path / 'image.bin'
+    path.write_bytes(data)
+    assert probe_file(str(path)) == (image_format, (123, 45))
+
+
+def test_probe_webp_extended_format():
+    Image = pytest.importorskip('PIL.Image')
+    output = BytesIO()
+    # EXIF forces the extended (VP8X) container
+    Image.new('RGB', (300, 7)).save(output, format='WEBP', exif=b'Exif\x00\x00II*\x00\x08\x00\x00\x00\x00\x00')
+    data = output.getvalue()
+    assert data[12:16] == b'VP8X'
+    assert probe_image(data) == ('WEBP', (300, 7))
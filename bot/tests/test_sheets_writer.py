@@ -0,0 +1,119 @@
+import re
+
+import sheets_writer
+from sheets_writer import SheetsWriter
+
+
+class FakeError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        # Like httplib2's response: a dict of headers with a status attribute
+        self.resp = type('Response', (dict,), {'status': status})()
+
+
+class FakeRequest:
+    def __init__(self, function):
+        self.function = function
+
+    def execute(self):
+        return self.function()
+
+
+class FakeSheet:
+    """Just enough of spreadsheets().values() for SheetsWriter"""
+
+    def __init__(self, failures=(), apply_before_failing=False):
+        self.rows = []
+        self.failures = list(failures)
+        self.apply_before_failing = apply_before_failing
+        self.appends = 0
+        self.reads = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def append(self, body, **kwargs):
+        def run():
+            self.appends += 1
+            if self.failures:
+                failure = self.failures.pop(0)
+                if self.apply_before_failing:
+                    self.rows.extend(body['values'])
+                raise failure
+            self.rows.extend(body['values'])
+            return {'updates': {'updatedRows': len(body['values'])}}
+        return FakeRequest(run)
+
+    def get(self, range, **kwargs):
+        # Like the API: the ID column was filled in, trailing empty cells are dropped
+        self.reads.append(range)
+        rows = [[str(n + 1)] + row[1:] for n, row in enumerate(self.rows)]
+        columns = range.split('!')[1]
+        if columns == 'F:F':
+            return FakeRequest(lambda: {'values': [[row[5]] for row in rows]})
+        first, last = (int(n) for n in re.findall(r'\d+', columns))
+        return FakeRequest(lambda: {'values': rows[first - 1:last]})
+
+
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(sheets_writer.time, 'sleep', lambda seconds: None)
+
+
+ROW = ["", "title", "content", "viral", "author", "01/01/2026 10:00:00", "u1", "u1\nu2", "", True]
+
+
+def test_quota_error_is_resent(monkeypatch):
+    no_sleep(monkeypatch)
+    sheet = FakeSheet([FakeError(429)])
+    SheetsWriter(sheet, 'sheet').append_rows([ROW])
+    assert sheet.appends == 2
+    assert len(sheet.rows) == 1
+
+
+def test_server_error_after_write_is_not_resent(monkeypatch):
+    no_sleep(monkeypatch)
+    sheet = FakeSheet([FakeError(503)], apply_before_failing=True)
+    SheetsWriter(sheet, 'sheet').append_rows([ROW])
+    assert sheet.appends == 1
+    assert len(sheet.rows) == 1
+
+
+def test_check_reads_only_the_end_of_the_sheet(monkeypatch):
+    no_sleep(monkeypatch)
+    monkeypatch.setattr(sheets_writer, 'VERIFY_WINDOW_ROWS', 2)
+    sheet = FakeSheet([FakeError(503)], apply_before_failing=True)
+    sheet.rows = [ROW[:1] + [f"old {n}"] + ROW[2:] for n in range(5)]
+    SheetsWriter(sheet, 'sheet').append_rows([ROW])
+    assert sheet.reads == ['Sheet1!F:F', 'Sheet1!A5:J6']
+    assert sheet.appends == 1
+    assert len(sheet.rows) == 6
+
+
+def test_timeout_without_write_is_resent(monkeypatch):
+    no_sleep(monkeypatch)
+    sheet = FakeSheet([TimeoutError("timed out")])
+    SheetsWriter(sheet, 'sheet').append_rows([ROW])
+    assert sheet.appends == 2
+    assert len(sheet.rows) == 1
+
+
+def test_client_error_is_raised(monkeypatch):
+    no_sleep(monkeypatch)
+    sheet = FakeSheet([FakeError(400)])
+    try:
+        SheetsWriter(sheet, 'sheet').append_rows([ROW])
+    except FakeError:
+        pass
+    else:
+        raise AssertionError("400 should not be retried")
+    assert sheet.appends == 1
+
+
+def test_contains_rows_ignores_filled_in_ids():
+    sheet_rows = [["1", "a"], ["2", "b", "x"], ["3", "c"]]
+    assert sheets_writer._contains_rows(sheet_rows, [["", "b", "x"], ["", "c"]])
+    assert not sheets_writer._contains_rows(sheet_rows, [["", "c"], ["", "b", "x"]])
+    assert not sheets_writer._contains_rows(sheet_rows, [["", "b", "y"]])
@@ -0,0 +1,63 @@
+import pytest
+
+from batch_manifest import BatchManifest
+from sheets_writer import SheetsWriter
+from upload_pipeline import UploadPipeline
+from test_sheets_writer import FakeError, FakeSheet, ROW, no_sleep
+
+
+def make_pipeline(sheet):
+    pipeline = UploadPipeline()
+    pipeline.sheets_writer = SheetsWriter(sheet, 'sheet')
+    return pipeline
+
+
+def other_row(title):
+    return ROW[:1] + [title] + ROW[2:]
+
+
+def test_pending_row_already_in_sheet_is_not_resent(tmp_path):
+    sheet = FakeSheet()
+    manifest = BatchManifest.create([], str(tmp_path))
+    # Crashed after the append reached Sheets but before it was confirmed
+    manifest.add_sheet_row(ROW)
+    sheet.rows.append(list(ROW))
+    manifest.add_sheet_row(other_row("never sent"))
+
+    assert make_pipeline(sheet).write_pending_rows(manifest) == 2
+    assert sheet.appends == 1
+    assert [row[1] for row in sheet.rows] == ["title", "never sent"]
+    assert manifest.is_complete()
+
+
+def test_dashboard_retry_reuses_pending_row(tmp_path, monkeypatch):
+    pytest.importorskip('googleapiclient')
+    no_sleep(monkeypatch)
+    sheet = FakeSheet([FakeError(400)])
+    manifest = BatchManifest.create([], str(tmp_path))
+    pipeline = make_pipeline(sheet)
+    with pytest.raises(FakeError):
+        pipeline.add_rows([ROW], manifest=manifest)
+
+    pipeline.add_rows([other_row("edited")], manifest=manifest)
+    assert [row[1] for row in sheet.rows] == ["edited"]
+    assert len(manifest.data['sheet_rows']) == 1
+    assert manifest.is_complete()
+
+
+def test_dashboard_retry_after_ambiguous_write_sends_nothing(tmp_path, monkeypatch):
+    pytest.importorskip('googleapiclient')
+    no_sleep(monkeypatch)
+    # The append went through but the check after the timeout failed too
+    sheet = FakeSheet([TimeoutError("timed out")], apply_before_failing=True)
+    get = sheet.get
+    sheet.get = lambda **kwargs: (_ for _ in ()).throw(TimeoutError("timed out"))
+    manifest = BatchManifest.create([], str(tmp_path))
+    pipeline = make_pipeline(sheet)
+    with pytest.raises(TimeoutError):
+        pipeline.add_rows([ROW], manifest=manifest)
+
+    sheet.get = get
+    pipeline.add_rows([ROW], manifest=manifest)
+    assert len(sheet.rows) == 1
+    assert manifest.is_complete()
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+from email.utils import formatdate
+
+import pytest
+
+import upload_retry
+from upload_retry import (RetryableError, RetryBudget, RetryPolicy, batch_retry_budget, current_budget,
+                          run_with_budget, parse_retry_after, retryable_status, retryable_request_error,
+                          retryable_b2sdk_error, RETRY_BUDGET_MIN)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record waits instead of sleeping"""
+    waits = []
+    monkeypatch.setattr(upload_retry.time, 'sleep', waits.append)
+    return waits
+
+
+def flaky(failures, error=None):
+    """function(attempt) failing with a RetryableError for the first `failures` calls"""
+    calls = []
+
+    def function(attempt):
+        calls.append(attempt)
+        if len(calls) <= failures:
+            raise error or RetryableError("503")
+        return "ok"
+    return function, calls
+
+
+def test_budget_is_spent_once_per_retry():
+    budget = RetryBudget(2)
+    assert budget.spend() and budget.spend()
+    assert not budget.spend()
+    assert budget.remaining == 0
+
+
+def test_budget_is_shared_between_threads():
+    budget = RetryBudget(100)
+    spent = []
+    threads = [threading.Thread(target=lambda: spent.extend(budget.spend() for _ in range(30)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert spent.count(True) == 100
+
+
+def test_batch_budget_scales_with_batch_size():
+    assert batch_retry_budget(1).remaining == RETRY_BUDGET_MIN
+    assert batch_retry_budget(1000).remaining == int(1000 * upload_retry.RETRY_BUDGET_RATIO)
+
+
+def test_run_with_budget_sets_and_restores_current_budget():
+    outer, inner = RetryBudget(1), RetryBudget(2)
+    assert current_budget() is None
+    seen = run_with_budget(outer, lambda: (current_budget(), run_with_budget(inner, current_budget),
+                                           current_budget()))
+    assert seen == (outer, inner, outer)
+    assert current_budget() is None
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('') is None
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after('soon') is None
+    assert 8 <= parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+
+
+def test_retryable_status():
+    assert retryable_status(400, 'bad request') is None
+    error = retryable_status(429, 'slow down', {'Retry-After': '2'})
+    assert isinstance(error, RetryableError) and error.retry_after == 2.0
+    assert retryable_status(503, 'busy').retry_after is None
+
+
+def test_retryable_request_error():
+    class Response:
+        def __init__(self, status):
+            self.status_code = status
+            self.text = 'body'
+            self.headers = {}
+
+    class RequestError(Exception):
+        def __init__(self, response=None):
+            super().__init__('failed')
+            self.response = response
+
+    assert isinstance(retryable_request_error(RequestError()), RetryableError)
+    assert isinstance(retryable_request_error(RequestError(Response(500))), RetryableError)
+    assert retryable_request_error(RequestError(Response(404))) is None
+
+
+def test_retryable_b2sdk_error():
+    class B2Error(Exception):
+        retry_after_seconds = 4
+
+        def __init__(self, retry):
+            super().__init__('b2')
+            self.retry = retry
+
+        def should_retry_upload(self):
+            return self.retry
+
+    assert retryable_b2sdk_error(B2Error(True)).retry_after == 4
+    assert retryable_b2sdk_error(B2Error(False)) is None
+    assert retryable_b2sdk_error(ValueError('no')) is None
+
+
+def test_delay_is_full_jitter_within_bounds():
+    policy = RetryPolicy(base_delay=1.0, max_delay=8.0)
+    for attempt in range(6):
+        for _ in range(50):
+            assert 0 <= policy.delay(attempt) <= min(8.0, 2 ** attempt)
+
+
+def test_delay_honours_retry_after_up_to_max():
+    policy = RetryPolicy(base_delay=0.01, max_delay=5.0)
+    assert policy.delay(0, retry_after=3.0) == 3.0
+    assert policy.delay(0, retry_after=60.0) == 5.0
+
+
+def test_call_retries_until_success(sleeps):
+    function, calls = flaky(2)
+    assert RetryPolicy(max_attempts=5, base_delay=0.01).call(function) == "ok"
+    assert calls == [0, 1, 2]
+    assert len(sleeps) == 2
+
+
+def test_call_gives_up_after_max_attempts(sleeps):
+    function, calls = flaky(10)
+    with pytest.raises(RetryableError):
+        RetryPolicy(max_attempts=3, base_delay=0.01).call(function)
+    assert calls == [0, 1, 2]
+
+
+def test_call_raises_other_errors_at_once(sleeps):
+    function, calls = flaky(1, ValueError("bad input"))
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=5).call(function)
+    assert calls == [0]
+    assert sleeps == []
+
+
+def test_call_stops_when_the_budget_runs_out(sleeps):
+    budget = RetryBudget(1)
+    function, calls = flaky(10)
+    with pytest.raises(RetryableError):
+        RetryPolicy(max_attempts=5, base_delay=0.01).call(function, budget)
+    assert calls == [0, 1]
+    # The thread's batch budget is used when none is passed
+    function, calls = flaky(10)
+    with pytest.raises(RetryableError):
+        run_with_budget(budget, RetryPolicy(max_attempts=5).call, function)
+    assert calls == [0]
+
+
+def test_call_async(monkeypatch):
+    async def no_sleep(seconds):
+        pass
+    monkeypatch.setattr(upload_retry.asyncio, 'sleep', no_sleep)
+    function, calls = flaky(2)
+
+    async def attempt(number):
+        return function(number)
+
+    assert asyncio.run(RetryPolicy(max_attempts=5).call_async(attempt)) == "ok"
+    assert calls == [0, 1, 2]
@@ -0,0 +1,30 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+
+from upload_to_b2 import B2UploadUrlPool
+
+
+def write_cache(pool):
+    with pool._cache_file_lock():
+        pool._write_cache({'authorizationToken': 'token', 'apiUrl': 'https://api.example'},
+                          time.time() + 3600, [('https://upload.example', 'upload-token')])
+
+
+def test_cache_file_is_private(tmp_path):
+    pool = B2UploadUrlPool(cache_file=str(tmp_path / 'cache' / 'auth.json'))
+    write_cache(pool)
+    assert os.stat(pool.cache_file).st_mode & 0o777 == 0o600
+    assert os.stat(tmp_path / 'cache').st_mode & 0o777 == 0o700
+    assert pool._read_cache()['upload_urls'] == [['https://upload.example', 'upload-token']]
+
+
+@pytest.mark.skipif(not hasattr(os, 'geteuid') or os.geteuid() != 0, reason="needs root to chown")
+def test_cache_file_of_another_user_is_refused(tmp_path):
+    pool = B2UploadUrlPool(cache_file=str(tmp_path / 'auth.json'))
+    write_cache(pool)
+    os.chown(pool.cache_file, 65534, 65534)
+    assert pool._read_cache() is None
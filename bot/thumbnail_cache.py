@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Thumbnail generation and caching for the uploader GUI
+Thumbnails are decoded at reduced size on background threads and kept in a
+size-bounded in-memory LRU cache, plus an optional size-bounded on-disk
+cache, keyed by path and modification time
+"""
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+
+THUMBNAIL_SIZE = (96, 96)
+
+# Where generated thumbnails are kept between runs - set to an empty string to disable
+THUMBNAIL_DIR = os.environ.get(
+    'IMAGE_UPLOADER_THUMB_DIR',
+    os.path.join(os.path.expanduser('~'), '.image_uploader', 'thumbnails')
+)
+
+# In-memory cache limit (decoded pixel bytes)
+THUMBNAIL_MEMORY_BYTES = 64 * 1024 * 1024
+
+# On-disk cache limit; the least recently used thumbnails are deleted down to
+# THUMBNAIL_DISK_PRUNE_TO of it at startup and whenever a write goes over it
+THUMBNAIL_DISK_BYTES = int(float(os.environ.get('IMAGE_UPLOADER_THUMB_DISK_MB', '256')) * 1024 * 1024)
+THUMBNAIL_DISK_PRUNE_TO = 0.9
+
+THUMBNAIL_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+def thumbnail_key(path):
+    """Cache key of a file's current contents: path, modification time and size"""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}"
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    """Decode a file straight to a small RGB thumbnail"""
+    from PIL import Image
+
+    with Image.open(path) as img:
+        # JPEGs decode at 1/2, 1/4 or 1/8 scale - far less work than a full decode
+        if img.format == 'JPEG':
+            img.draft('RGB', (size[0] * 2, size[1] * 2))
+        img.thumbnail(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        else:
+            img.load()
+        return img
+
+class ThumbnailCache:
+    """Generate thumbnails in the background and keep the most recently used
+
+    request(paths, callback) replaces the set of wanted thumbnails (e.g. the
+    rows currently on screen); anything no longer wanted is dropped from
+    the queue. callback(path, image) is called from a worker thread.
+    """
+
+    def __init__(self, size=THUMBNAIL_SIZE, max_bytes=THUMBNAIL_MEMORY_BYTES, disk_dir=THUMBNAIL_DIR,
+                 workers=THUMBNAIL_WORKERS, max_disk_bytes=THUMBNAIL_DISK_BYTES):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._disk_bytes = None  # unknown until the first prune has listed the directory
+        self._prune_lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._wanted = OrderedDict()
+        self._callback = None
+        self._has_work = threading.Condition(self._lock)
+        self._closed = False
+        if disk_dir:
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+            except OSError as e:
+                print(f"Thumbnail disk cache disabled: {str(e)}", file=sys.stderr)
+                self.disk_dir = None
+        if self.disk_dir:
+            # Listing a big cache directory shouldn't hold up the window
+            threading.Thread(target=self.prune_disk, daemon=True).start()
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def get(self, path):
+        """Cached thumbnail from memory, or None - never decodes, safe on the GUI thread"""
+        try:
+            key = thumbnail_key(path)
+        except OSError:
+            return None
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+            return image
+
+    def request(self, paths, callback):
+        """Generate thumbnails for paths (in order) that aren't cached in memory yet"""
+        with self._lock:
+            self._callback = callback
+            self._wanted = OrderedDict((path, True) for path in paths)
+            self._has_work.notify_all()
+
+    def close(self):
+        """Stop the worker threads"""
+        with self._lock:
+            self._closed = True
+            self._wanted.clear()
+            self._has_work.notify_all()
+
+    def _store(self, key, image):
+        cost = image.size[0] * image.size[1] * len(image.getbands())
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = image
+            self._memory_bytes += cost
+            while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.size[0] * evicted.size[1] * len(evicted.getbands())
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.jpg')
+
+    def prune_disk(self):
+        """Delete the least recently used disk thumbnails while the cache is over max_disk_bytes
+
+        Disk hits refresh a thumbnail's modification time, so mtime order is
+        LRU order. Returns the bytes left in the cache.
+        """
+        if not self._prune_lock.acquire(blocking=False):
+            # Another thread is already pruning
+            return self._disk_bytes
+        try:
+            entries = []
+            for entry in os.scandir(self.disk_dir):
+                if entry.name.endswith('.jpg'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_disk_bytes:
+                limit = self.max_disk_bytes * THUMBNAIL_DISK_PRUNE_TO
+                for _, size, path in sorted(entries):
+                    if total <= limit:
+                        break
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except OSError:
+                        pass
+            with self._lock:
+                self._disk_bytes = total
+            return total
+        except OSError as e:
+            print(f"Could not prune thumbnail cache: {str(e)}", file=sys.stderr)
+            return self._disk_bytes
+        finally:
+            self._prune_lock.release()
+
+    def _written_to_disk(self, size):
+        """Count a new disk thumbnail and prune once the cache goes over its limit"""
+        with self._lock:
+            if self._disk_bytes is None:
+                return
+            self._disk_bytes += size
+            over = self._disk_bytes > self.max_disk_bytes
+        if over:
+            self.prune_disk()
+
+    def _load(self, path):
+        """Thumbnail from memory, disk or a fresh decode"""
+        from PIL import Image
+
+        key = thumbnail_key(path)
+        with self._lock:
+            image = self._memory.get(key)
+        if image is not None:
+            return image
+
+        disk_path = self._disk_path(key) if self.disk_dir else None
+        if disk_path and os.path.exists(disk_path):
+            try:
+                with Image.open(disk_path) as cached:
+                    cached.load()
+                    image = cached.copy()
+                # Mark it recently used for prune_disk()
+                os.utime(disk_path)
+            except Exception:
+                image = None
+
+        if image is None:
+            image = make_thumbnail(path, self.size)
+            if disk_path:
+                try:
+                    temp_path = f"{disk_path}.{threading.get_ident()}.tmp"
+                    image.save(temp_path, format='JPEG', quality=85)
+                    os.replace(temp_path, disk_path)
+                    self._written_to_disk(os.path.getsize(disk_path))
+                except Exception as e:
+                    print(f"Could not write thumbnail cache: {str(e)}", file=sys.stderr)
+
+        self._store(key, image)
+        return image
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._wanted and not self._closed:
+                    self._has_work.wait()
+                if self._closed:
+                    return
+                path, _ = self._wanted.popitem(last=False)
+                callback = self._callback
+            try:
+                image = self._load(path)
+            except Exception as e:
+                print(f"Thumbnail failed for {path}: {str(e)}", file=sys.stderr)
+                image = None
+            if callback:
+                callback(path, image)
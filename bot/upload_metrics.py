@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Upload timings and metrics
+Collects a per-stage timing breakdown (decode, resize, encode, auth,
+upload URL, upload...) for each upload result, and keeps process-wide
+counters and latency histograms per backend and stage that long-running
+modes export as JSON or Prometheus text
+"""
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_local = threading.local()
+
+# Cleared in worker processes, whose timings are recorded by the parent instead
+_observe_stages = True
+
+def _collectors():
+    """Timing dicts currently collecting in this thread"""
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+@contextmanager
+def collect_timings(timings=None):
+    """Add up the seconds spent per stage by this thread inside the block
+
+    Yields the dict of stage -> seconds. Work done in other threads or
+    processes must be added with add_timings().
+    """
+    timings = {} if timings is None else timings
+    collectors = _collectors()
+    collectors.append(timings)
+    try:
+        yield timings
+    finally:
+        collectors.remove(timings)
+
+def add_timing(stage, seconds, observe=True):
+    """Record time spent in a stage for the active collectors and the histograms"""
+    for timings in _collectors():
+        timings[stage] = timings.get(stage, 0.0) + seconds
+    if observe and _observe_stages:
+        metrics.observe_stage(stage, seconds)
+
+def disable_stage_histograms():
+    """Only collect timings in this process (pool initializer for worker processes)"""
+    global _observe_stages
+    _observe_stages = False
+
+def add_timings(timings, observe=True):
+    """Record a whole stage -> seconds dict (e.g. one returned by a worker process)"""
+    for stage, seconds in timings.items():
+        add_timing(stage, seconds, observe)
+
+@contextmanager
+def timed(stage):
+    """Time the block as one stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(stage, time.perf_counter() - started)
+
+def timings_ms(timings):
+    """Stage timings rounded to milliseconds, for results"""
+    return {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus style)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum_seconds': round(self.sum, 6),
+            'mean_ms': round(self.sum / self.count * 1000, 2) if self.count else None,
+            'buckets': {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+        }
+
+class UploadMetrics:
+    """Process-wide upload counters and latency histograms per backend and stage"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._uploads = {}
+        self._stages = {}
+
+    def observe_upload(self, backend, success, seconds, size=None):
+        """Count one upload attempt through a backend"""
+        with self._lock:
+            entry = self._uploads.get(backend)
+            if entry is None:
+                entry = self._uploads[backend] = {
+                    'success': 0, 'failure': 0, 'bytes': 0, 'latency': Histogram(self.buckets)
+                }
+            entry['success' if success else 'failure'] += 1
+            if success and size:
+                entry['bytes'] += size
+            entry['latency'].observe(seconds)
+
+    def observe_stage(self, stage, seconds):
+        """Add one stage timing to its histogram"""
+        with self._lock:
+            if stage not in self._stages:
+                self._stages[stage] = Histogram(self.buckets)
+            self._stages[stage].observe(seconds)
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict"""
+        with self._lock:
+            return {
+                'uptime_seconds': round(time.time() - self.started_at, 1),
+                'backends': {
+                    backend: {
+                        'success': entry['success'],
+                        'failure': entry['failure'],
+                        'bytes': entry['bytes'],
+                        'latency': entry['latency'].snapshot()
+                    }
+                    for backend, entry in self._uploads.items()
+                },
+                'stages': {stage: histogram.snapshot() for stage, histogram in self._stages.items()}
+            }
+
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def histogram_lines(name, label, value, histogram):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+
+        with self._lock:
+            lines.append('# HELP b2_uploads_total Upload attempts per backend and result.')
+            lines.append('# TYPE b2_uploads_total counter')
+            for backend, entry in sorted(self._uploads.items()):
+                for result in ('success', 'failure'):
+                    lines.append(f'b2_uploads_total{{backend="{backend}",result="{result}"}} {entry[result]}')
+            lines.append('# HELP b2_upload_bytes_total Bytes uploaded per backend.')
+            lines.append('# TYPE b2_upload_bytes_total counter')
+            for backend, entry in sorted(self._uploads.items()):
+                lines.append(f'b2_upload_bytes_total{{backend="{backend}"}} {entry["bytes"]}')
+            lines.append('# HELP b2_upload_duration_seconds Upload attempt latency per backend.')
+            lines.append('# TYPE b2_upload_duration_seconds histogram')
+            for backend, entry in sorted(self._uploads.items()):
+                histogram_lines('b2_upload_duration_seconds', 'backend', backend, entry['latency'])
+            lines.append('# HELP b2_stage_duration_seconds Time spent per upload stage.')
+            lines.append('# TYPE b2_stage_duration_seconds histogram')
+            for stage, histogram in sorted(self._stages.items()):
+                histogram_lines('b2_stage_duration_seconds', 'stage', stage, histogram)
+        return "\n".join(lines) + "\n"
+
+# Shared by everything in this process
+metrics = UploadMetrics()
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """Serve metrics.prometheus_text() at http://host:port/metrics from a background thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics", file=sys.stderr)
+    return server
+
+def start_stats_dump(interval, stream=sys.stderr):
+    """Write metrics.snapshot() as one JSON line every interval seconds from a background thread"""
+    def run():
+        while True:
+            time.sleep(interval)
+            stream.write(json.dumps({'metrics': metrics.snapshot()}) + "\n")
+            stream.flush()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
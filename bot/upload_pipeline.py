@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Headless B2 upload and Google Sheets logic shared by the GUI and the command line
+b2sdk and the Google client libraries are only imported when connecting, so
+importing this module (and opening the GUI) stays fast
+"""
+import os
+import sys
+import mimetypes
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dedup_index import (get_dedup_index, hash_file, SOURCE_HASH_INFO_KEY, PARAMS_INFO_KEY,
+                          ORIGINAL_UPLOAD_PARAMS, CONTENT_ADDRESSED, CACHE_CONTROL_INFO_KEY,
+                          IMMUTABLE_CACHE_CONTROL, content_addressed_params, content_addressed_name)
+from sheets_writer import SheetsWriter
+from image_probe import sniff_file_content_type
+from upload_retry import retryable_b2sdk_error, batch_retry_budget, upload_retry_policy
+
+# B2 Configuration
+B2_BUCKET_ID = "cf82ffa78d0a1a7197ac0510"
+B2_BUCKET_NAME = "social-feed-image"
+B2_KEY_ID = "004f2f7daa17c500000000002"
+B2_KEY_NAME = "uplaod"
+B2_APPLICATION_KEY = "K004ozruXnFNNq8cbFRxdYO1HhfJTSs"
+
+# Google Sheets Configuration
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+SPREADSHEET_ID = '1J2tXeDwvJBdayzPr-vEUt5JMt8Em73awYZmdvVhgCHQ'
+SERVICE_ACCOUNT_FILE = 'service_account.json'  # Path to your service account JSON file
+
+# Number of files uploaded at once by default
+DEFAULT_UPLOAD_CONCURRENCY = 4
+MAX_UPLOAD_CONCURRENCY = 32
+
+# Categories (platforms) a sheet row can be filed under
+SHEET_CATEGORIES = ["chamet", "viral", "tango", "other"]
+
+def public_url_for(filename):
+    """BunnyCDN URL of a file in the bucket"""
+    # Original B2 format: https://f004.backblazeb2.com/file/bucket-name/filename
+    # Convert to BunnyCDN format: https://leakurge.b-cdn.net/filename
+    return f"https://leakurge.b-cdn.net/{filename}"
+
+def sheet_row(results, title, content, category, author, caption="", is_album=True):
+    """Google Sheets row for a post made of the successful uploads in results
+
+    Columns: ID (auto-generated), title, content, category, author, time,
+    primary image URL, all image URLs, caption, is album.
+    """
+    image_urls = [result['public_url'] for result in results if result['status'] == 'success']
+    return [
+        "",  # ID (auto-generated)
+        title,
+        content,
+        category,
+        author,
+        datetime.now().strftime("%m/%d/%Y %H:%M:%S"),
+        image_urls[0] if image_urls else "",
+        ",".join(image_urls),
+        caption,
+        "TRUE" if is_album else "FALSE"
+    ]
+
+class UploadPipeline:
+    """B2 uploads and Sheets writes without any GUI"""
+
+    def __init__(self, service_account_file=SERVICE_ACCOUNT_FILE, content_addressed=CONTENT_ADDRESSED):
+        self.bucket_id = B2_BUCKET_ID
+        self.key_id = B2_KEY_ID
+        self.application_key = B2_APPLICATION_KEY
+        self.spreadsheet_id = SPREADSHEET_ID
+        self.service_account_file = service_account_file
+        self.b2_api = None
+        self.sheets_service = None
+        self.sheets_writer = None
+        # Name objects by content hash (and mark them immutable) instead of by file name
+        self.content_addressed = content_addressed
+
+    def connect_b2(self):
+        """Authorize against B2; raises on failure"""
+        from b2sdk.v1 import InMemoryAccountInfo, B2Api
+
+        # Create account info and B2 API
+        info = InMemoryAccountInfo()
+        b2_api = B2Api(info)
+
+        # Try to authorize with the provided credentials
+        b2_api.authorize_account("production", self.key_id, self.application_key)
+        self.b2_api = b2_api
+        print("B2 connection established successfully", file=sys.stderr)
+        return b2_api
+
+    def connect_sheets(self):
+        """Build the Sheets client; returns None if the service account file is missing"""
+        if not os.path.exists(self.service_account_file):
+            print(f"Service account file not found: {self.service_account_file}", file=sys.stderr)
+            print("Please place your service_account.json file in the same directory as this script", file=sys.stderr)
+            return None
+
+        from google.oauth2 import service_account
+        from googleapiclient.discovery import build
+
+        # Create credentials from service account file
+        credentials = service_account.Credentials.from_service_account_file(
+            self.service_account_file, scopes=SCOPES)
+
+        # Build the service
+        self.sheets_service = build('sheets', 'v4', credentials=credentials)
+        self.sheets_writer = SheetsWriter(self.sheets_service, self.spreadsheet_id)
+        print("Google Sheets connection established successfully", file=sys.stderr)
+        return self.sheets_service
+
+    def upload_file(self, bucket, image_path, retry_budget=None):
+        """Upload a single image and return its result entry
+
+        Transient B2 errors are retried with backoff, spending retry_budget
+        (shared by the batch) if given.
+        """
+        try:
+            filename = os.path.basename(image_path)
+            params = ORIGINAL_UPLOAD_PARAMS
+            file_infos = {}
+            if self.content_addressed:
+                params = content_addressed_params(params)
+                file_infos[CACHE_CONTROL_INFO_KEY] = IMMUTABLE_CACHE_CONTROL
+
+            # Skip files that are already in the bucket
+            dedup_index = get_dedup_index()
+            content_hash = hash_file(image_path)
+            if dedup_index:
+                cached = dedup_index.lookup(content_hash, params)
+                if cached:
+                    return {
+                        'filename': filename,
+                        'file_id': cached['file_id'],
+                        'public_url': cached['url'],
+                        'sha256': content_hash,
+                        'status': 'success',
+                        'method': 'dedup_cache'
+                    }
+
+            # Upload file to B2 using upload_local_file method, labelled by its actual format
+            content_type = (sniff_file_content_type(image_path) or mimetypes.guess_type(filename)[0]
+                            or 'application/octet-stream')
+            object_name = filename
+            if self.content_addressed:
+                object_name = content_addressed_name(filename, content_hash, params)
+            file_infos.update({SOURCE_HASH_INFO_KEY: content_hash, PARAMS_INFO_KEY: params})
+
+            def attempt(number):
+                try:
+                    return bucket.upload_local_file(
+                        local_file=image_path,
+                        file_name=object_name,
+                        content_type=content_type,
+                        file_infos=file_infos
+                    )
+                except Exception as e:
+                    raise retryable_b2sdk_error(e) or e
+
+            file_info = upload_retry_policy.call(attempt, retry_budget)
+
+            public_url = public_url_for(object_name)
+
+            if dedup_index:
+                dedup_index.record(content_hash, params, object_name, public_url, file_info.id_)
+
+            return {
+                'filename': filename,
+                'file_id': file_info.id_,
+                'public_url': public_url,
+                'sha256': content_hash,
+                'status': 'success'
+            }
+
+        except Exception as e:
+            return {
+                'filename': os.path.basename(image_path),
+                'error': str(e),
+                'status': 'error'
+            }
+
+    def upload_files(self, image_paths, concurrency=DEFAULT_UPLOAD_CONCURRENCY, on_progress=None,
+                     manifest=None):
+        """Upload files in parallel and return their results in the given order
+
+        on_progress(completed, total) is called from this thread as each file
+        finishes. With a manifest, files it lists as done are skipped and
+        every outcome is written to it as soon as it is known.
+        """
+        bucket = self.b2_api.get_bucket_by_id(self.bucket_id)
+        total = len(image_paths)
+        # Results keep the selection order no matter which upload finishes first
+        results = [None] * total
+        todo = list(range(total))
+        if manifest:
+            todo = manifest.pending_indexes()
+            for i in range(total):
+                results[i] = manifest.result_for(i)
+        completed = total - len(todo)
+        # Transient errors are retried, but the whole batch shares one retry budget
+        retry_budget = batch_retry_budget(len(todo))
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = {
+                executor.submit(self.upload_file, bucket, image_paths[i], retry_budget): i
+                for i in todo
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                results[index] = future.result()
+                if manifest:
+                    manifest.record_result(index, results[index])
+                completed += 1
+                if on_progress:
+                    on_progress(completed, total)
+
+        return results
+
+    def add_rows(self, rows, manifest=None):
+        """Append rows to Google Sheets in one request, tracking them in the manifest
+
+        Rows the manifest still lists as pending (an earlier attempt failed)
+        are reused instead of adding new ones, and are only sent again if the
+        sheet does not have them yet.
+        """
+        if not self.sheets_writer:
+            print("Error adding to Google Sheets: Google Sheets service not initialized", file=sys.stderr)
+            raise Exception("Google Sheets service not initialized")
+
+        # Loaded by connect_sheets() already
+        from googleapiclient.errors import HttpError
+
+        try:
+            row_indexes = []
+            to_send = list(rows)
+            if manifest:
+                pending = manifest.pending_sheet_rows()
+                to_send = []
+                for row in rows:
+                    if not pending:
+                        row_indexes.append(manifest.add_sheet_row(row))
+                        to_send.append(row)
+                        continue
+                    # Sent again from the dashboard: the failed attempt may have reached the sheet
+                    row_index, previous_row = pending.pop(0)
+                    if self.sheets_writer.rows_written([previous_row]):
+                        manifest.mark_sheet_row_written(row_index)
+                        print("Google Sheets row was already written by the earlier attempt",
+                              file=sys.stderr)
+                        continue
+                    manifest.update_sheet_row(row_index, row)
+                    row_indexes.append(row_index)
+                    to_send.append(row)
+
+            # The append API finds the end of the table itself - no read, no row race
+            futures = self.sheets_writer.submit_many(to_send)
+            self.sheets_writer.flush()
+            for future in futures:
+                future.result()
+
+            for row_index in row_indexes:
+                manifest.mark_sheet_row_written(row_index)
+
+            print(f"Added {len(to_send)} row(s) to Google Sheets", file=sys.stderr)
+
+        except HttpError as error:
+            print(f"Google Sheets API error: {error}", file=sys.stderr)
+            raise Exception(f"Google Sheets API error: {error}")
+        except Exception as e:
+            print(f"Error adding to Google Sheets: {e}", file=sys.stderr)
+            raise
+
+    def write_pending_rows(self, manifest):
+        """Write sheet rows an interrupted batch never confirmed; returns how many
+
+        A row that reached Sheets just before the crash is found in the
+        sheet and only marked as written, not sent again.
+        """
+        pending = manifest.pending_sheet_rows()
+        if not pending:
+            return 0
+        if not self.sheets_writer:
+            raise Exception("Google Sheets service not initialized")
+
+        unsent = []
+        for row_index, row in pending:
+            if self.sheets_writer.rows_written([row]):
+                manifest.mark_sheet_row_written(row_index)
+            else:
+                unsent.append((row_index, row))
+
+        futures = self.sheets_writer.submit_many([row for _, row in unsent])
+        self.sheets_writer.flush()
+        for (row_index, _), future in zip(unsent, futures):
+            future.result()
+            manifest.mark_sheet_row_written(row_index)
+        return len(pending)
+
+    def resume(self, manifest, concurrency=DEFAULT_UPLOAD_CONCURRENCY, on_progress=None):
+        """Finish an interrupted batch: upload unfinished files, then write pending sheet rows
+
+        Returns (results, rows_written).
+        """
+        results = self.upload_files(manifest.image_paths(), concurrency, on_progress, manifest)
+        rows_written = self.write_pending_rows(manifest)
+        return results, rows_written
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Retries for B2 uploads
+Exponential backoff with full jitter, Retry-After support and a retry budget
+shared by a whole batch, so that transient B2 errors (503, 429, dropped
+connections) cost a short delay instead of a failed upload, while a B2
+outage can't turn one batch into thousands of retries
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+from upload_metrics import add_timing
+
+# Attempts per upload (the first try included) and backoff bounds, in seconds
+RETRY_MAX_ATTEMPTS = int(os.environ.get('B2_RETRY_ATTEMPTS', '5'))
+RETRY_BASE_DELAY = float(os.environ.get('B2_RETRY_BASE_DELAY', '0.5'))
+RETRY_MAX_DELAY = 30.0
+
+# Retries a batch may spend in total: RETRY_BUDGET_RATIO per file, at least RETRY_BUDGET_MIN
+RETRY_BUDGET_RATIO = float(os.environ.get('B2_RETRY_BUDGET_RATIO', '0.5'))
+RETRY_BUDGET_MIN = 10
+
+# Statuses worth retrying. B2 asks for a new upload URL after any of these
+# except 429, which only means "slow down"
+RETRYABLE_STATUSES = (401, 408, 429, 500, 502, 503, 504)
+
+class RetryableError(Exception):
+    """A transient failure; retry_after is the server's requested wait in seconds, if any"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class RetryBudget:
+    """Number of retries left for a batch, shared by all its threads"""
+
+    def __init__(self, retries):
+        self.remaining = retries
+        self._lock = threading.Lock()
+
+    def spend(self):
+        """Take one retry; False once the budget is used up"""
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+def batch_retry_budget(count):
+    """Retry budget for a batch of count files"""
+    return RetryBudget(max(RETRY_BUDGET_MIN, int(count * RETRY_BUDGET_RATIO)))
+
+_local = threading.local()
+
+def current_budget():
+    """Retry budget of the batch this thread is working for, or None"""
+    return getattr(_local, 'budget', None)
+
+def run_with_budget(budget, function, *args, **kwargs):
+    """Call function in this (worker) thread with budget as its retry budget"""
+    previous = current_budget()
+    _local.budget = budget
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _local.budget = previous
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retryable_status(status, body, headers=None):
+    """RetryableError for a retryable HTTP status, None for anything else"""
+    if status not in RETRYABLE_STATUSES:
+        return None
+    retry_after = parse_retry_after((headers or {}).get('Retry-After'))
+    return RetryableError(f"B2 returned {status}: {body}", retry_after)
+
+def retryable_request_error(error):
+    """RetryableError for a requests exception worth retrying (no response, or a retryable status)"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return RetryableError(str(error) or type(error).__name__)
+    return retryable_status(response.status_code, response.text, response.headers)
+
+def retryable_b2sdk_error(error):
+    """RetryableError for a b2sdk exception it considers transient, None otherwise"""
+    should_retry = getattr(error, 'should_retry_upload', None)
+    if should_retry is None or not should_retry():
+        return None
+    return RetryableError(str(error), getattr(error, 'retry_after_seconds', None))
+
+class RetryPolicy:
+    """How often and how long to wait before retrying a transient failure"""
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, but never shorter than the server asked for"""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            return min(self.max_delay, max(retry_after, backoff))
+        return backoff
+
+    def next_delay(self, attempt, error, budget=None):
+        """Seconds to wait before retrying after a failed attempt (0-based), or None to give up"""
+        if attempt + 1 >= self.max_attempts:
+            return None
+        budget = budget or current_budget()
+        if budget is not None and not budget.spend():
+            return None
+        return self.delay(attempt, getattr(error, 'retry_after', None))
+
+    def call(self, function, budget=None):
+        """Call function(attempt) until it stops raising RetryableError or retries run out
+
+        Any other exception is raised at once. When giving up, the last
+        RetryableError is raised.
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                return function(attempt)
+            except RetryableError as e:
+                wait = self.next_delay(attempt, e, budget)
+                if wait is None:
+                    raise
+                add_timing('retry_wait', wait)
+                time.sleep(wait)
+
+    async def call_async(self, function, budget=None):
+        """call() for a coroutine function"""
+        for attempt in range(self.max_attempts):
+            try:
+                return await function(attempt)
+            except RetryableError as e:
+                wait = self.next_delay(attempt, e, budget)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+
+# Default policy for uploads
+upload_retry_policy = RetryPolicy()
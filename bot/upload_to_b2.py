@@ -5,105 +5,575 @@ Uses direct HTTP uploads for fastest performance
 Includes smart image compression and WebP conversion
 """
 import sys
+import os
 import json
 import hashlib
 import hmac
+import mmap
+import struct
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import tempfile
+import threading
 import time
+import atexit
+import multiprocessing
 from base64 import b64decode
 from io import BytesIO
+from contextlib import contextmanager
+import shutil
+from urllib.parse import quote
+try:
+    import fcntl
+except ImportError:
+    # Windows - the auth cache is then shared without a lock
+    fcntl = None
+
+from dedup_index import (get_dedup_index, hash_bytes, hash_file, SOURCE_HASH_INFO_KEY,
+                          PARAMS_INFO_KEY, ORIGINAL_UPLOAD_PARAMS, CONTENT_ADDRESSED,
+                          CACHE_CONTROL_INFO_KEY, IMMUTABLE_CACHE_CONTROL, content_addressed_params,
+                          is_content_addressed, content_addressed_name)
+from image_probe import probe_image, sniff_content_type
+from upload_metrics import (metrics, collect_timings, add_timings, timed, timings_ms,
+                            start_metrics_server, start_stats_dump, disable_stage_histograms)
+from upload_retry import (RetryableError, RetryPolicy, retryable_status, retryable_request_error,
+                          retryable_b2sdk_error, batch_retry_budget, current_budget,
+                          run_with_budget, upload_retry_policy)
 
 # B2 Configuration
 B2_ACCOUNT_ID = "004f2f7daa17c500000000002"
 B2_APPLICATION_KEY = "K004ozruXnFNNq8cbFRxdYO1HhfJTSs"
 B2_BUCKET_ID = "cf82ffa78d0a1a7197ac0510"
 
+# B2 API endpoint - override to point at a test server (e.g. benchmark_upload.py)
+B2_PRODUCTION_API_URL = 'https://api.backblazeb2.com'
+B2_API_URL = os.environ.get('B2_API_URL', B2_PRODUCTION_API_URL)
+
+# Compression settings
+MAX_DIMENSION = 1920
+
+# WebP encode profiles - method is the encoder effort (0 fastest, 6 smallest output)
+ENCODE_PROFILES = {
+    'fast': {'quality': 80, 'method': 2},
+    'balanced': {'quality': 85, 'method': 4},
+    'max-compression': {'quality': 85, 'method': 6},
+}
+DEFAULT_ENCODE_PROFILE = os.environ.get('B2_ENCODE_PROFILE', 'max-compression')
+
+# Byte-budget mode searches quality in [TARGET_SIZE_MIN_QUALITY, profile quality]
+TARGET_SIZE_MIN_QUALITY = 40
+TARGET_SIZE_MAX_ENCODES = 6
+
+# Rendition sizes generated per upload, e.g. B2_RENDITIONS=1920,960,480,240
+# (unset: a single 1920px image)
+DEFAULT_RENDITIONS = [int(size) for size in os.environ.get('B2_RENDITIONS', '').split(',') if size.strip()] or None
+
+# Reduced-resolution decode: JPEGs are decoded at 1/2, 1/4 or 1/8 scale as long as
+# the result stays at least DRAFT_REDUCING_GAP times the target size, and resize()
+# does a fast integer reduce() down to RESIZE_REDUCING_GAP times the target before LANCZOS
+DRAFT_REDUCING_GAP = 1.5
+RESIZE_REDUCING_GAP = 3.0
+
+# Pass-through: WebPs within MAX_DIMENSION are uploaded without re-encoding if they use at
+# most this many bits per pixel (or fit the request's target_bytes)
+PASSTHROUGH_MAX_BITS_PER_PIXEL = float(os.environ.get('B2_PASSTHROUGH_MAX_BPP', '2.0'))
+
+# HTTP connection pool - keep at least as many connections per host as uploads run at once
+B2_HTTP_POOL_SIZE = int(os.environ.get('B2_HTTP_POOL_SIZE', '32'))
+# Retries for failed connection attempts (a request that reached B2 is never resent here)
+B2_HTTP_CONNECT_RETRIES = int(os.environ.get('B2_HTTP_CONNECT_RETRIES', '2'))
+
+def create_b2_session(pool_size=B2_HTTP_POOL_SIZE, connect_retries=B2_HTTP_CONNECT_RETRIES):
+    """Keep-alive session with a connection pool per host and a connect retry adapter
+
+    Status codes and read errors are not retried by the adapter - the upload
+    code handles those itself (e.g. a 503 needs a new upload URL).
+    """
+    session = requests.Session()
+    retry = Retry(total=connect_retries, connect=connect_retries, read=0, status=0, redirect=0,
+                  backoff_factor=0.25, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Keep-alive session shared by all B2 API calls and threads (reuses TCP/TLS connections)
+b2_session = create_b2_session()
+
+# Upload URL pool configuration
+# Account tokens and upload URLs are valid for 24 hours; refresh an hour early
+B2_AUTH_TTL = 23 * 60 * 60
+B2_UPLOAD_URL_POOL_SIZE = int(os.environ.get('B2_UPLOAD_URL_POOL_SIZE', '8'))
+# Kept in the user's own directory: the file decides where images are uploaded to
+B2_AUTH_CACHE_FILE = os.environ.get(
+    'B2_AUTH_CACHE_FILE',
+    os.path.join(os.path.expanduser('~'), '.image_uploader', 'b2_auth_cache.json')
+)
+
+# Large file settings - B2 parts must be at least 5MB (except the last one)
+B2_LARGE_FILE_THRESHOLD = int(os.environ.get('B2_LARGE_FILE_THRESHOLD', str(16 * 1024 * 1024)))
+B2_LARGE_FILE_PART_SIZE = int(os.environ.get('B2_LARGE_FILE_PART_SIZE', str(8 * 1024 * 1024)))
+B2_MIN_PART_SIZE = 5 * 1024 * 1024
+B2_MAX_PARTS = 10000
+B2_LARGE_FILE_WORKERS = 4
+B2_PART_RETRIES = 3
+part_retry_policy = RetryPolicy(max_attempts=B2_PART_RETRIES)
+
+# Circuit breaker: a backend is skipped after BACKEND_FAILURE_THRESHOLD consecutive
+# failures and probed again with a single upload after BACKEND_COOLDOWN seconds
+BACKEND_FAILURE_THRESHOLD = 3
+BACKEND_COOLDOWN = 60.0
+BACKEND_LATENCY_SMOOTHING = 0.3
+
+# Largest binary frame accepted on stdin (--binary); anything bigger is a corrupt stream
+MAX_FRAME_HEADER_BYTES = 64 * 1024
+MAX_FRAME_IMAGE_BYTES = int(os.environ.get('B2_MAX_FRAME_MB', '512')) * 1024 * 1024
+
+# rclone remote and parallel transfers used for whole-batch uploads
+RCLONE_REMOTE = 'b2:social-feed-image'
+RCLONE_BATCH_TRANSFERS = 32
+
+def authorize_b2_account():
+    """Authorize the account and return the B2 auth data"""
+    auth_response = b2_session.get(
+        f'{B2_API_URL}/b2api/v2/b2_authorize_account',
+        auth=(B2_ACCOUNT_ID, B2_APPLICATION_KEY)
+    )
+    auth_response.raise_for_status()
+    return auth_response.json()
+
+class B2UploadUrlPool:
+    """Shared account authorization plus a pool of reusable upload URLs
+
+    B2 allows only one upload at a time per upload URL, so every concurrent
+    upload takes its own URL/token pair out of the pool and hands it back
+    when done. URLs that B2 rejects (401/503) are dropped, not returned.
+    The account token is shared with other processes through cache_file as
+    soon as it is fetched; idle upload URLs only when this process exits.
+    """
+
+    def __init__(self, pool_size=B2_UPLOAD_URL_POOL_SIZE, cache_file=B2_AUTH_CACHE_FILE):
+        self.pool_size = pool_size
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._auth = None
+        self._auth_expires = 0
+        self._idle = []
+        self._cache_loaded = False
+        if cache_file:
+            # Idle upload URLs are handed over to the next process only once this one is done with them
+            atexit.register(self.save_idle)
+
+    @contextmanager
+    def _cache_file_lock(self):
+        """Hold an exclusive lock on the cache file across processes"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), mode=0o700, exist_ok=True)
+        fd = os.open(f"{self.cache_file}.lock", os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with os.fdopen(fd, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read_cache(self):
+        """The cached auth data, or None if it is missing, expired or for another account
+
+        A file owned by another user is refused - it could point uploads at any host.
+        """
+        if not os.path.exists(self.cache_file):
+            return None
+        with open(self.cache_file, 'r') as f:
+            if hasattr(os, 'getuid') and os.fstat(f.fileno()).st_uid != os.getuid():
+                print(f"Ignoring B2 auth cache owned by another user: {self.cache_file}", file=sys.stderr)
+                return None
+            cached = json.load(f)
+        if cached.get('account_id') != B2_ACCOUNT_ID or cached.get('expires', 0) <= time.time():
+            return None
+        return cached
+
+    def _write_cache(self, auth, expires, upload_urls):
+        """Write the cache file (atomic replace); call with the cache file lock held"""
+        cached = {
+            'account_id': B2_ACCOUNT_ID,
+            'auth': auth,
+            'expires': expires,
+            'upload_urls': upload_urls
+        }
+        temp_path = None
+        try:
+            cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            # mkstemp creates a new file only readable by this user, never an existing one
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=os.path.basename(self.cache_file) + '.',
+                                             suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cached, f)
+            os.replace(temp_path, self.cache_file)
+        except Exception as e:
+            print(f"Could not write B2 auth cache: {str(e)}", file=sys.stderr)
+            if temp_path:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def _load_cache(self):
+        """Claim the auth token and upload URLs left by a previous process"""
+        self._cache_loaded = True
+        if not self.cache_file:
+            return
+        try:
+            with self._cache_file_lock():
+                cached = self._read_cache()
+                if cached is None:
+                    return
+                self._auth = cached['auth']
+                self._auth_expires = cached['expires']
+                self._idle = [tuple(pair) for pair in cached.get('upload_urls', [])]
+                # Take the URLs out of the file so another process can't use them concurrently
+                self._write_cache(self._auth, self._auth_expires, [])
+        except Exception as e:
+            print(f"Ignoring B2 auth cache: {str(e)}", file=sys.stderr)
+
+    def _save_auth(self):
+        """Share a new account token with other processes (upload URLs stay with their owners)"""
+        if not self.cache_file:
+            return
+        try:
+            with self._cache_file_lock():
+                self._write_cache(self._auth, self._auth_expires, [])
+        except Exception as e:
+            print(f"Could not write B2 auth cache: {str(e)}", file=sys.stderr)
+
+    def save_idle(self):
+        """Hand the idle upload URLs over to other processes (at exit)
+
+        They are merged into the cache file under its lock and leave this
+        pool, so no URL is ever usable by two processes at once.
+        """
+        if not self.cache_file:
+            return
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+            auth, expires = self._auth, self._auth_expires
+        if not idle or not auth or expires <= time.time():
+            return
+        try:
+            with self._cache_file_lock():
+                cached = self._read_cache()
+                if cached is not None and cached['auth'].get('authorizationToken') != auth.get('authorizationToken'):
+                    # Another process has re-authorized since - keep its cache, drop our URLs
+                    return
+                upload_urls = [tuple(pair) for pair in (cached or {}).get('upload_urls', [])]
+                for pair in idle:
+                    if len(upload_urls) < self.pool_size and pair not in upload_urls:
+                        upload_urls.append(pair)
+                self._write_cache(auth, expires, upload_urls)
+        except Exception as e:
+            print(f"Could not write B2 auth cache: {str(e)}", file=sys.stderr)
+
+    def get_auth(self):
+        """Return cached account auth data, authorizing if missing or expired"""
+        with self._lock:
+            if not self._cache_loaded:
+                self._load_cache()
+            if self._auth and time.time() < self._auth_expires:
+                return self._auth
+        with timed('auth'):
+            auth_data = authorize_b2_account()
+        with self._lock:
+            self._auth = auth_data
+            self._auth_expires = time.time() + B2_AUTH_TTL
+            # Upload URLs belong to the old authorization
+            self._idle = []
+        self._save_auth()
+        return auth_data
+
+    def invalidate_auth(self):
+        """Forget the account token so the next call re-authorizes"""
+        with self._lock:
+            self._auth = None
+            self._auth_expires = 0
+            self._idle = []
+
+    def _fetch_upload_url(self):
+        """Request a new upload URL, re-authorizing once on an expired token"""
+        for attempt in range(2):
+            auth_data = self.get_auth()
+            with timed('upload_url'):
+                upload_response = b2_session.post(
+                    f"{auth_data['apiUrl']}/b2api/v2/b2_get_upload_url",
+                    headers={'Authorization': auth_data['authorizationToken']},
+                    json={'bucketId': B2_BUCKET_ID}
+                )
+            if upload_response.status_code == 401 and attempt == 0:
+                self.invalidate_auth()
+                continue
+            upload_response.raise_for_status()
+            upload_data = upload_response.json()
+            return upload_data['uploadUrl'], upload_data['authorizationToken']
+
+    def take_idle(self):
+        """Take a pooled upload URL/token pair without fetching a new one, or None"""
+        with self._lock:
+            if not self._cache_loaded:
+                self._load_cache()
+            if self._idle and time.time() < self._auth_expires:
+                return self._idle.pop()
+        return None
+
+    def acquire(self):
+        """Take an upload URL/token pair for exclusive use by one upload"""
+        return self.take_idle() or self._fetch_upload_url()
+
+    def release(self, upload_url, auth_token):
+        """Return a healthy upload URL to the pool"""
+        with self._lock:
+            if len(self._idle) < self.pool_size and (upload_url, auth_token) not in self._idle:
+                self._idle.append((upload_url, auth_token))
+
+    def discard(self, upload_url, auth_token):
+        """Drop an upload URL that B2 rejected"""
+        with self._lock:
+            if (upload_url, auth_token) in self._idle:
+                self._idle.remove((upload_url, auth_token))
+
+# Shared pool used by every upload in this process
+upload_url_pool = B2UploadUrlPool()
+
 def get_b2_upload_url():
     """Get B2 upload URL using API v2 for faster uploads"""
     try:
-        # Authorize account
-        auth_response = requests.get(
-            'https://api.backblazeb2.com/b2api/v2/b2_authorize_account',
-            auth=(B2_ACCOUNT_ID, B2_APPLICATION_KEY)
-        )
-        auth_response.raise_for_status()
-        auth_data = auth_response.json()
-        
-        # Get upload URL
-        upload_response = requests.post(
-            f"{auth_data['apiUrl']}/b2api/v2/b2_get_upload_url",
-            headers={'Authorization': auth_data['authorizationToken']},
-            json={'bucketId': B2_BUCKET_ID}
-        )
-        upload_response.raise_for_status()
-        upload_data = upload_response.json()
-        
-        return upload_data['uploadUrl'], upload_data['authorizationToken']
+        return upload_url_pool.acquire()
     except Exception as e:
         raise Exception(f"Failed to get upload URL: {str(e)}")
 
-def compress_and_optimize_image(image_data, filename):
-    """Compress and convert image to WebP for best performance"""
-    try:
-        from PIL import Image
-        import io
-        
-        # Open image
-        img = Image.open(BytesIO(image_data))
+def b2_api_call(endpoint, body):
+    """POST a JSON request to a B2 API endpoint, re-authorizing once on 401"""
+    for attempt in range(2):
+        auth_data = upload_url_pool.get_auth()
+        response = b2_session.post(
+            f"{auth_data['apiUrl']}/b2api/v2/{endpoint}",
+            headers={'Authorization': auth_data['authorizationToken']},
+            json=body
+        )
+        if response.status_code == 401 and attempt == 0:
+            upload_url_pool.invalidate_auth()
+            continue
+        response.raise_for_status()
+        return response.json()
+
+def fit_within(size, max_dimension=MAX_DIMENSION):
+    """Return size scaled down (keeping aspect ratio) so neither side exceeds max_dimension"""
+    width, height = size
+    if max(width, height) <= max_dimension:
+        return width, height
+    if width > height:
+        return max_dimension, max(1, int(height * (max_dimension / width)))
+    return max(1, int(width * (max_dimension / height))), max_dimension
+
+def resolve_profile(profile=None):
+    """Return the name of an encode profile, raising on unknown names"""
+    profile = profile or DEFAULT_ENCODE_PROFILE
+    if profile not in ENCODE_PROFILES:
+        raise ValueError(f"Unknown encode profile '{profile}' (choose from {', '.join(ENCODE_PROFILES)})")
+    return profile
+
+def encode_webp(img, quality, method):
+    """Encode a PIL image as WebP and return the bytes"""
+    webp_buffer = BytesIO()
+    img.save(webp_buffer, format='WEBP', quality=quality, method=method)
+    return webp_buffer.getvalue()
+
+def encode_webp_to_budget(img, quality, method, target_bytes, max_encodes=TARGET_SIZE_MAX_ENCODES):
+    """Binary-search WebP quality for the best output no larger than target_bytes
+
+    Starts at the profile quality and never goes below TARGET_SIZE_MIN_QUALITY.
+    If nothing fits within max_encodes tries, the smallest output is returned.
+    """
+    data = encode_webp(img, quality, method)
+    if len(data) <= target_bytes:
+        return data
+    
+    best = None
+    smallest = data
+    low, high = TARGET_SIZE_MIN_QUALITY, quality - 1
+    encodes = 1
+    while low <= high and encodes < max_encodes:
+        mid = (low + high) // 2
+        data = encode_webp(img, mid, method)
+        encodes += 1
+        if len(data) <= target_bytes:
+            best = data
+            low = mid + 1
+        else:
+            if len(data) < len(smallest):
+                smallest = data
+            high = mid - 1
+    
+    return best or smallest
+
+def open_original(image_data):
+    """Open image_data (bytes or a memory-mapped file) with PIL, keeping its mode"""
+    from PIL import Image
+    
+    if isinstance(image_data, mmap.mmap):
+        image_data.seek(0)
+        return Image.open(image_data)
+    return Image.open(BytesIO(image_data))
+
+def open_for_resize(image_data, max_dimension=MAX_DIMENSION):
+    """Open an image for downscaling to max_dimension, flattened onto white RGB
+
+    Returns (img, original_dimensions). Large JPEGs come back draft-decoded,
+    so img may be smaller than the original but never smaller than needed.
+    """
+    from PIL import Image
+    
+    with timed('decode'):
+        # Open image (reads the header only) - a memory-mapped file is read in place
+        img = open_original(image_data)
+        original_dimensions = img.size
         
-        # Get original size
-        original_size = len(image_data)
+        # Fast path: let libjpeg skip DCT detail we would throw away when downscaling
+        target_size = fit_within(img.size, max_dimension)
+        if img.format == 'JPEG' and target_size != img.size:
+            img.draft(img.mode, (int(target_size[0] * DRAFT_REDUCING_GAP),
+                                 int(target_size[1] * DRAFT_REDUCING_GAP)))
+        img.load()
         
         # Convert RGBA to RGB if necessary (for JPEG/WebP compatibility)
         if img.mode in ('RGBA', 'LA', 'P'):
             # Create white background
             if img.mode == 'P':
                 img = img.convert('RGBA')
-            
+        
             if img.mode in ('RGBA', 'LA'):
                 background = Image.new('RGB', img.size, (255, 255, 255))
                 if img.mode == 'LA':
                     img = img.convert('RGBA')
                 background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
                 img = background
+    
+    return img, original_dimensions
+
+def resize_to(img, target_size):
+    """High-quality LANCZOS resize, with a fast integer reduce() first for big reductions"""
+    from PIL import Image
+    
+    if img.size == target_size:
+        return img
+    with timed('resize'):
+        return img.resize(target_size, Image.Resampling.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+
+def encode_with_profile(img, profile=None, target_bytes=None):
+    """Encode as WebP with the profile's quality and effort, optionally within a byte budget"""
+    settings = ENCODE_PROFILES[resolve_profile(profile)]
+    with timed('encode'):
+        if target_bytes:
+            return encode_webp_to_budget(img, settings['quality'], settings['method'], target_bytes)
+        return encode_webp(img, settings['quality'], settings['method'])
+
+def rendition_filename(filename, max_dimension, primary=False):
+    """Predictable object name of a rendition: photo.webp, photo_960.webp, ..."""
+    base = filename.rsplit('.', 1)[0]
+    if primary:
+        return f"{base}.webp"
+    return f"{base}_{max_dimension}.webp"
+
+def normalize_renditions(renditions):
+    """Validate a list of rendition sizes and sort it largest first"""
+    sizes = sorted({int(size) for size in renditions}, reverse=True)
+    if not sizes or sizes[-1] <= 0:
+        raise ValueError("Renditions must be a non-empty list of positive sizes")
+    return sizes
+
+def compress_renditions(image_data, filename, renditions, profile=None, target_bytes=None):
+    """Encode one WebP per rendition size from a single decode
+
+    The largest rendition is the primary image (named like the single-image
+    output and subject to target_bytes). Each smaller one is resampled from
+    the previous rendition, not from the original.
+    Returns a list of (max_dimension, data, filename), largest first.
+    """
+    sizes = normalize_renditions(renditions)
+    img, original_dimensions = open_for_resize(image_data, sizes[0])
+    
+    results = []
+    for position, size in enumerate(sizes):
+        img = resize_to(img, fit_within(original_dimensions, size))
+        primary = position == 0
+        webp_data = encode_with_profile(img, profile, target_bytes if primary else None)
+        results.append((size, webp_data, rendition_filename(filename, size, primary)))
+    
+    return results
+
+def is_upload_ready(probe, size, target_bytes=None):
+    """Whether a probed image already is a WebP within the dimension and size targets"""
+    if not probe or probe[0] != 'WEBP' or not probe[1]:
+        return False
+    width, height = probe[1]
+    if not width or not height or max(width, height) > MAX_DIMENSION:
+        return False
+    if target_bytes:
+        return size <= target_bytes
+    return size * 8 <= PASSTHROUGH_MAX_BITS_PER_PIXEL * width * height
+
+def compress_and_optimize_image(image_data, filename, profile=None, target_bytes=None):
+    """Compress and convert image to WebP for best performance
+
+    profile selects the encoder speed/size trade-off (see ENCODE_PROFILES).
+    With target_bytes, quality is lowered as needed to fit the byte budget.
+    Returns (data, content_type, filename); content_type and filename are
+    None if the original is kept because it couldn't be compressed.
+    """
+    try:
+        # Get original size
+        original_size = len(image_data)
         
-        # Determine target size based on dimensions
-        width, height = img.size
-        max_dimension = max(width, height)
-        
-        # Resize if too large (keep aspect ratio)
-        if max_dimension > 1920:
-            if width > height:
-                new_width = 1920
-                new_height = int(height * (1920 / width))
-            else:
-                new_height = 1920
-                new_width = int(width * (1920 / height))
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Fast path: a WebP that already meets the targets is uploaded as it is,
+        # without decoding or re-encoding it
+        probe = probe_image(image_data)
+        if is_upload_ready(probe, original_size, target_bytes):
+            return image_data, 'image/webp', filename.rsplit('.', 1)[0] + '.webp'
         
-        # Save as WebP with optimal quality
-        webp_buffer = BytesIO()
+        img, original_dimensions = open_for_resize(image_data)
         
-        # Calculate quality based on size
-        # Smaller files: higher quality, larger files: more compression
-        quality = 85  # Default quality
+        # Resize if too large (keep aspect ratio) - the target is computed from the
+        # original dimensions so a draft-decoded image ends up at the same size
+        img = resize_to(img, fit_within(original_dimensions))
         
-        img.save(webp_buffer, format='WEBP', quality=quality, method=6)
-        webp_data = webp_buffer.getvalue()
+        # Save as WebP with the profile's quality and effort
+        webp_data = encode_with_profile(img, profile, target_bytes)
         
         # If WebP is larger than original, use original with slight compression
         if len(webp_data) > original_size * 0.9 and original_size < 2 * 1024 * 1024:
             # Try optimizing original format instead
-            if 'image/jpeg' in filename or 'image/jpg' in filename:
+            source_format = probe[0] if probe else None
+            if source_format == 'JPEG':
                 jpeg_buffer = BytesIO()
                 img.save(jpeg_buffer, format='JPEG', quality=92, optimize=True)
-                return jpeg_buffer.getvalue(), 'image/jpeg'
-            elif 'image/png' in filename:
+                optimized = jpeg_buffer.getvalue()
+                if len(optimized) < original_size:
+                    return optimized, 'image/jpeg', filename
+            elif source_format == 'PNG':
+                # img was flattened onto white - save from the original pixels to keep transparency
+                png_img = open_original(image_data)
+                if png_img.size != img.size:
+                    if png_img.mode in ('P', 'LA'):
+                        png_img = png_img.convert('RGBA')
+                    png_img = resize_to(png_img, img.size)
                 png_buffer = BytesIO()
-                img.save(png_buffer, format='PNG', optimize=True, compress_level=6)
+                png_img.save(png_buffer, format='PNG', optimize=True, compress_level=6)
                 optimized = png_buffer.getvalue()
                 if len(optimized) < original_size:
-                    return optimized, 'image/png'
+                    return optimized, 'image/png', filename
         
         # Return WebP format with .webp extension
         new_filename = filename.rsplit('.', 1)[0] + '.webp'
@@ -114,53 +584,267 @@ def compress_and_optimize_image(image_data, filename):
         print(f"Compression failed: {str(e)}, using original", file=sys.stderr)
         return image_data, None, None
 
-def upload_direct_to_b2(image_data, filename, content_type):
-    """Upload directly to B2 using API v2 for maximum speed"""
-    try:
-        # Get upload URL
-        upload_url, auth_token = get_b2_upload_url()
+def compression_params_key(profile=None, target_bytes=None, renditions=None, content_addressed=None):
+    """Identify the compression settings, so a settings change misses the dedup index
+
+    content_addressed (default CONTENT_ADDRESSED) selects content-addressed
+    object names, which are part of the key too.
+    """
+    settings = ENCODE_PROFILES[resolve_profile(profile)]
+    sizes = normalize_renditions(renditions) if renditions else [MAX_DIMENSION]
+    key = f"webp:q{settings['quality']}:m{settings['method']}:max{sizes[0]}"
+    if len(sizes) > 1:
+        key += ":r" + "-".join(str(size) for size in sizes[1:])
+    if target_bytes:
+        key += f":budget{int(target_bytes)}"
+    return with_naming(key, content_addressed)
+
+def with_naming(params, content_addressed=None):
+    """params, marked for content-addressed names if requested (default CONTENT_ADDRESSED)"""
+    if content_addressed is None:
+        content_addressed = CONTENT_ADDRESSED
+    return content_addressed_params(params) if content_addressed else params
+
+def object_name(filename, content_hash, params):
+    """Name to upload an image under: its own name, or one derived from its content"""
+    if is_content_addressed(params):
+        return content_addressed_name(filename, content_hash, params)
+    return filename
+
+def upload_file_info(content_hash=None, params=None):
+    """B2 file info for an upload: source hash and parameters, and the cache header of
+    content-addressed objects"""
+    file_info = {}
+    if content_hash:
+        file_info = {SOURCE_HASH_INFO_KEY: content_hash, PARAMS_INFO_KEY: params or compression_params_key()}
+    if is_content_addressed(params):
+        file_info[CACHE_CONTROL_INFO_KEY] = IMMUTABLE_CACHE_CONTROL
+    return file_info
+
+def cdn_url_for(filename):
+    """BunnyCDN URL for a file in the bucket"""
+    return f"https://leakurge.b-cdn.net/{filename}"
+
+def b2_upload_headers(auth_token, filename, content_type, file_info=None):
+    """Headers for a b2_upload_file request"""
+    headers = {
+        'Authorization': auth_token,
+        'X-Bz-File-Name': filename,
+        'Content-Type': content_type,
+        'X-Bz-Content-Sha1': 'do_not_verify',  # Faster - skip SHA1 check
+        'X-Bz-Upload-Timestamp': str(int(time.time() * 1000))
+    }
+    for key, value in (file_info or {}).items():
+        headers[f'X-Bz-Info-{key}'] = quote(str(value), safe='')
+    return headers
+
+def upload_direct_to_b2(image_data, filename, content_type, file_info=None, upload_info=None):
+    """Upload directly to B2 using API v2 for maximum speed
+
+    file_info is stored as B2 file info (X-Bz-Info-*). If upload_info is a
+    dict it receives the new 'file_id' on success. Transient errors are
+    retried with backoff; every retry after a 401/5xx or a dropped
+    connection uses a fresh upload URL, as B2 requires.
+    """
+    def attempt(number):
+        # Get upload URL from the shared pool
+        try:
+            upload_url, auth_token = upload_url_pool.acquire()
+        except requests.RequestException as e:
+            raise retryable_request_error(e) or Exception(f"Failed to get upload URL: {str(e)}")
         
         # Prepare headers
-        headers = {
-            'Authorization': auth_token,
-            'X-Bz-File-Name': filename,
-            'Content-Type': content_type,
-            'X-Bz-Content-Sha1': 'do_not_verify',  # Faster - skip SHA1 check
-            'X-Bz-Upload-Timestamp': str(int(time.time() * 1000))
-        }
+        headers = b2_upload_headers(auth_token, filename, content_type, file_info)
         
         # Upload directly (no buffering)
-        response = requests.post(
-            upload_url,
-            headers=headers,
-            data=image_data,
-            timeout=30
-        )
+        try:
+            with timed('upload'):
+                response = b2_session.post(
+                    upload_url,
+                    headers=headers,
+                    data=image_data,
+                    timeout=30
+                )
+        except requests.RequestException as e:
+            upload_url_pool.discard(upload_url, auth_token)
+            raise RetryableError(str(e) or type(e).__name__)
+        
+        error = retryable_status(response.status_code, response.text, response.headers)
+        if error:
+            # 429 only asks us to slow down - the URL itself is still good
+            if response.status_code == 429:
+                upload_url_pool.release(upload_url, auth_token)
+            else:
+                upload_url_pool.discard(upload_url, auth_token)
+            raise error
         
+        upload_url_pool.release(upload_url, auth_token)
         response.raise_for_status()
+        return response
+    
+    try:
+        response = upload_retry_policy.call(attempt)
+        if upload_info is not None:
+            upload_info['file_id'] = response.json().get('fileId')
         
         # Return CDN URL
-        cdn_url = f"https://leakurge.b-cdn.net/{filename}"
+        cdn_url = cdn_url_for(filename)
         return cdn_url, None
         
     except Exception as e:
         return None, str(e)
 
-def upload_with_rclone_fast(temp_file_path, filename):
-    """Fast rclone upload with aggressive settings"""
+def _large_file_part_size(total_size):
+    """Part size that respects B2's minimum part size and maximum part count"""
+    part_size = max(B2_LARGE_FILE_PART_SIZE, B2_MIN_PART_SIZE)
+    return max(part_size, -(-total_size // B2_MAX_PARTS))
+
+def _read_part(source, offset, length):
+    """Read one part from a file path or slice it out of an in-memory buffer"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source)[offset:offset + length]
+    with open(source, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+def _upload_part(file_id, source, part_number, offset, length, part_urls, part_urls_lock):
+    """Upload one part with retries, returning its SHA1"""
+    data = _read_part(source, offset, length)
+    sha1 = hashlib.sha1(data).hexdigest()
+    
+    def attempt(number):
+        # Each part URL may only be used by one thread at a time
+        with part_urls_lock:
+            part_url = part_urls.pop() if part_urls else None
+        if part_url is None:
+            try:
+                upload_data = b2_api_call('b2_get_upload_part_url', {'fileId': file_id})
+            except requests.RequestException as e:
+                raise retryable_request_error(e) or e
+            part_url = (upload_data['uploadUrl'], upload_data['authorizationToken'])
+        
+        try:
+            response = b2_session.post(
+                part_url[0],
+                headers={
+                    'Authorization': part_url[1],
+                    'X-Bz-Part-Number': str(part_number),
+                    'Content-Length': str(len(data)),
+                    'X-Bz-Content-Sha1': sha1
+                },
+                data=bytes(data) if isinstance(data, memoryview) else data,
+                timeout=60
+            )
+        except requests.RequestException as e:
+            # Drop the URL - the connection state is unknown
+            raise RetryableError(f"part {part_number}: {str(e)}")
+        
+        if response.ok or response.status_code == 429:
+            with part_urls_lock:
+                part_urls.append(part_url)
+        if response.ok:
+            return sha1
+        
+        error = retryable_status(response.status_code, response.text, response.headers)
+        if error:
+            raise RetryableError(f"part {part_number}: {str(error)}", error.retry_after)
+        raise Exception(f"part {part_number}: B2 returned {response.status_code}: {response.text}")
+    
+    return part_retry_policy.call(attempt)
+
+def upload_large_file_to_b2(source, filename, content_type, file_info=None, upload_info=None,
+                            max_workers=B2_LARGE_FILE_WORKERS):
+    """Upload a large file in parallel parts using the B2 large file API
+
+    source is either a file path (parts are streamed from disk) or an
+    in-memory buffer. Each part is retried on its own; the whole file is
+    cancelled if any part gives up.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    file_id = None
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            total_size = len(source)
+        else:
+            total_size = os.path.getsize(source)
+        part_size = _large_file_part_size(total_size)
+        parts = [
+            (number, offset, min(part_size, total_size - offset))
+            for number, offset in enumerate(range(0, total_size, part_size), start=1)
+        ]
+        if len(parts) < 2:
+            return None, "file too small for the large file API"
+        
+        start_data = b2_api_call('b2_start_large_file', {
+            'bucketId': B2_BUCKET_ID,
+            'fileName': filename,
+            'contentType': content_type,
+            'fileInfo': file_info or {}
+        })
+        file_id = start_data['fileId']
+        
+        part_urls = []
+        part_urls_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(parts)))) as executor:
+            futures = [
+                executor.submit(_upload_part, file_id, source, number, offset, length,
+                                part_urls, part_urls_lock)
+                for number, offset, length in parts
+            ]
+            try:
+                part_sha1s = [future.result() for future in futures]
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        b2_api_call('b2_finish_large_file', {'fileId': file_id, 'partSha1Array': part_sha1s})
+        if upload_info is not None:
+            upload_info['file_id'] = file_id
+        
+        return cdn_url_for(filename), None
+        
+    except Exception as e:
+        if file_id:
+            try:
+                b2_api_call('b2_cancel_large_file', {'fileId': file_id})
+            except Exception:
+                pass
+        return None, str(e)
+
+_rclone_available = None
+
+def rclone_available():
+    """Check once per process whether rclone can be run"""
+    global _rclone_available
+    if _rclone_available is None:
+        import subprocess
+        try:
+            result = subprocess.run(['rclone', 'version'], capture_output=True, timeout=3)
+            _rclone_available = result.returncode == 0
+        except Exception:
+            _rclone_available = False
+    return _rclone_available
+
+def upload_with_rclone_fast(temp_file_path, filename, cache_control=None, file_info=None):
+    """Fast rclone upload with aggressive settings
+
+    file_info is sent as X-Bz-Info-* upload headers, so the dedup index
+    can be rebuilt from rclone uploads too.
+    """
     try:
         import subprocess
         
         # Check if rclone is available
-        result = subprocess.run(['rclone', 'version'], capture_output=True, timeout=3)
-        if result.returncode != 0:
+        if not rclone_available():
             return None, "rclone not found"
         
         # Aggressive speed settings
         rclone_cmd = [
             'rclone', 'copyto',
             temp_file_path,
-            f'b2:social-feed-image/{filename}',
+            f'{RCLONE_REMOTE}/{filename}',
             '--transfers=32',
             '--checkers=32',
             '--no-check-dest',
@@ -172,6 +856,11 @@ def upload_with_rclone_fast(temp_file_path, filename):
             '--timeout=60s',
             '--retries=1'
         ]
+        if cache_control:
+            rclone_cmd.append(f'--header-upload=Cache-Control: {cache_control}')
+        for key, value in (file_info or {}).items():
+            if key != CACHE_CONTROL_INFO_KEY:
+                rclone_cmd.append(f'--header-upload=X-Bz-Info-{key}: {quote(str(value), safe="")}')
         
         result = subprocess.run(
             rclone_cmd, 
@@ -181,7 +870,7 @@ def upload_with_rclone_fast(temp_file_path, filename):
         )
         
         if result.returncode == 0:
-            cdn_url = f"https://leakurge.b-cdn.net/{filename}"
+            cdn_url = cdn_url_for(filename)
             return cdn_url, None
         else:
             return None, f"rclone failed: {result.stderr}"
@@ -189,93 +878,859 @@ def upload_with_rclone_fast(temp_file_path, filename):
     except Exception as e:
         return None, str(e)
 
-def upload_with_b2sdk_optimized(image_data, filename, content_type):
-    """Optimized b2sdk with minimal overhead"""
+def parse_rclone_json_log(output):
+    """Split rclone --use-json-log output into (copied names, {name: error})"""
+    copied = set()
+    errors = {}
+    for line in output.splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(entry, dict) or not entry.get('object'):
+            continue
+        name = entry['object']
+        if entry.get('level') == 'error':
+            errors[name] = entry.get('msg', 'rclone error')
+        elif str(entry.get('msg', '')).startswith('Copied'):
+            copied.add(name)
+    # A file that failed and then succeeded on rclone's own retry is fine
+    for name in copied:
+        errors.pop(name, None)
+    return copied, errors
+
+def upload_batch_with_rclone(files, cache_control=None):
+    """Upload many files with a single rclone process
+
+    files is a list of (data, filename) with unique filenames, where data
+    is bytes or a path on disk. They are staged in one temp directory and sent with one
+    "rclone copy", so its parallel transfers are actually used. Returns
+    {filename: (cdn_url, error)} built from rclone's JSON log.
+
+    Upload headers apply to the whole copy, so these files carry no
+    per-file src_sha256/upload_params info and --rebuild-index can't
+    re-create their dedup entries (the local index still records them).
+    """
+    import subprocess
+    
+    if not rclone_available():
+        return {filename: (None, "rclone not found") for _, filename in files}
+    
+    staging_dir = tempfile.mkdtemp(prefix='b2_rclone_batch_')
     try:
-        from b2sdk.v1 import InMemoryAccountInfo, B2Api
+        # Stage the batch - hard link files already on disk instead of copying them
+        for data, filename in files:
+            staged_path = os.path.join(staging_dir, filename)
+            # Names with a "/" go into that folder of the bucket
+            os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+            if isinstance(data, str):
+                try:
+                    os.link(data, staged_path)
+                except OSError:
+                    shutil.copyfile(data, staged_path)
+            else:
+                with open(staged_path, 'wb') as f:
+                    f.write(data)
         
-        # Initialize B2 API once
-        info = InMemoryAccountInfo()
-        b2_api = B2Api(info)
-        b2_api.authorize_account("production", B2_ACCOUNT_ID, B2_APPLICATION_KEY)
+        rclone_cmd = [
+            'rclone', 'copy',
+            staging_dir,
+            RCLONE_REMOTE,
+            f'--transfers={RCLONE_BATCH_TRANSFERS}',
+            f'--checkers={RCLONE_BATCH_TRANSFERS}',
+            '--no-check-dest',
+            '--no-traverse',
+            '--buffer-size=128M',
+            '--use-server-modtime',
+            '--use-json-log',
+            '--log-level=INFO',
+            '--stats=0',
+            '--timeout=60s',
+            '--retries=1'
+        ]
+        if cache_control:
+            rclone_cmd.append(f'--header-upload=Cache-Control: {cache_control}')
         
-        # Get bucket
-        bucket = b2_api.get_bucket_by_id(B2_BUCKET_ID)
+        try:
+            result = subprocess.run(
+                rclone_cmd,
+                capture_output=True,
+                text=True,
+                timeout=90 + 5 * len(files)
+            )
+        except Exception as e:
+            return {filename: (None, str(e)) for _, filename in files}
         
-        # Upload directly from memory (no temp file)
-        file_info = bucket.upload_bytes(
-            image_data,
-            filename,
-            content_type=content_type
-        )
+        copied, errors = parse_rclone_json_log(result.stderr)
+        outcome = {}
+        for _, filename in files:
+            if filename in copied:
+                outcome[filename] = (cdn_url_for(filename), None)
+            elif filename in errors:
+                outcome[filename] = (None, f"rclone failed: {errors[filename]}")
+            elif result.returncode == 0:
+                # Nothing logged against it and rclone exited cleanly
+                outcome[filename] = (cdn_url_for(filename), None)
+            else:
+                outcome[filename] = (None, f"rclone failed: {result.stderr[-500:]}")
+        return outcome
+    
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+_b2sdk_bucket = None
+_b2sdk_lock = threading.Lock()
+
+def get_b2sdk_bucket():
+    """Authorized b2sdk bucket, created once per process and shared by all threads
+
+    b2sdk keeps its own connection pool and renews the account token itself.
+    """
+    global _b2sdk_bucket
+    with _b2sdk_lock:
+        if _b2sdk_bucket is None:
+            from b2sdk.v1 import InMemoryAccountInfo, B2Api
+            
+            info = InMemoryAccountInfo()
+            b2_api = B2Api(info)
+            realm = "production" if B2_API_URL == B2_PRODUCTION_API_URL else B2_API_URL
+            b2_api.authorize_account(realm, B2_ACCOUNT_ID, B2_APPLICATION_KEY)
+            _b2sdk_bucket = b2_api.get_bucket_by_id(B2_BUCKET_ID)
+        return _b2sdk_bucket
+
+def upload_with_b2sdk_optimized(image_data, filename, content_type, file_info=None, upload_info=None):
+    """Optimized b2sdk with minimal overhead"""
+    try:
+        # Reuse the authorized B2 API instance
+        bucket = get_b2sdk_bucket()
+        
+        def attempt(number):
+            try:
+                if isinstance(image_data, str):
+                    # File path - b2sdk streams it and splits large files itself
+                    return bucket.upload_local_file(
+                        local_file=image_data,
+                        file_name=filename,
+                        content_type=content_type,
+                        file_infos=file_info or {}
+                    )
+                # Upload directly from memory (no temp file)
+                return bucket.upload_bytes(
+                    image_data,
+                    filename,
+                    content_type=content_type,
+                    file_infos=file_info or {}
+                )
+            except Exception as e:
+                raise retryable_b2sdk_error(e) or e
+        
+        uploaded = upload_retry_policy.call(attempt)
+        if upload_info is not None:
+            upload_info['file_id'] = uploaded.id_
         
         # Return CDN URL
-        cdn_url = f"https://leakurge.b-cdn.net/{filename}"
+        cdn_url = cdn_url_for(filename)
         return cdn_url, None
         
     except Exception as e:
         return None, str(e)
 
-def upload_image(image_data, filename, content_type):
-    """Upload with fastest available method and compression"""
+def prepare_upload(image_data, filename, content_type, profile=None, target_bytes=None):
+    """Compress an image and return the (data, filename, content_type) to upload"""
+    compressed_data, new_content_type, new_filename = compress_and_optimize_image(
+        image_data, filename, profile, target_bytes)
+    
+    # Use compressed (or passed-through) data; an original that is kept keeps its
+    # name, but is labelled with the type its bytes actually have
+    image_data = compressed_data
+    content_type = new_content_type or sniff_content_type(image_data) or content_type
+    if new_filename:
+        filename = new_filename
+    
+    return image_data, filename, content_type
+
+def prepare_renditions(image_data, filename, content_type, renditions, profile=None, target_bytes=None):
+    """Compress an image into renditions, returning (max_dimension, data, filename, content_type) tuples
+
+    If the image can't be decoded, the original is returned as the only
+    entry with max_dimension None.
+    """
+    try:
+        return [
+            (size, data, rendition_name, 'image/webp')
+            for size, data, rendition_name in compress_renditions(
+                image_data, filename, renditions, profile, target_bytes)
+        ]
+    except Exception as e:
+        print(f"Compression failed: {str(e)}, using original", file=sys.stderr)
+        return [(None, image_data, filename, sniff_content_type(image_data) or content_type)]
+
+def _compress_job(index, image_data, filename, content_type, profile=None, target_bytes=None,
+                  renditions=None):
+    """Process pool entry point - returns the job index, the prepared upload and its stage timings"""
+    with collect_timings() as timings:
+        if renditions:
+            prepared = prepare_renditions(image_data, filename, content_type, renditions,
+                                          profile, target_bytes)
+        else:
+            prepared = prepare_upload(image_data, filename, content_type, profile, target_bytes)
+    return index, prepared, timings
+
+def available_cpus():
+    """Number of cores this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+def compress_process_context():
+    """Start method for compression workers
+
+    Never fork: in --serve other threads are uploading, and a lock one of
+    them holds would stay locked forever in the forked child.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+def compress_images_parallel(items, max_workers=None, profile=None, target_bytes=None, renditions=None):
+    """Compress (image_data, filename, content_type) items on a process pool
+
+    Yields (index, (data, filename, content_type), timings) as each job
+    finishes, so uploads can start before the whole batch is encoded. With
+    renditions, the second element is the prepare_renditions list instead.
+    timings holds the seconds spent per stage (decode, resize, encode).
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
+    items = list(items)
+    max_workers = min(max_workers or available_cpus(), len(items)) if items else 1
+    
+    # Not worth a process pool for a single image or single core
+    if max_workers <= 1:
+        for index, (image_data, filename, content_type) in enumerate(items):
+            yield _compress_job(index, image_data, filename, content_type,
+                                profile, target_bytes, renditions)
+        return
+    
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=compress_process_context(),
+                             initializer=disable_stage_histograms) as executor:
+        futures = {
+            executor.submit(_compress_job, index, image_data, filename, content_type,
+                            profile, target_bytes, renditions): index
+            for index, (image_data, filename, content_type) in enumerate(items)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                index, prepared, timings = future.result()
+            except Exception as e:
+                # Worker died - upload the original like compress_and_optimize_image does
+                print(f"Compression failed: {str(e)}, using original", file=sys.stderr)
+                if renditions:
+                    yield index, [(None,) + tuple(items[index])], {}
+                else:
+                    yield index, items[index], {}
+                continue
+            # Stage histograms live in this process, not the worker's
+            for stage, seconds in timings.items():
+                metrics.observe_stage(stage, seconds)
+            yield index, prepared, timings
+
+def upload_images_batch(items, compress_workers=None, upload_workers=4, profile=None, target_bytes=None,
+                        renditions=None, content_addressed=None):
+    """Compress on all cores and upload each image as soon as it is encoded
+
+    Returns one upload_image-style result per item, in input order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    items = list(items)
+    results = [None] * len(items)
+    profile = resolve_profile(profile)
+    renditions = renditions or DEFAULT_RENDITIONS
+    if renditions:
+        renditions = normalize_renditions(renditions)
+    params = compression_params_key(profile, target_bytes, renditions, content_addressed)
+    
+    # Images already in the bucket skip both compression and upload
+    timings = [{} for _ in items]
+    pending = find_pending_uploads(items, params, renditions, results, timings)
+    # Transient errors are retried, but the whole batch shares one retry budget
+    budget = batch_retry_budget(len(pending))
+    
+    with ThreadPoolExecutor(max_workers=max(1, upload_workers)) as executor:
+        futures = {}
+        pending_items = pending_upload_items(items, pending, params)
+        for position, prepared, compress_timings in compress_images_parallel(
+                pending_items, compress_workers, profile, target_bytes, renditions):
+            index, content_hash = pending[position]
+            add_stage_timings(timings[index], compress_timings)
+            if renditions:
+                future = executor.submit(run_with_budget, budget, run_collecting_timings, timings[index],
+                                         upload_renditions, prepared, content_hash=content_hash,
+                                         params=params)
+            else:
+                future = executor.submit(run_with_budget, budget, run_collecting_timings, timings[index],
+                                         upload_prepared, *prepared, content_hash=content_hash,
+                                         params=params)
+            futures[future] = index
+        for future, index in futures.items():
+            results[index] = future.result()
+    
+    return [
+        with_result_metrics(result, timings[index], len(items[index][0]))
+        for index, result in enumerate(results)
+    ]
+
+def find_pending_uploads(items, params, renditions, results, timings):
+    """Fill results with dedup hits and return (index, content_hash) for the rest"""
+    pending = []
+    for index, (image_data, filename, content_type) in enumerate(items):
+        with collect_timings(timings[index]):
+            with timed('hash'):
+                content_hash = hash_bytes(image_data)
+            with timed('dedup'):
+                results[index] = lookup_dedup(content_hash, params, renditions)
+        if results[index] is None:
+            pending.append((index, content_hash))
+    return pending
+
+def pending_upload_items(items, pending, params):
+    """The items still to upload, under the object names they get"""
+    return [
+        (items[index][0], object_name(items[index][1], content_hash, params), items[index][2])
+        for index, content_hash in pending
+    ]
+
+def add_stage_timings(timings, extra):
+    """Add the stage -> seconds entries of extra to timings"""
+    for stage, seconds in extra.items():
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+def run_collecting_timings(timings, function, *args, **kwargs):
+    """Call function in this (worker) thread, adding its stage timings to timings"""
+    with collect_timings(timings):
+        return function(*args, **kwargs)
+
+def with_result_metrics(result, timings, bytes_in):
+    """Attach stage timings (ms), input/output sizes and the compression ratio to a result"""
+    result['timings'] = timings_ms(timings)
+    result['bytes_in'] = bytes_in
+    if result.get('bytes_out') and bytes_in:
+        result['compression_ratio'] = round(result['bytes_out'] / bytes_in, 4)
+    return result
+
+def upload_images_batch_rclone(items, compress_workers=None, profile=None, target_bytes=None,
+                               renditions=None, content_addressed=None, upload_workers=4):
+    """Compress a whole batch, then upload it with one rclone process
+
+    Files rclone reports as failed (or all of them, without rclone) go
+    through the normal upload fallback chain on upload_workers threads.
+    Returns one upload_image-style result per item, in input order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    items = list(items)
+    results = [None] * len(items)
+    profile = resolve_profile(profile)
+    renditions = renditions or DEFAULT_RENDITIONS
+    if renditions:
+        renditions = normalize_renditions(renditions)
+    params = compression_params_key(profile, target_bytes, renditions, content_addressed)
+    
+    # Images already in the bucket skip both compression and upload
+    timings = [{} for _ in items]
+    pending = find_pending_uploads(items, params, renditions, results, timings)
+    
+    # Every item becomes a list of (max_dimension, data, filename, content_type) files
+    prepared_items = {}
+    pending_items = pending_upload_items(items, pending, params)
+    for position, prepared, compress_timings in compress_images_parallel(
+            pending_items, compress_workers, profile, target_bytes, renditions):
+        prepared_items[position] = prepared if renditions else [(None,) + tuple(prepared)]
+        add_stage_timings(timings[pending[position][0]], compress_timings)
+    
+    # Each object name goes into the rclone copy once; files repeating a
+    # name are uploaded after it, one by one, so the last one wins as usual
+    batch_files = []
+    batch_names = set()
+    batched = set()
+    for position, prepared in sorted(prepared_items.items()):
+        for rendition_position, (_, data, name, _) in enumerate(prepared):
+            if name not in batch_names:
+                batch_names.add(name)
+                batch_files.append((data, name))
+                batched.add((position, rendition_position))
+    
+    budget = batch_retry_budget(len(pending))
+    outcome = {}
+    if pending:
+        started = time.time()
+        outcome = upload_batch_with_rclone(batch_files, upload_file_info(params=params).get(CACHE_CONTROL_INFO_KEY))
+        # One process uploads everything, so every file is charged the whole run
+        batch_seconds = time.time() - started
+    
+    uploads = {}
+    retries = {}  # object name -> [(position, rendition position)] in batch order
+    for position, (index, content_hash) in enumerate(pending):
+        uploads[position] = []
+        for rendition_position, (size, data, name, content_type) in enumerate(prepared_items[position]):
+            if (position, rendition_position) in batched:
+                cdn_url, error = outcome.get(name, (None, "not uploaded"))
+                metrics.observe_upload("rclone_batch", cdn_url is not None, batch_seconds, len(data))
+            else:
+                cdn_url, error = None, "object name repeated in the batch"
+            if cdn_url:
+                uploads[position].append({
+                    "success": True,
+                    "url": cdn_url,
+                    "filename": name,
+                    "file_id": None,
+                    "method": "rclone_batch",
+                    "bytes_out": len(data)
+                })
+            else:
+                print(f"Batch rclone upload of {name} failed ({error}), retrying on its own",
+                      file=sys.stderr)
+                uploads[position].append(None)
+                retries.setdefault(name, []).append((position, rendition_position))
+    
+    def retry_files(files):
+        # Files sharing an object name are uploaded in order, never at the same time
+        for position, rendition_position in files:
+            index, content_hash = pending[position]
+            _, data, name, content_type = prepared_items[position][rendition_position]
+            uploads[position][rendition_position] = run_collecting_timings(
+                timings[index], _upload_prepared, data, name, content_type,
+                content_hash if rendition_position == 0 else None, params)
+    
+    if retries:
+        with ThreadPoolExecutor(max_workers=max(1, upload_workers)) as executor:
+            futures = [executor.submit(run_with_budget, budget, retry_files, files)
+                       for files in retries.values()]
+            for future in futures:
+                future.result()
+    
+    for position, (index, content_hash) in enumerate(pending):
+        if any(upload.get('method') == "rclone_batch" for upload in uploads[position]):
+            add_stage_timings(timings[index], {'upload': batch_seconds})
+        if renditions:
+            results[index] = _combine_renditions(prepared_items[position], uploads[position],
+                                                 content_hash, params)
+        else:
+            results[index] = uploads[position][0]
+            record_dedup(content_hash, uploads[position][0], params)
+    
+    return [
+        with_result_metrics(result, timings[index], len(items[index][0]))
+        for index, result in enumerate(results)
+    ]
+
+def lookup_dedup(content_hash, params=None, renditions=None):
+    """Return an upload result for an image already in the bucket, or None"""
+    index = get_dedup_index()
+    if not index:
+        return None
+    try:
+        entry = index.lookup(content_hash, params or compression_params_key())
+    except Exception as e:
+        print(f"Deduplication lookup failed: {str(e)}", file=sys.stderr)
+        return None
+    if not entry:
+        return None
+    result = {
+        "success": True,
+        "url": entry['url'],
+        "filename": entry['file_name'],
+        "file_id": entry['file_id'],
+        "method": "dedup_cache"
+    }
+    if renditions:
+        # Rendition names are derived from the primary name, so they need no index entries
+        result['renditions'] = []
+        for position, size in enumerate(normalize_renditions(renditions)):
+            rendition_name = rendition_filename(entry['file_name'], size, position == 0)
+            result['renditions'].append({
+                "size": size,
+                "filename": rendition_name,
+                "url": cdn_url_for(rendition_name)
+            })
+    return result
+
+def record_dedup(content_hash, result, params=None):
+    """Add a successful upload to the dedup index"""
+    index = get_dedup_index()
+    if not index or not content_hash or not result.get('success'):
+        return
+    try:
+        index.record(content_hash, params or compression_params_key(), result['filename'],
+                     result['url'], result.get('file_id'))
+    except Exception as e:
+        print(f"Deduplication record failed: {str(e)}", file=sys.stderr)
+
+def list_bucket_files():
+    """Yield (file_name, file_id, file_info) for the latest version of every file"""
+    start_file_name = None
+    while True:
+        body = {'bucketId': B2_BUCKET_ID, 'maxFileCount': 10000}
+        if start_file_name:
+            body['startFileName'] = start_file_name
+        data = b2_api_call('b2_list_file_names', body)
+        for entry in data['files']:
+            if entry.get('action') == 'upload':
+                yield entry['fileName'], entry['fileId'], entry.get('fileInfo', {})
+        start_file_name = data.get('nextFileName')
+        if not start_file_name:
+            break
+
+def sync_dedup_index(rebuild=False):
+    """Verify (and optionally rebuild) the dedup index against the bucket"""
+    index = get_dedup_index()
+    if not index:
+        raise Exception("Deduplication index is disabled")
+    return index.sync_with_bucket(list_bucket_files(), cdn_url_for, rebuild=rebuild)
+
+def upload_image(image_data, filename, content_type, profile=None, target_bytes=None, renditions=None,
+                 content_addressed=None):
+    """Upload with fastest available method and compression
+
+    With renditions (a list of max dimensions), every size is generated from
+    one decode and uploaded; the result lists them under "renditions".
+    With content_addressed (default CONTENT_ADDRESSED), objects are named
+    after the source hash and settings instead of filename.
+    The result carries per-stage "timings" (ms) and "bytes_in"/"bytes_out".
+    """
+    started = time.perf_counter()
+    with collect_timings() as timings:
+        result = _upload_image(image_data, filename, content_type, profile, target_bytes, renditions,
+                               content_addressed)
+    timings['total'] = time.perf_counter() - started
+    return with_result_metrics(result, timings, len(image_data))
+
+def _upload_image(image_data, filename, content_type, profile=None, target_bytes=None, renditions=None,
+                  content_addressed=None):
+    """Compress and upload one image for upload_image"""
     try:
-        import tempfile
-        import os
+        profile = resolve_profile(profile)
+        renditions = renditions or DEFAULT_RENDITIONS
+        if renditions:
+            renditions = normalize_renditions(renditions)
+        params = compression_params_key(profile, target_bytes, renditions, content_addressed)
+        
+        # Step 0: Skip images that are already in the bucket
+        with timed('hash'):
+            content_hash = hash_bytes(image_data)
+        with timed('dedup'):
+            cached = lookup_dedup(content_hash, params, renditions)
+        if cached:
+            return cached
+        filename = object_name(filename, content_hash, params)
+        
+        if renditions:
+            prepared = prepare_renditions(image_data, filename, content_type, renditions,
+                                          profile, target_bytes)
+            return upload_renditions(prepared, content_hash=content_hash, params=params)
         
         # Step 1: Compress and optimize image
-        compressed_data, new_content_type, new_filename = compress_and_optimize_image(image_data, filename)
-        
-        # Use compressed data if available
-        if compressed_data is not image_data:
-            image_data = compressed_data
-            content_type = new_content_type or content_type
-            if new_filename:
-                filename = new_filename
-        
-        # Try 1: Direct B2 API upload (FASTEST)
-        cdn_url, error = upload_direct_to_b2(image_data, filename, content_type)
-        if cdn_url:
+        image_data, filename, content_type = prepare_upload(image_data, filename, content_type,
+                                                            profile, target_bytes)
+        
+        return upload_prepared(image_data, filename, content_type,
+                               content_hash=content_hash, params=params)
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+def upload_prepared(image_data, filename, content_type, content_hash=None, params=None):
+    """Upload already-compressed data with the fastest available method
+
+    content_hash is the SHA-256 of the source image; when given, it is stored
+    as B2 file info and the upload is recorded in the dedup index under
+    params (the current compression settings by default).
+    """
+    result = _upload_prepared(image_data, filename, content_type, content_hash, params)
+    record_dedup(content_hash, result, params)
+    return result
+
+def upload_renditions(prepared, content_hash=None, params=None):
+    """Upload the output of prepare_renditions in parallel
+
+    The first (largest) rendition is the primary image: its URL is the
+    result's "url" and only it is recorded in the dedup index.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    timings = [{} for _ in prepared]
+    # The rendition uploads spend the retry budget of the batch this one belongs to
+    budget = current_budget()
+    with ThreadPoolExecutor(max_workers=len(prepared)) as executor:
+        futures = [
+            executor.submit(run_with_budget, budget, run_collecting_timings, timings[position],
+                            _upload_prepared, data, rendition_name, content_type,
+                            content_hash if position == 0 else None, params)
+            for position, (size, data, rendition_name, content_type) in enumerate(prepared)
+        ]
+        uploads = [future.result() for future in futures]
+    
+    # The uploads ran in other threads - add their time to this thread's collectors
+    for upload_timings in timings:
+        add_timings(upload_timings, observe=False)
+    
+    return _combine_renditions(prepared, uploads, content_hash, params)
+
+def _combine_renditions(prepared, uploads, content_hash=None, params=None):
+    """Merge per-rendition upload results into one result for the primary image"""
+    primary = dict(uploads[0])
+    primary['renditions'] = [
+        {"size": size, "filename": upload.get('filename'), "url": upload.get('url'),
+         "file_id": upload.get('file_id'), "bytes": upload.get('bytes_out')}
+        for (size, _, _, _), upload in zip(prepared, uploads)
+        if size is not None and upload['success']
+    ]
+    primary['bytes_out'] = sum(upload.get('bytes_out') or 0 for upload in uploads)
+    failed = [upload for upload in uploads if not upload['success']]
+    if failed:
+        return {
+            "success": False,
+            "error": failed[0]['error'],
+            "renditions": primary['renditions']
+        }
+    
+    # A failed decode uploads only the original - don't index it as renditions
+    if prepared[0][0] is not None:
+        record_dedup(content_hash, primary, params)
+    return primary
+
+def upload_path(path, filename, content_type, content_addressed=None):
+    """Upload a file from disk unmodified, streaming it if it is large"""
+    started = time.perf_counter()
+    with collect_timings() as timings:
+        result = _upload_path(path, filename, content_type, content_addressed)
+    timings['total'] = time.perf_counter() - started
+    return with_result_metrics(result, timings, os.path.getsize(path) if os.path.exists(path) else None)
+
+def _upload_path(path, filename, content_type, content_addressed=None):
+    """Hash, deduplicate and upload one file for upload_path"""
+    try:
+        params = with_naming(ORIGINAL_UPLOAD_PARAMS, content_addressed)
+        with timed('hash'):
+            content_hash = hash_file(path)
+        with timed('dedup'):
+            cached = lookup_dedup(content_hash, params)
+        if cached:
+            return cached
+        
+        return upload_prepared(path, object_name(filename, content_hash, params), content_type,
+                               content_hash=content_hash, params=params)
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+class BackendSelector:
+    """Per-backend health and latency, used to order the upload fallback chain
+
+    Backends are tried fastest measured latency first; one that has not been
+    measured yet is tried early so it gets measured, and one that failed in the
+    last BACKEND_COOLDOWN seconds goes to the back. After BACKEND_FAILURE_THRESHOLD
+    consecutive failures a backend's circuit opens and it is skipped until
+    BACKEND_COOLDOWN has passed, when one upload is let through as a probe.
+    Callers claim each attempt with begin() and report it with record().
+    """
+
+    def __init__(self, failure_threshold=BACKEND_FAILURE_THRESHOLD, cooldown=BACKEND_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _get(self, backend):
+        if backend not in self._stats:
+            self._stats[backend] = {
+                'successes': 0,
+                'failures': 0,
+                'consecutive_failures': 0,
+                'latency': None,
+                'failed_at': None,
+                'opened_at': None,
+                'probing': False
+            }
+        return self._stats[backend]
+
+    def order(self, backends):
+        """Return the backends to try, best first, leaving out open circuits"""
+        now = time.time()
+        available = []
+        with self._lock:
+            for position, backend in enumerate(backends):
+                stats = self._get(backend)
+                if stats['opened_at'] is not None:
+                    # Cooldown over - listed until an upload claims the probe in begin()
+                    if stats['probing'] or now - stats['opened_at'] < self.cooldown:
+                        continue
+                recently_failed = (stats['consecutive_failures'] > 0 and
+                                   now - stats['failed_at'] < self.cooldown)
+                available.append((recently_failed, stats['latency'] or 0.0, position, backend))
+        if not available:
+            # Everything is failing - trying is still better than failing outright
+            return list(backends)
+        return [backend for _, _, _, backend in sorted(available)]
+
+    def begin(self, backend):
+        """Claim an attempt on backend; False if its circuit is open and another upload is probing it
+
+        Only an attempt that actually starts marks the probe, so a backend
+        listed by order() but never tried (because an earlier one succeeded)
+        stays half-open for the next upload.
+        """
+        with self._lock:
+            stats = self._get(backend)
+            if stats['opened_at'] is None:
+                return True
+            if stats['probing']:
+                return False
+            stats['probing'] = True
+            return True
+
+    def record(self, backend, success, latency):
+        """Record the outcome of one upload attempt"""
+        with self._lock:
+            stats = self._get(backend)
+            stats['probing'] = False
+            if success:
+                stats['successes'] += 1
+                stats['consecutive_failures'] = 0
+                stats['opened_at'] = None
+                if stats['latency'] is None:
+                    stats['latency'] = latency
+                else:
+                    stats['latency'] += BACKEND_LATENCY_SMOOTHING * (latency - stats['latency'])
+            else:
+                stats['failures'] += 1
+                stats['consecutive_failures'] += 1
+                stats['failed_at'] = time.time()
+                if stats['opened_at'] is not None or stats['consecutive_failures'] >= self.failure_threshold:
+                    if stats['opened_at'] is None:
+                        print(f"Upload backend {backend} failing, skipping it for {self.cooldown:.0f}s",
+                              file=sys.stderr)
+                    stats['opened_at'] = time.time()
+
+    def snapshot(self):
+        """Current stats per backend, for status reporting"""
+        now = time.time()
+        with self._lock:
             return {
-                "success": True,
-                "url": cdn_url,
-                "filename": filename,
-                "method": "direct_b2_api"
+                backend: {
+                    'successes': stats['successes'],
+                    'failures': stats['failures'],
+                    'latency_ms': None if stats['latency'] is None else round(stats['latency'] * 1000, 1),
+                    'circuit': 'closed' if stats['opened_at'] is None else (
+                        'half_open' if now - stats['opened_at'] >= self.cooldown else 'open')
+                }
+                for backend, stats in self._stats.items()
             }
+
+# Shared by every upload in this process (and across requests in --serve mode)
+backend_selector = BackendSelector()
+
+# Fallback chain in default order of preference
+UPLOAD_BACKENDS = ('direct_b2_api', 'rclone', 'b2sdk')
+
+def _upload_prepared(image_data, filename, content_type, content_hash=None, params=None):
+    """Run the upload fallback chain for upload_prepared
+
+    image_data may also be a file path; large files are then streamed from
+    disk part by part instead of being loaded into memory.
+    """
+    try:
+        file_info = upload_file_info(content_hash, params)
+        upload_info = {}
         
-        # Try 2: Rclone (if available)
-        temp_dir = tempfile.gettempdir()
-        temp_file_path = os.path.join(temp_dir, filename)
+        if isinstance(image_data, mmap.mmap):
+            # A mapped original that is uploaded unmodified - send a plain copy of it
+            image_data = image_data[:]
         
-        try:
-            with open(temp_file_path, 'wb') as f:
-                f.write(image_data)
+        streamed = isinstance(image_data, str)
+        size = os.path.getsize(image_data) if streamed else len(image_data)
+        if streamed and size <= B2_LARGE_FILE_THRESHOLD:
+            with open(image_data, 'rb') as f:
+                image_data = f.read()
+            streamed = False
+        
+        def try_direct():
+            # Direct B2 API upload (FASTEST) - large files go up in parallel parts
+            if size > B2_LARGE_FILE_THRESHOLD:
+                with timed('upload'):
+                    cdn_url, error = upload_large_file_to_b2(image_data, filename, content_type,
+                                                             file_info, upload_info)
+                return cdn_url, error, "b2_large_file"
+            cdn_url, error = upload_direct_to_b2(image_data, filename, content_type, file_info, upload_info)
+            return cdn_url, error, "direct_b2_api"
+        
+        def try_rclone():
+            # Rclone (if available)
+            cache_control = file_info.get(CACHE_CONTROL_INFO_KEY)
+            if streamed:
+                with timed('upload'):
+                    return upload_with_rclone_fast(image_data, filename, cache_control,
+                                                   file_info) + ("rclone",)
+            
+            # Names may contain "/" (folders in the bucket) - stage under a unique temp name
+            fd, temp_file_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(image_data)
+                
+                with timed('upload'):
+                    return upload_with_rclone_fast(temp_file_path, filename, cache_control,
+                                                   file_info) + ("rclone",)
+            finally:
+                if os.path.exists(temp_file_path):
+                    try:
+                        os.remove(temp_file_path)
+                    except:
+                        pass
+        
+        def try_b2sdk():
+            # b2sdk fallback
+            with timed('upload'):
+                cdn_url, error = upload_with_b2sdk_optimized(image_data, filename, content_type,
+                                                             file_info, upload_info)
+            return cdn_url, error, "b2sdk"
+        
+        attempts = {'direct_b2_api': try_direct, 'rclone': try_rclone, 'b2sdk': try_b2sdk}
+        errors = []
+        
+        # Healthiest, fastest backend first; backends with an open circuit are skipped
+        for backend in backend_selector.order(UPLOAD_BACKENDS):
+            if not backend_selector.begin(backend):
+                continue
+            started = time.time()
+            try:
+                cdn_url, error, method = attempts[backend]()
+            except Exception as e:
+                cdn_url, error, method = None, str(e), backend
+            elapsed = time.time() - started
+            backend_selector.record(backend, cdn_url is not None, elapsed)
+            metrics.observe_upload(method, cdn_url is not None, elapsed, size)
             
-            cdn_url, error = upload_with_rclone_fast(temp_file_path, filename)
             if cdn_url:
                 return {
                     "success": True,
                     "url": cdn_url,
                     "filename": filename,
-                    "method": "rclone"
+                    "file_id": upload_info.get('file_id'),
+                    "method": method,
+                    "bytes_out": size
                 }
-        finally:
-            if os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                except:
-                    pass
-        
-        # Try 3: Fallback to b2sdk
-        cdn_url, error = upload_with_b2sdk_optimized(image_data, filename, content_type)
-        if cdn_url:
-            return {
-                "success": True,
-                "url": cdn_url,
-                "filename": filename,
-                "method": "b2sdk"
-            }
+            errors.append(f"{backend}: {error}")
         
-        raise Exception(error if error else "All upload methods failed")
+        raise Exception("; ".join(errors) if errors else "All upload methods failed")
         
     except Exception as e:
         return {
@@ -283,15 +1738,272 @@ def upload_image(image_data, filename, content_type):
             "error": str(e)
         }
 
-if __name__ == "__main__":
-    try:
-        input_data = json.loads(sys.stdin.read())
-        
+@contextmanager
+def mapped_file(path):
+    """Memory-map a file read-only, so its bytes are never copied into the heap"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped
+            yield b''
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+def read_exactly(stream, size):
+    """Read exactly size bytes into a single buffer; None at a clean EOF before the first byte"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = stream.readinto(view[received:])
+        if not count:
+            if received == 0:
+                return None
+            raise EOFError(f"Frame truncated after {received} of {size} bytes")
+        received += count
+    return buffer
+
+def read_frame(stream):
+    """Read one binary request frame; returns (header, image_data) or None at EOF
+
+    A frame is a 4-byte big-endian header length, a UTF-8 JSON header
+    (the usual request fields plus "length"), then "length" raw image bytes.
+    """
+    prefix = read_exactly(stream, 4)
+    if prefix is None:
+        return None
+    (header_length,) = struct.unpack('>I', prefix)
+    # Checked before anything is allocated - e.g. a JSON line sent by mistake reads as a 2 GB header
+    if header_length > MAX_FRAME_HEADER_BYTES:
+        raise ValueError(f"header of {header_length} bytes is over the {MAX_FRAME_HEADER_BYTES} byte limit")
+    header = json.loads(bytes(read_exactly(stream, header_length) or b'').decode('utf-8'))
+    length = int(header.get('length', 0))
+    if not 0 <= length <= MAX_FRAME_IMAGE_BYTES:
+        raise ValueError(f"image length {length} is outside 0-{MAX_FRAME_IMAGE_BYTES} bytes")
+    image_data = read_exactly(stream, length) if length else None
+    if length and image_data is None:
+        raise EOFError("Frame ended before its image data")
+    return header, image_data
+
+def write_frame(stream, header, image_data):
+    """Write one binary request frame (the counterpart of read_frame)"""
+    header = dict(header, length=len(image_data))
+    encoded = json.dumps(header).encode('utf-8')
+    stream.write(struct.pack('>I', len(encoded)))
+    stream.write(encoded)
+    stream.write(image_data)
+
+def process_request(input_data, image_data=None):
+    """Decode one JSON upload request and upload it
+
+    Optional "profile", "target_bytes" and "renditions" fields select the
+    encode settings, and "content_addressed" the object naming. image_data
+    is the raw image of a binary frame, used instead of a base64 "image" field.
+    """
+    # Status request: {"stats": true} reports backend health and upload metrics
+    # ("format": "prometheus" returns the metrics in Prometheus text format)
+    if input_data.get('stats'):
+        if input_data.get('format') == 'prometheus':
+            return {"success": True, "prometheus": metrics.prometheus_text()}
+        return {"success": True, "backends": backend_selector.snapshot(), "metrics": metrics.snapshot()}
+    
+    profile = input_data.get('profile')
+    target_bytes = input_data.get('target_bytes')
+    renditions = input_data.get('renditions')
+    content_addressed = input_data.get('content_addressed')
+    
+    # Batch request: {"images": [{"image": ..., "filename": ..., "content_type": ...}, ...]}
+    if 'images' in input_data:
+        items = [
+            (b64decode(item['image']), item['filename'], item['content_type'])
+            for item in input_data['images']
+        ]
+        # "engine": "async" keeps up to "concurrency" uploads in flight from one event loop
+        if input_data.get('engine') == 'async':
+            from async_upload import upload_many_blocking, DEFAULT_ASYNC_CONCURRENCY
+            results = upload_many_blocking(items, input_data.get('concurrency', DEFAULT_ASYNC_CONCURRENCY),
+                                           profile=profile, target_bytes=target_bytes,
+                                           renditions=renditions, content_addressed=content_addressed)
+        # "backend": "rclone" sends the whole batch through one rclone process
+        elif input_data.get('backend') == 'rclone':
+            results = upload_images_batch_rclone(items, profile=profile, target_bytes=target_bytes,
+                                                 renditions=renditions,
+                                                 content_addressed=content_addressed,
+                                                 upload_workers=input_data.get('upload_workers', 4))
+        else:
+            results = upload_images_batch(items, upload_workers=input_data.get('upload_workers', 4),
+                                          profile=profile, target_bytes=target_bytes,
+                                          renditions=renditions, content_addressed=content_addressed)
+        return {
+            "success": all(r['success'] for r in results),
+            "results": results
+        }
+    
+    filename = input_data['filename']
+    content_type = input_data['content_type']
+    
+    # File on disk: {"path": ..., "compress": false} uploads it as-is without loading it into memory
+    if 'path' in input_data:
+        if not input_data.get('compress', True):
+            return upload_path(input_data['path'], filename, content_type, content_addressed)
+        with mapped_file(input_data['path']) as image_data:
+            return upload_image(image_data, filename, content_type, profile, target_bytes, renditions,
+                                content_addressed)
+    
+    if image_data is None:
         image_data = b64decode(input_data['image'])
-        filename = input_data['filename']
-        content_type = input_data['content_type']
-        
-        result = upload_image(image_data, filename, content_type)
+    
+    return upload_image(image_data, filename, content_type, profile, target_bytes, renditions,
+                        content_addressed)
+
+def warm_up():
+    """Import codecs and authorize ahead of the first request"""
+    try:
+        from PIL import Image, WebPImagePlugin, JpegImagePlugin, PngImagePlugin
+        Image.init()
+    except Exception as e:
+        print(f"Pillow warm-up failed: {str(e)}", file=sys.stderr)
+    try:
+        upload_url_pool.get_auth()
+    except Exception as e:
+        print(f"B2 warm-up failed: {str(e)}", file=sys.stderr)
+
+def serve(input_stream=sys.stdin, output_stream=sys.stdout, concurrency=1, binary=False):
+    """Process newline-delimited JSON requests until EOF
+
+    Each request is {"id": ..., "image": <base64>, "filename": ..., "content_type": ...}
+    and produces exactly one JSON result line carrying the same "id".
+    Results may be written out of order when concurrency > 1.
+    With binary=True, input_stream is a binary stream of read_frame frames
+    instead of JSON lines; results are still JSON lines.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    write_lock = threading.Lock()
+    
+    def respond(result):
+        with write_lock:
+            output_stream.write(json.dumps(result) + "\n")
+            output_stream.flush()
+    
+    def handle(request, image_data=None):
+        request_id = None
+        try:
+            input_data = json.loads(request) if isinstance(request, str) else request
+            request_id = input_data.get('id')
+            result = process_request(input_data, image_data)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        result['id'] = request_id
+        respond(result)
+    
+    def incoming():
+        """Yield (request, image_data) until EOF"""
+        if not binary:
+            for line in input_stream:
+                line = line.strip()
+                if line:
+                    yield line, None
+            return
+        while True:
+            try:
+                frame = read_frame(input_stream)
+            except Exception as e:
+                # The stream is out of sync - nothing after this can be trusted
+                respond({"success": False, "error": f"Bad frame: {str(e)}", "id": None})
+                return
+            if frame is None:
+                return
+            yield frame
+    
+    warm_up()
+    
+    # At most two requests per worker are read ahead; then reading stdin waits,
+    # so a fast producer can't pile up decoded payloads in memory
+    in_flight = threading.BoundedSemaphore(max(1, concurrency) * 2)
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for request, image_data in incoming():
+            if concurrency > 1:
+                in_flight.acquire()
+                try:
+                    future = executor.submit(handle, request, image_data)
+                except Exception:
+                    in_flight.release()
+                    raise
+                future.add_done_callback(lambda _: in_flight.release())
+            else:
+                handle(request, image_data)
+
+def main(argv=None):
+    """Command line entry point"""
+    global DEFAULT_ENCODE_PROFILE, DEFAULT_RENDITIONS, CONTENT_ADDRESSED
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Upload images to Backblaze B2")
+    parser.add_argument('--serve', action='store_true',
+                        help="read newline-delimited JSON requests from stdin until EOF")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="uploads processed at once in --serve mode")
+    parser.add_argument('--binary', action='store_true',
+                        help="read length-prefixed binary frames (JSON header + raw image) from stdin")
+    parser.add_argument('--metrics-port', type=int,
+                        help="in --serve mode, expose Prometheus metrics on this port at /metrics")
+    parser.add_argument('--stats-interval', type=float,
+                        help="in --serve mode, write a JSON metrics line to stderr every N seconds")
+    parser.add_argument('--profile', choices=sorted(ENCODE_PROFILES),
+                        help=f"default encode profile (currently {DEFAULT_ENCODE_PROFILE})")
+    parser.add_argument('--renditions',
+                        help="default rendition sizes, comma separated (e.g. 1920,960,480,240)")
+    parser.add_argument('--content-addressed', action='store_true',
+                        help="name objects by content hash and mark them immutable for caching")
+    parser.add_argument('--verify-index', action='store_true',
+                        help="drop dedup index entries whose B2 file is gone or replaced")
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help="verify the dedup index and re-add entries from B2 file info")
+    args = parser.parse_args(argv)
+    
+    if args.profile:
+        DEFAULT_ENCODE_PROFILE = args.profile
+    if args.renditions:
+        DEFAULT_RENDITIONS = normalize_renditions(args.renditions.split(','))
+    if args.content_addressed:
+        CONTENT_ADDRESSED = True
+    
+    if args.verify_index or args.rebuild_index:
+        try:
+            summary = sync_dedup_index(rebuild=args.rebuild_index)
+            print(json.dumps(dict(summary, success=True)))
+        except Exception as e:
+            print(json.dumps({"success": False, "error": str(e)}))
+        return
+    
+    if args.serve:
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port)
+        if args.stats_interval:
+            start_stats_dump(args.stats_interval)
+        if args.binary:
+            serve(sys.stdin.buffer, concurrency=args.concurrency, binary=True)
+        else:
+            serve(concurrency=args.concurrency)
+        return
+    
+    try:
+        if args.binary:
+            frame = read_frame(sys.stdin.buffer)
+            if frame is None:
+                raise ValueError("No request frame on stdin")
+            result = process_request(*frame)
+        else:
+            input_data = json.loads(sys.stdin.read())
+            result = process_request(input_data)
         print(json.dumps(result))
     except Exception as e:
         print(json.dumps({"success": False, "error": str(e)}))
+
+if __name__ == "__main__":
+    main()
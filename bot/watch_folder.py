@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Watched-folder ingest
+Polls one or more directories and sends new or changed images through the
+compression and upload pipeline of upload_to_b2.py as they appear. Files
+still being written are left alone until their size and modification time
+settle, and a checkpoint file keeps restarts from reprocessing old files
+"""
+import sys
+import os
+import json
+import time
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import upload_to_b2
+from image_probe import IMAGE_EXTENSIONS, sniff_content_type
+from upload_retry import batch_retry_budget, run_with_budget
+
+# Where the checkpoint of already processed files is kept
+WATCH_CHECKPOINT = os.environ.get(
+    'IMAGE_UPLOADER_WATCH_CHECKPOINT',
+    os.path.join(os.path.expanduser('~'), '.image_uploader', 'watch_checkpoint.json')
+)
+
+# Names used by browsers and copy tools for files that are still arriving
+PARTIAL_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '.download')
+
+DEFAULT_INTERVAL = 5.0
+DEFAULT_SETTLE = 3.0
+DEFAULT_CONCURRENCY = 4
+MAX_ATTEMPTS = 3
+CHECKPOINT_SAVE_INTERVAL = 2.0
+
+def file_key(stat):
+    """What identifies a version of a file: size and modification time"""
+    return [stat.st_size, stat.st_mtime_ns]
+
+def is_candidate(name):
+    """Image files that are not hidden or partial downloads"""
+    lowered = name.lower()
+    return (not name.startswith('.') and lowered.endswith(IMAGE_EXTENSIONS)
+            and not lowered.endswith(PARTIAL_SUFFIXES))
+
+class WatchCheckpoint:
+    """JSON record of processed files (path -> version, state, url), saved atomically"""
+
+    def __init__(self, path=WATCH_CHECKPOINT):
+        self.path = path
+        self.files = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.files = json.load(f).get('files', {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable watch checkpoint: {str(e)}", file=sys.stderr)
+
+    def needs_upload(self, path, key):
+        """True unless this version of the file was uploaded, or failed too often"""
+        with self._lock:
+            entry = self.files.get(path)
+        if not entry or entry.get('key') != key:
+            return True
+        return entry.get('state') == 'failed' and entry.get('attempts', 0) < MAX_ATTEMPTS
+
+    def record(self, path, key, result):
+        """Store the outcome of uploading one version of a file"""
+        with self._lock:
+            previous = self.files.get(path) or {}
+            attempts = previous.get('attempts', 0) + 1 if previous.get('key') == key else 1
+            if result.get('success'):
+                self.files[path] = {'key': key, 'state': 'done', 'url': result.get('url'),
+                                    'uploaded_at': time.time()}
+            else:
+                self.files[path] = {'key': key, 'state': 'failed', 'error': result.get('error'),
+                                    'attempts': attempts}
+            self._dirty = True
+
+    def save(self, force=False):
+        """Write the checkpoint if it changed (at most every CHECKPOINT_SAVE_INTERVAL unless forced)"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._saved_at < CHECKPOINT_SAVE_INTERVAL):
+                return
+            data = json.dumps({'files': self.files}, indent=1)
+            self._dirty = False
+            self._saved_at = time.time()
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+
+class FolderWatcher:
+    """Poll directories and upload stable new or changed images"""
+
+    def __init__(self, directories, checkpoint=None, settle=DEFAULT_SETTLE,
+                 concurrency=DEFAULT_CONCURRENCY, recursive=True, profile=None, target_bytes=None,
+                 renditions=None, content_addressed=None, on_result=None):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        roots = [os.path.basename(directory) for directory in self.directories]
+        if len(set(roots)) != len(roots):
+            # Their files would get the same object names
+            raise ValueError("watched directories must have different names")
+        self.checkpoint = checkpoint if checkpoint is not None else WatchCheckpoint()
+        self.settle = settle
+        self.recursive = recursive
+        self.profile = profile
+        self.target_bytes = target_bytes
+        self.renditions = renditions
+        self.content_addressed = content_addressed
+        self.on_result = on_result
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        self._pending = {}      # path -> (key, first time this key was seen)
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _walk(self):
+        """Yield (path, stat) for candidate images in the watched directories"""
+        stack = list(self.directories)
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                print(f"Cannot scan {directory}: {str(e)}", file=sys.stderr)
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive and not entry.name.startswith('.'):
+                            stack.append(entry.path)
+                    elif entry.is_file() and is_candidate(entry.name):
+                        yield entry.path, entry.stat()
+                except OSError:
+                    continue
+
+    def scan(self):
+        """Return the files that are new or changed and have stopped changing"""
+        now = time.time()
+        ready = []
+        seen = set()
+        for path, stat in self._walk():
+            seen.add(path)
+            key = file_key(stat)
+            with self._lock:
+                if path in self._in_flight:
+                    continue
+            if not self.checkpoint.needs_upload(path, key):
+                self._pending.pop(path, None)
+                continue
+            previous = self._pending.get(path)
+            if previous is None or previous[0] != key:
+                # New, or still being written - start (or restart) the settle timer
+                self._pending[path] = (key, now)
+                if self.settle > 0:
+                    continue
+            elif now - previous[1] < self.settle:
+                continue
+            ready.append((path, key))
+            del self._pending[path]
+        # Forget files that disappeared before they settled
+        for path in list(self._pending):
+            if path not in seen:
+                del self._pending[path]
+        return ready
+
+    def object_filename(self, path):
+        """Name of a file in the bucket: its path below the watched directory
+
+        Files with the same name in different subfolders don't overwrite each
+        other. With several watched directories, the directory's own name is
+        put in front.
+        """
+        root = max((directory for directory in self.directories
+                    if path.startswith(directory + os.sep)), key=len)
+        name = os.path.relpath(path, root)
+        if len(self.directories) > 1:
+            name = os.path.join(os.path.basename(root), name)
+        return name.replace(os.sep, '/')
+
+    def _upload(self, path, key):
+        try:
+            filename = self.object_filename(path)
+            with upload_to_b2.mapped_file(path) as image_data:
+                content_type = (sniff_content_type(image_data) or mimetypes.guess_type(filename)[0]
+                                or 'application/octet-stream')
+                result = upload_to_b2.upload_image(image_data, filename, content_type,
+                                                   self.profile, self.target_bytes, self.renditions,
+                                                   self.content_addressed)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        result['path'] = path
+        self.checkpoint.record(path, key, result)
+        self.checkpoint.save()
+        with self._lock:
+            self._in_flight.discard(path)
+        if self.on_result:
+            self.on_result(result)
+        return result
+
+    def submit_ready(self):
+        """Scan once and queue every ready file for upload; returns the futures"""
+        futures = []
+        ready = self.scan()
+        # The files found by one scan share a retry budget, like a batch
+        budget = batch_retry_budget(len(ready))
+        for path, key in ready:
+            with self._lock:
+                self._in_flight.add(path)
+            futures.append(self._executor.submit(run_with_budget, budget, self._upload, path, key))
+        return futures
+
+    def run(self, interval=DEFAULT_INTERVAL, once=False):
+        """Poll until stop() (or, with once=True, until everything present now is uploaded)"""
+        try:
+            while not self._stopped.is_set():
+                futures = self.submit_ready()
+                if once:
+                    for future in futures:
+                        future.result()
+                    # Files found still settling get one more look once they have had time to settle
+                    if not self._pending:
+                        break
+                    self._stopped.wait(self.settle)
+                    continue
+                self.checkpoint.save()
+                self._stopped.wait(interval)
+        finally:
+            self._executor.shutdown(wait=True)
+            self.checkpoint.save(force=True)
+
+    def stop(self):
+        """Make run() return after the uploads in flight have finished"""
+        self._stopped.set()
+
+def main(argv=None):
+    """Command line entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Watch folders and upload new images to Backblaze B2")
+    parser.add_argument('directories', nargs='+', help="directories to watch")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between scans")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE,
+                        help="seconds a file's size and mtime must stay unchanged before upload")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help="uploads processed at once")
+    parser.add_argument('--checkpoint', default=WATCH_CHECKPOINT,
+                        help="checkpoint file of processed files")
+    parser.add_argument('--no-recursive', action='store_true',
+                        help="don't descend into subdirectories")
+    parser.add_argument('--profile', choices=sorted(upload_to_b2.ENCODE_PROFILES),
+                        help="encode profile")
+    parser.add_argument('--renditions',
+                        help="rendition sizes, comma separated (e.g. 1920,960,480,240)")
+    parser.add_argument('--content-addressed', action='store_true',
+                        help="name objects by content hash and mark them immutable for caching")
+    parser.add_argument('--once', action='store_true',
+                        help="upload what is there now, then exit")
+    args = parser.parse_args(argv)
+
+    missing = [directory for directory in args.directories if not os.path.isdir(directory)]
+    if missing:
+        parser.error(f"not a directory: {', '.join(missing)}")
+
+    write_lock = threading.Lock()
+
+    def report(result):
+        # One JSON line per processed file
+        with write_lock:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+
+    try:
+        watcher = FolderWatcher(
+            args.directories,
+            checkpoint=WatchCheckpoint(args.checkpoint),
+            settle=args.settle,
+            concurrency=args.concurrency,
+            recursive=not args.no_recursive,
+            profile=args.profile,
+            renditions=args.renditions.split(',') if args.renditions else None,
+            content_addressed=args.content_addressed or None,
+            on_result=report
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Watching {', '.join(watcher.directories)}", file=sys.stderr)
+    upload_to_b2.warm_up()
+    try:
+        watcher.run(args.interval, once=args.once)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+if __name__ == "__main__":
+    main()